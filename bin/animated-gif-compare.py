@@ -8,21 +8,13 @@ from multiprocessing import Pool
 import os
 
 import h5py
+import numpy as np
+
+from species_distribution import render
 
 
 def process_taxon(gif_name, grids):
-    import matplotlib.pyplot as plt
-    from matplotlib import animation
-
-    def animate(nframe):
-        plt.cla()
-        plt.imshow(grids[nframe])
-        plt.title(nframe)
-
-    fig = plt.figure(figsize=(10, 8))
-    anim = animation.FuncAnimation(fig, animate, frames=2)
-    anim.save(gif_name, writer='imagemagick', fps=2)
-    plt.close()
+    render.render_gif([np.ma.masked_invalid(g) for g in grids], gif_name)
     print("wrote {}".format(gif_name))
 
 archive = h5py.File('archive-species-distribution.hdf5', 'r')
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+""" dev tool timing distribution.combine_probability_matrices against the
+masked array reduce it replaced, on random filter outputs over windows of
+several sizes.  Checks both give the same distribution """
+
+import argparse
+import functools
+import operator
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from species_distribution.arena import ARENA
+from species_distribution.distribution import combine_probability_matrices
+from species_distribution.window import Window
+
+SHAPE = (360, 720)
+
+
+def reduce_combine(matrices, window, scale):
+    """ the combine step as it was, a masked array per operation """
+    distribution = functools.reduce(operator.mul, [window.crop(m) for m in matrices])
+    distribution = distribution / distribution.sum()
+    distribution = window.embed(distribution, np.ma.MaskedArray(data=np.zeros(SHAPE), mask=True))
+    distribution *= scale
+    return distribution
+
+
+def fused_combine(matrices, window, scale):
+    with ARENA.scope():
+        return combine_probability_matrices(
+            matrices,
+            window=window,
+            scale=scale,
+            out=np.ma.MaskedArray(data=np.zeros(SHAPE), mask=True)
+        )
+
+
+def random_matrices(n, rng):
+    return [
+        np.ma.MaskedArray(data=rng.random(SHAPE), mask=rng.random(SHAPE) < .2)
+        for _ in range(n)
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--matrices', type=int, default=6, help='filter outputs combined')
+    parser.add_argument('-r', '--repeat', type=int, default=20, help='timed runs per window')
+    parser.add_argument('-w', '--window', type=int, action='append',
+                        help='rows of a square-ish window to time, can specify multiple -w options')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    matrices = random_matrices(args.matrices, rng)
+    scale = rng.random(SHAPE)
+
+    for rows in args.window or (20, 90, 360):
+        window = Window(SHAPE, 0, rows, 0, min(rows * 2, SHAPE[1]))
+
+        old = reduce_combine(matrices, window, scale)
+        new = fused_combine(matrices, window, scale)
+        same = (
+            np.array_equal(np.ma.getmaskarray(old), np.ma.getmaskarray(new))
+            and np.array_equal(old.compressed(), new.compressed())
+        )
+
+        times = [
+            timeit.timeit(lambda: f(matrices, window, scale), number=args.repeat) / args.repeat
+            for f in (reduce_combine, fused_combine)
+        ]
+        print('window {}x{}: reduce {:.2f}ms, fused {:.2f}ms, {:.1f}x, identical: {}'.format(
+            *window.shape, times[0] * 1000, times[1] * 1000, times[0] / times[1], same))
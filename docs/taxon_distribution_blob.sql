@@ -0,0 +1,56 @@
+-- taxon_distribution_blob, written with STORAGE "blob" in .settings.json,
+-- one row per taxon holding its distribution as a blob, see
+-- species_distribution/blob.py for the format
+
+CREATE TABLE IF NOT EXISTS distribution.taxon_distribution_blob (
+    taxon_key int PRIMARY KEY,
+    version smallint NOT NULL,
+    cell_count int NOT NULL,
+    data bytea NOT NULL
+);
+
+-- the blob is already compressed
+ALTER TABLE distribution.taxon_distribution_blob ALTER COLUMN data SET STORAGE EXTERNAL;
+
+
+-- optional, expands blobs into the rows of taxon_distribution for SQL
+-- consumers.  Needs the plpython3u extension:
+--     CREATE EXTENSION plpython3u;
+
+CREATE OR REPLACE FUNCTION distribution.taxon_distribution_blob_cells(data bytea)
+RETURNS TABLE (cell_id int, relative_abundance real)
+LANGUAGE plpython3u IMMUTABLE STRICT AS $$
+import struct
+import zlib
+
+magic, version, flags, rows, columns, cells, runs = struct.unpack_from('<2sBBHHII', data)
+if magic != b'SD' or version != 1:
+    plpy.error('unsupported distribution blob')
+
+body = data[16:]
+if flags & 1:
+    body = zlib.decompress(body)
+
+gaps = struct.unpack_from('<{}I'.format(runs), body, 0)
+lengths = struct.unpack_from('<{}I'.format(runs), body, 4 * runs)
+values = struct.unpack_from('<{}f'.format(cells), body, 8 * runs)
+
+index = 0
+n = 0
+for gap, length in zip(gaps, lengths):
+    index += gap
+    for cell in range(index, index + length):
+        yield (cell + 1, values[n])
+        n += 1
+    index += length
+$$;
+
+CREATE OR REPLACE VIEW distribution.v_taxon_distribution_blob AS
+ SELECT b.taxon_key,
+    c.cell_id,
+    c.relative_abundance
+   FROM distribution.taxon_distribution_blob b,
+     LATERAL distribution.taxon_distribution_blob_cells(b.data) c;
+
+grant all privileges on taxon_distribution_blob to sau_int;
+grant all privileges on v_taxon_distribution_blob to sau_int;
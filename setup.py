@@ -22,6 +22,8 @@ setup(
     packages=find_packages(),
     install_requires=['Cython', 'six', 'unittest2', 'numpy', 'psycopg2', 'python-dateutil', 'SQLAlchemy', 'pyproj', 'matplotlib', 'pillow'],
     scripts=[
+        'bin/distribution-diff',
+        'bin/distribution-tiles',
         'bin/h5-to-database',
         'bin/h5-to-png',
         'bin/species-distribution'
@@ -0,0 +1,121 @@
+""" Reusable work buffers for the filters
+
+Every filter starts from a fresh 360x720 masked grid, and the habitat
+filter allocates high resolution scratch grids of up to 3600x7200 per
+habitat, so a worker allocates and frees hundreds of megabytes per taxon.
+Within a taxon's scope the arena hands out buffers from a free list
+instead, and takes them all back when the scope ends.  Buffers are kept
+up to max_bytes between taxa, so a worker's memory stays flat:
+
+    with ARENA.scope():
+        grid = ARENA.masked(shape)
+        ...
+
+Scratch buffers which are done with before the scope ends go back to
+the free list early with release, so the next user, such as the next
+habitat of the taxon, reuses them:
+
+        data = ARENA.zeros(shape)
+        ...
+        ARENA.release(data)
+
+Outside a scope the arena allocates plain new arrays.  Nothing handed
+out in a scope may be used after it ends, or after it's released, so
+results leaving a scope must be copies.
+"""
+
+from contextlib import contextmanager
+import threading
+
+import numpy as np
+
+# bytes of free buffers kept between scopes
+MAX_BYTES = 512 * 2 ** 20
+
+
+class Arena():
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.free = []
+        self.lent = []
+        self.active = False
+        self.allocations = 0
+        self.reuses = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def scope(self):
+        """ buffers handed out in the scope are reclaimed when it ends """
+        self.active = True
+        try:
+            yield self
+        finally:
+            self.active = False
+            self.reclaim()
+
+    def _take(self, nbytes):
+        with self.lock:
+            # best fit, the smallest free buffer large enough
+            fits = [b for b in self.free if b.nbytes >= nbytes]
+            if fits:
+                buffer = min(fits, key=lambda b: b.nbytes)
+                self.free = [b for b in self.free if b is not buffer]
+                self.reuses += 1
+            else:
+                buffer = np.empty(nbytes, dtype=np.uint8)
+                self.allocations += 1
+            self.lent.append(buffer)
+        return buffer
+
+    def empty(self, shape, dtype=float):
+        """ an uninitialized array """
+        if not self.active:
+            return np.empty(shape, dtype=dtype)
+
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._take(nbytes)[:nbytes].view(dtype).reshape(shape)
+
+    def zeros(self, shape, dtype=float):
+        a = self.empty(shape, dtype)
+        a.fill(0)
+        return a
+
+    def masked(self, shape):
+        """ a float masked array of zeros, fully masked """
+        mask = self.empty(shape, dtype=bool)
+        mask.fill(True)
+        return np.ma.MaskedArray(data=self.zeros(shape), mask=mask, copy=False)
+
+    def release(self, *arrays):
+        """ takes back the buffers of arrays handed out in the scope before it
+        ends.  Arrays the arena didn't hand out are left alone """
+        with self.lock:
+            for a in arrays:
+                # the buffer is the base of the view handed out
+                while a is not None and not any(a is b for b in self.lent):
+                    a = a.base
+                if a is not None:
+                    self.lent = [b for b in self.lent if b is not a]
+                    self.free.append(a)
+
+    def reclaim(self):
+        """ takes back every buffer handed out, keeping the largest up to max_bytes """
+        with self.lock:
+            buffers = sorted(self.free + self.lent, key=lambda b: b.nbytes, reverse=True)
+            self.free = []
+            self.lent = []
+            kept = 0
+            for buffer in buffers:
+                if kept + buffer.nbytes <= self.max_bytes:
+                    self.free.append(buffer)
+                    kept += buffer.nbytes
+
+    def report(self):
+        return '{} buffers {:.1f}MB, {} allocations {} reuses'.format(
+            len(self.free), sum(b.nbytes for b in self.free) / 2 ** 20, self.allocations, self.reuses)
+
+
+# the arena of this process
+ARENA = Arena()
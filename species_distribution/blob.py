@@ -0,0 +1,101 @@
+""" Compact per-taxon storage of distributions
+
+taxon_distribution keeps a row per cell, 100k rows for a wide ranging
+taxon.  A blob holds a whole distribution for one row of
+taxon_distribution_blob: a header, then the cells as runs of consecutive
+flat grid indexes, delta encoded, and their float32 values, zlib
+compressed.  Row major runs are long, a range is mostly bands of whole
+rows, so the indexes take a few bytes per row of the range.
+
+    header   magic 'SD', version, flags, rows, columns, cells, runs
+             little endian '<2sBBHHII'
+    body     runs uint32 gaps to the previous run's end (or 0)
+             runs uint32 lengths
+             cells float32 values
+             zlib compressed with flags & COMPRESSED
+
+docs/taxon_distribution_blob.sql creates the table and a view expanding
+blobs into taxon_distribution's rows for SQL consumers.
+"""
+
+from collections import namedtuple
+import struct
+import zlib
+
+import numpy as np
+
+from . import sparse
+
+MAGIC = b'SD'
+VERSION = 1
+COMPRESSED = 1
+
+HEADER = struct.Struct('<2sBBHHII')
+
+Header = namedtuple('Header', ['version', 'flags', 'shape', 'cells', 'runs'])
+
+
+def read_header(data):
+    """ returns the Header of blob data, raises ValueError if it isn't a blob
+    of a supported version """
+
+    if len(data) < HEADER.size:
+        raise ValueError('truncated distribution blob')
+
+    magic, version, flags, rows, columns, cells, runs = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a distribution blob')
+    if version != VERSION:
+        raise ValueError('unsupported distribution blob version {}'.format(version))
+    return Header(version, flags, (rows, columns), cells, runs)
+
+
+def encode(matrix, compress=True):
+    """ returns the blob of the cells of the masked array matrix which
+    save_database would write, the unmasked cells which aren't NaN """
+
+    data = np.ma.getdata(matrix)
+    indexes = np.flatnonzero(~(np.ma.getmaskarray(matrix) | np.isnan(data)))
+    values = data.ravel()[indexes].astype('<f4')
+
+    # runs of consecutive indexes, and the gaps between them
+    starts = indexes[np.diff(indexes, prepend=-2) != 1]
+    ends = indexes[np.diff(indexes, append=-1) != 1] + 1
+    gaps = starts - np.concatenate([[0], ends])[:-1]
+    lengths = ends - starts
+
+    body = gaps.astype('<u4').tobytes() + lengths.astype('<u4').tobytes() + values.tobytes()
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= COMPRESSED
+
+    rows, columns = matrix.shape
+    return HEADER.pack(MAGIC, VERSION, flags, rows, columns, len(indexes), len(starts)) + body
+
+
+def decode_cells(data):
+    """ returns (shape, indexes, values) of blob data, the payload format of
+    sparse.unpack, with int32 flat indexes and float32 values """
+
+    header = read_header(data)
+    body = memoryview(data)[HEADER.size:]
+    if header.flags & COMPRESSED:
+        body = zlib.decompress(body)
+
+    runs, cells = header.runs, header.cells
+    gaps = np.frombuffer(body, dtype='<u4', count=runs).astype(np.int64)
+    lengths = np.frombuffer(body, dtype='<u4', count=runs, offset=4 * runs).astype(np.int64)
+    values = np.frombuffer(body, dtype='<f4', count=cells, offset=8 * runs)
+
+    # undo the deltas, then expand each run's start into its indexes
+    offsets = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+    starts = np.cumsum(gaps) + offsets
+    indexes = np.repeat(starts - offsets, lengths) + np.arange(cells)
+
+    return header.shape, indexes.astype(np.int32), values.astype(np.float32)
+
+
+def decode(data):
+    """ returns the masked array of blob data, cells not in it are masked """
+    return sparse.unpack(decode_cells(data))
@@ -0,0 +1,166 @@
+""" Bounded, observable caches
+
+Caches are named, bounded by entries and by an estimate of the bytes they
+hold, and evict least recently used entries first.  Each has a scope:
+RUN caches hold world data useful to every taxon, TAXON caches hold data
+of the taxon being distributed and are cleared when the next one starts.
+Hit, miss and eviction counters of every cache are kept for the run
+report:
+
+    @cached('kernel', max_bytes=64 * 2 ** 20)
+    def kernel(r1, r2):
+        ...
+
+    cache.clear(cache.TAXON)
+    logger.info(cache.report())
+"""
+
+from collections import OrderedDict
+import functools
+import sys
+import threading
+
+import numpy as np
+
+RUN = 'run'
+TAXON = 'taxon'
+
+# name: Cache
+CACHES = {}
+
+
+def nbytes(value):
+    """ estimated memory held by value """
+    if isinstance(value, np.ma.MaskedArray):
+        return value.data.nbytes + np.ma.getmaskarray(value).nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class Cache():
+
+    def __init__(self, name, max_entries=None, max_bytes=None, scope=RUN):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.scope = scope
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, size = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # would evict everything else and still not fit
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+
+            while (
+                (self.max_entries is not None and len(self.entries) > self.max_entries)
+                or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def reserve(self, entries):
+        """ raises max_entries to at least entries """
+        with self.lock:
+            if self.max_entries is not None and self.max_entries < entries:
+                self.max_entries = entries
+
+    def discard(self, key):
+        """ removes key if it is cached """
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def get_cache(name, max_entries=None, max_bytes=None, scope=RUN):
+    """ returns the cache called name, creating it with the given bounds """
+    if name not in CACHES:
+        CACHES[name] = Cache(name, max_entries, max_bytes, scope)
+    return CACHES[name]
+
+
+_missing = object()
+
+
+def cached(name, max_entries=None, max_bytes=None, scope=RUN, key=None):
+    """ decorator caching the results of a function in the cache called name.
+    Results are keyed on the arguments, or key(*args, **kwargs) if given, which
+    lets methods leave self out of the key and several functions share a cache """
+
+    def decorator(f):
+        cache = get_cache(name, max_entries, max_bytes, scope)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            value = cache.get(k, _missing)
+            if value is _missing:
+                value = f(*args, **kwargs)
+                cache.put(k, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def clear(scope=None):
+    """ clears every cache of scope, or every cache """
+    for cache in CACHES.values():
+        if scope is None or cache.scope == scope:
+            cache.clear()
+
+
+def stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def report():
+    """ one line summary of every cache for the run log """
+    return '; '.join(
+        '{} {entries} entries {mb:.1f}MB, {hits} hits {misses} misses {evictions} evictions'.format(
+            name, mb=s['bytes'] / 2 ** 20, **s)
+        for name, s in sorted(stats().items())
+    )
@@ -0,0 +1,311 @@
+""" Coordinator and workers for distributing taxa across several hosts
+
+The coordinator serves taxon keys and a queue of reports over TCP with
+multiprocessing.managers.  Workers on any host connect to it, pull taxon
+keys until there are none left, distribute and save each taxon to the
+database themselves, and report its state back:
+
+    coordinator$ bin/species-distribution --coordinator 0.0.0.0:50000
+    worker$ bin/species-distribution --worker coordinator-host:50000 -p 8
+
+A taxon is leased to the worker it is served to, which renews the lease
+with heartbeats while it distributes the taxon, at an interval fitting the
+coordinator's lease.  When a worker dies, even before reporting the taxon
+running, its lease expires and the taxon is served again, up to CLUSTER
+retries times before it is recorded as failed.  Workers wait for requeued
+taxa until the coordinator is done.
+
+Connections are authenticated with settings.CLUSTER['authkey'], which has
+no default: managers unpickle what clients send, so anyone holding the key
+can run code on the coordinator.
+"""
+
+from collections import deque
+import logging
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+import queue
+import threading
+import time
+
+from species_distribution import settings
+from species_distribution.ledger import worker_id, QUEUED, RUNNING, SAVED, FAILED
+
+logger = logging.getLogger(__name__)
+
+
+class QueueManager(BaseManager):
+    pass
+
+QueueManager.register('tasks')
+QueueManager.register('reports')
+QueueManager.register('done')
+
+
+def parse_address(address):
+    """ 'host:port' -> (host, port) """
+    host, _, port = address.rpartition(':')
+    return host, int(port or settings.CLUSTER['port'])
+
+
+def _authkey(authkey):
+    authkey = authkey or settings.CLUSTER.get('authkey')
+    if not authkey:
+        raise ValueError('coordinator and workers need a shared secret, set CLUSTER authkey in .settings.json')
+    return authkey.encode()
+
+
+def _lease():
+    """ seconds a taxon served is leased to its worker """
+    return settings.CLUSTER.get('lease', 600)
+
+
+class Leases():
+    """ the taxa of a coordinator, each leased to the worker it is served to
+    for duration seconds.  Workers call serve and lease through a proxy """
+
+    def __init__(self, taxon_keys, duration):
+        self.queue = deque(taxon_keys)
+        self.duration = duration
+        # taxon_key: (worker, time its lease expires)
+        self.leased = {}
+        self.lock = threading.Lock()
+
+    def serve(self, worker):
+        """ returns the next taxon key, leased to worker, or None if there is none now """
+        with self.lock:
+            if not self.queue:
+                return None
+            taxon_key = self.queue.popleft()
+            self.leased[taxon_key] = (worker, time.monotonic() + self.duration)
+            return taxon_key
+
+    def lease(self):
+        """ seconds a taxon is leased for, workers send heartbeats well within it """
+        return self.duration
+
+    def renew(self, taxon_key, worker):
+        """ extends the lease of taxon_key, unless it expired """
+        with self.lock:
+            if taxon_key in self.leased:
+                self.leased[taxon_key] = (worker, time.monotonic() + self.duration)
+
+    def release(self, taxon_key):
+        """ forgets taxon_key, which finished """
+        with self.lock:
+            self.leased.pop(taxon_key, None)
+            if taxon_key in self.queue:
+                self.queue.remove(taxon_key)
+
+    def expired(self):
+        """ removes and returns (taxon_key, worker) of the expired leases """
+        with self.lock:
+            now = time.monotonic()
+            lost = [(key, worker) for key, (worker, expires) in self.leased.items() if expires <= now]
+            for key, _ in lost:
+                del self.leased[key]
+            return lost
+
+    def requeue(self, taxon_key):
+        with self.lock:
+            self.queue.append(taxon_key)
+
+
+class Coordinator():
+    """ serves taxon_keys to workers in a background thread, leased for lease
+    seconds, collecting their reports on the reports queue """
+
+    def __init__(self, taxon_keys, address, authkey=None, lease=None):
+        self.tasks = Leases(taxon_keys, lease or _lease())
+        self.reports = queue.Queue()
+        # set when no more taxa will be served, workers waiting for requeued ones quit
+        self.done = threading.Event()
+
+        # registering on a subclass keeps the server side callables out of
+        # QueueManager, which workers use to connect
+        class Server(QueueManager):
+            pass
+        Server.register('tasks', callable=lambda: self.tasks, exposed=('serve', 'lease'))
+        Server.register('reports', callable=lambda: self.reports)
+        Server.register('done', callable=lambda: self.done)
+
+        self.server = Server(address=address, authkey=_authkey(authkey)).get_server()
+        self.address = self.server.address
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        logger.info('coordinator serving {} taxa on {}:{}'.format(len(taxon_keys), *self.address))
+
+    def _serve(self):
+        try:
+            self.server.serve_forever()
+        except SystemExit:
+            # serve_forever always ends with sys.exit, meant for a server process
+            pass
+
+    def close(self):
+        self.done.set()
+        self.server.stop_event.set()
+        self.server.listener.close()
+
+
+def coordinate(taxon_keys, address, authkey=None, ledger=None, stop=lambda: False, lease=None, retries=None):
+    """ serves taxon_keys to workers until every taxon was reported finished or
+    stop() returns True.  Reports are recorded in ledger if given.  A running
+    taxon without a report for lease seconds is served again, at most retries
+    times, then failed.  Returns a dict of taxon_key: final state """
+
+    retries = settings.CLUSTER.get('retries', 2) if retries is None else retries
+
+    # each taxon is served once, however often it is listed
+    taxon_keys = list(dict.fromkeys(taxon_keys))
+    coordinator = Coordinator(taxon_keys, address, authkey, lease)
+    leases = coordinator.tasks
+    finished = {}
+    # taxa reported running since they were last served
+    running = set()
+    attempts = {}
+    try:
+        while len(finished) < len(taxon_keys) and not stop():
+            for taxon_key, worker in leases.expired():
+                running.discard(taxon_key)
+                attempts[taxon_key] = attempts.get(taxon_key, 0) + 1
+                if attempts[taxon_key] <= retries:
+                    logger.warning('lost taxon {} on {}, serving it again'.format(taxon_key, worker))
+                    leases.requeue(taxon_key)
+                    if ledger:
+                        ledger.mark(taxon_key, QUEUED)
+                else:
+                    message = 'lost on {} after {} attempts'.format(worker, attempts[taxon_key])
+                    logger.error('taxon {} {}'.format(taxon_key, message))
+                    finished[taxon_key] = FAILED
+                    if ledger:
+                        ledger.mark(taxon_key, FAILED, message, worker=worker)
+
+            try:
+                taxon_key, state, worker, message = coordinator.reports.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if taxon_key in finished:
+                # a late report of a taxon given up on, or finished by another worker
+                continue
+
+            if state == RUNNING:
+                if taxon_key not in running:
+                    logger.debug('taxon {} started on {}'.format(taxon_key, worker))
+                    running.add(taxon_key)
+                    if ledger:
+                        ledger.mark(taxon_key, state, message, worker=worker)
+                leases.renew(taxon_key, worker)
+                continue
+
+            running.discard(taxon_key)
+            leases.release(taxon_key)
+            if ledger:
+                ledger.mark(taxon_key, state, message, worker=worker)
+
+            finished[taxon_key] = state
+            logger.info('taxon {} {} on {} [{}/{}]'.format(taxon_key, state, worker, len(finished), len(taxon_keys)))
+    finally:
+        coordinator.close()
+
+    return finished
+
+
+def connect(address, authkey=None):
+    """ returns the (tasks, reports, done) proxies of the coordinator at address """
+    manager = QueueManager(address=address, authkey=_authkey(authkey))
+    manager.connect()
+    return manager.tasks(), manager.reports(), manager.done()
+
+
+class Heartbeat():
+    """ reports taxon_key running every interval seconds in a background
+    thread, renewing its lease, until stopped """
+
+    def __init__(self, address, authkey, taxon_key, interval):
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, args=(address, authkey, taxon_key, interval), daemon=True)
+        self.thread.start()
+
+    def _beat(self, address, authkey, taxon_key, interval):
+        # taxa done within the interval never connect
+        if self.stopped.wait(interval):
+            return
+        try:
+            # proxies aren't shared between threads, the heartbeat has its own
+            _, reports, _ = connect(address, authkey)
+            while not self.stopped.is_set():
+                reports.put((taxon_key, RUNNING, worker_id(), None))
+                self.stopped.wait(interval)
+        except (EOFError, OSError):
+            logger.warning('lost the coordinator, taxon {} can\'t renew its lease'.format(taxon_key))
+
+    def stop(self):
+        """ stops the heartbeat without waiting for it, the coordinator ignores
+        a late beat of a finished taxon """
+        self.stopped.set()
+
+
+def _next_taxon(tasks, done):
+    """ returns the next taxon key served, waiting for taxa of lost workers to
+    be served again until the coordinator is done, then None """
+    while True:
+        taxon_key = tasks.serve(worker_id())
+        if taxon_key is not None:
+            return taxon_key
+        if done.wait(1):
+            return None
+
+
+def work(address, authkey=None, distribute=None, save=None):
+    """ pulls taxon keys from the coordinator at address until it is done,
+    distributing and saving each one.  Returns the number of taxa done """
+
+    if distribute is None or save is None:
+        from species_distribution import distribution
+        distribute = distribute or distribution.create_taxon_distribution
+        save = save or distribution.save_database
+
+    tasks, reports, done = connect(address, authkey)
+    # heartbeats well within the coordinator's lease
+    interval = tasks.lease() / 4
+    count = 0
+    while True:
+        try:
+            taxon_key = _next_taxon(tasks, done)
+        except (EOFError, OSError):
+            # the coordinator closed after the last report
+            break
+        if taxon_key is None:
+            break
+
+        reports.put((taxon_key, RUNNING, worker_id(), None))
+        heartbeat = Heartbeat(address, authkey, taxon_key, interval)
+        try:
+            _, matrix = distribute(taxon_key)
+            save(taxon_key, matrix)
+            report = (taxon_key, SAVED, worker_id(), None)
+        except Exception as e:
+            logger.exception('taxon {} failed'.format(taxon_key))
+            report = (taxon_key, FAILED, worker_id(), str(e))
+        finally:
+            heartbeat.stop()
+        reports.put(report)
+        count += 1
+
+    logger.info('worker {} done, {} taxa'.format(worker_id(), count))
+    return count
+
+
+def run_workers(address, processes=1, authkey=None, save=None):
+    """ runs processes workers connected to the coordinator at address, see work """
+
+    if processes == 1:
+        return work(address, authkey, save=save)
+
+    workers = [Process(target=work, args=(address, authkey), kwargs={'save': save}) for _ in range(processes)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
@@ -0,0 +1,162 @@
+""" Numerical comparison of two sets of distributions
+
+Each side is a source of distributions: a database table, an hdf5 file
+or a snapshot directory of .npz grids such as a ledger spool.  Sources
+return a taxon's distribution as its cells in cell order, flat indexes and
+values, the way taxon_distribution stores them, so both sides are merged
+in one pass.  Taxa are compared in parallel and each yields its L1 and
+L-infinity distance and the cells entering or leaving its support.
+"""
+
+import logging
+from multiprocessing import Pool
+import os
+import re
+
+import numpy as np
+
+from . import sparse
+
+logger = logging.getLogger(__name__)
+
+# upper edges of the summary histogram's L1 bins, the first bin is identical
+HISTOGRAM_BINS = (0, 1e-12, 1e-9, 1e-6, 1e-3, 1e-1, np.inf)
+
+
+def _cells(matrix):
+    """ sorted (indexes, values) of the unmasked, non NaN cells of matrix """
+    if matrix is None:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    _, indexes, values = sparse.pack(matrix)
+    valid = ~np.isnan(values)
+    return indexes[valid].astype(np.int64), values[valid]
+
+
+class DatabaseSource():
+
+    def __init__(self, table='taxon_distribution'):
+        if not re.match(r'^[\w.]+$', table):
+            raise ValueError('invalid table name {}'.format(table))
+        self.table = table
+
+    def __str__(self):
+        return 'database:' + self.table
+
+    def taxa(self):
+        from .models.db import Session
+        with Session() as session:
+            result = session.execute('SELECT DISTINCT taxon_key FROM {}'.format(self.table))
+            return sorted(row[0] for row in result)
+
+    def cells(self, taxon_key):
+        from . import sd_io as io
+        return _cells(io.load_distribution(taxon_key, table=self.table))
+
+
+class HDF5Source():
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __str__(self):
+        return self.fname
+
+    def taxa(self):
+        import h5py
+        with h5py.File(self.fname, 'r') as f:
+            return sorted(int(k) for k in f['taxa'].keys())
+
+    def cells(self, taxon_key):
+        import h5py
+        with h5py.File(self.fname, 'r') as f:
+            key = 'taxa/' + str(taxon_key)
+            if key not in f:
+                return _cells(None)
+            return _cells(np.ma.masked_invalid(f[key][:]))
+
+
+class SnapshotSource():
+    """ a directory of {taxon_key}.npz files with data and mask arrays """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __str__(self):
+        return self.directory
+
+    def taxa(self):
+        names = (os.path.splitext(name) for name in os.listdir(self.directory))
+        return sorted(int(stem) for stem, ext in names if ext == '.npz' and stem.isdigit())
+
+    def cells(self, taxon_key):
+        fname = os.path.join(self.directory, '{}.npz'.format(taxon_key))
+        if not os.path.isfile(fname):
+            return _cells(None)
+        with np.load(fname) as f:
+            return _cells(np.ma.MaskedArray(data=f['data'], mask=f['mask']))
+
+
+def source(spec):
+    """ returns the source described by spec: 'database' or 'database:TABLE',
+    a directory of snapshots, or an hdf5 file """
+
+    if spec == 'database' or spec.startswith('database:'):
+        return DatabaseSource(*spec.split(':')[1:])
+    if os.path.isdir(spec):
+        return SnapshotSource(spec)
+    return HDF5Source(spec)
+
+
+def compare(a, b):
+    """ compares the (indexes, values) cells of two distributions, returns a
+    dict of their L1 and L-infinity distances, the cell counts of each side
+    and of the cells only present on one side """
+
+    indexes_a, values_a = a
+    indexes_b, values_b = b
+
+    # merge both sides in cell order, cells missing on one side are 0 there
+    cells = np.union1d(indexes_a, indexes_b)
+    dense_a = np.zeros(len(cells))
+    dense_b = np.zeros(len(cells))
+    dense_a[np.searchsorted(cells, indexes_a)] = values_a
+    dense_b[np.searchsorted(cells, indexes_b)] = values_b
+    difference = np.abs(dense_a - dense_b)
+
+    return {
+        'l1': float(difference.sum()),
+        'linf': float(difference.max()) if len(cells) else 0.0,
+        'cells_a': len(indexes_a),
+        'cells_b': len(indexes_b),
+        'removed': len(np.setdiff1d(indexes_a, indexes_b, assume_unique=True)),
+        'added': len(np.setdiff1d(indexes_b, indexes_a, assume_unique=True)),
+    }
+
+
+def _diff_taxon(args):
+    taxon_key, source_a, source_b = args
+    return taxon_key, compare(source_a.cells(taxon_key), source_b.cells(taxon_key))
+
+
+def diff_taxa(taxon_keys, source_a, source_b, processes=None):
+    """ compares taxon_keys between two sources in parallel, yields
+    (taxon_key, compare() result) as taxa complete """
+
+    tasks = ((key, source_a, source_b) for key in taxon_keys)
+    with Pool(processes=processes) as pool:
+        for result in pool.imap_unordered(_diff_taxon, tasks, chunksize=4):
+            yield result
+
+
+def changed(result, tolerance=0):
+    return result['linf'] > tolerance or result['added'] or result['removed']
+
+
+def histogram(results, bins=HISTOGRAM_BINS):
+    """ returns a list of (upper bin edge, number of taxa) of the L1 distances
+    of results, the first bin counting identical taxa """
+
+    l1 = np.array([r['l1'] for r in results])
+    counts = [int((l1 <= bins[0]).sum())]
+    counts += [int(((l1 > low) & (l1 <= high)).sum()) for low, high in zip(bins[:-1], bins[1:])]
+    return list(zip(bins, counts))
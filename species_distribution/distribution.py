@@ -1,70 +1,243 @@
 import functools
+import itertools
 import logging
-import operator
+
+import numpy as np
 
 from .models.db import Session
+from .models.taxa import Taxon, TaxonHabitat
 from .exceptions import InvalidTaxonException, NoPolygonException
+from . import cache
+from .arena import ARENA
 from . import filters
 from . import sd_io as io
 from . import settings
+from . import threads
 from .models.world import Grid
+from .prefetch import Prefetcher
+from .supervisor import report_stage
+from .window import Window
 
 logger = logging.getLogger(__name__)
 
 
-def combine_probability_matrices(matrices):
+def combine_probability_matrices(matrices, window=None, scale=None, out=None):
     """given a sequence of probability matrices, combine them into a
-    single matrix with sum 1.0 and return it"""
+    single matrix with sum 1.0 and return it.
+
+    Cells masked in any matrix are masked, as are cells whose normalized
+    value isn't finite.  Only the window of the grids is combined if given,
+    and the normalized matrix is multiplied by the grid scale if given.
+    The product is accumulated in place in arena buffers, and the result
+    written into out, a masked array left masked outside the window, if
+    given"""
+
+    shape = np.shape(matrices[0])
+    if window is None:
+        window = Window.full(shape)
+    if out is None:
+        out = np.ma.MaskedArray(data=np.zeros(shape), mask=True)
+
+    product = window.crop(np.ma.getdata(matrices[0]), out=ARENA.empty(window.shape))
+    mask = window.crop(np.ma.getmaskarray(matrices[0]), out=ARENA.empty(window.shape, dtype=bool))
+    values = ARENA.empty(window.shape)
+    masked = ARENA.empty(window.shape, dtype=bool)
+
+    # masked array arithmetic ignores floating point errors, so does this
+    with np.errstate(all='ignore'):
+        for matrix in matrices[1:]:
+            np.multiply(product, window.crop(np.ma.getdata(matrix), out=values), out=product)
+            np.logical_or(mask, window.crop(np.ma.getmaskarray(matrix), out=masked), out=mask)
+
+        if mask.all():
+            return out
+
+        # normalize by the sum of the unmasked cells
+        np.copyto(values, product)
+        np.copyto(values, 0, where=mask)
+        total = values.sum()
+
+        # np.ma.divide masks cells where total is 0 relative to the product.
+        # Probabilities are at most 1, so that only happens when total is
+        if abs(total) <= np.finfo(float).tiny:
+            np.greater_equal(np.abs(product) * np.finfo(float).tiny, abs(total), out=masked)
+            mask |= masked
+
+        np.divide(product, total, out=product)
+        np.isfinite(product, out=masked)
+        np.logical_or(mask, ~masked, out=mask)
+
+    if scale is not None:
+        np.multiply(product, window.crop(scale, out=values), out=product)
+
+    return window.embed(np.ma.MaskedArray(data=product, mask=mask, copy=False), out)
+
+
+FILTERS = (
+    filters.polygon,
+    filters.fao,
+    filters.latitude,
+    filters.depth,
+    filters.habitat,
+    filters.submergence
+)
+
+# world grids read by the filters, loaded once per process
+WORLD_LAYERS = (
+    'abyssal',
+    'area_coast',
+    'area_offshore',
+    'coastal_prop',
+    'coral',
+    'ele_avg',
+    'ele_min',
+    'estuary',
+    'front',
+    'percent_water',
+    'seamount',
+    'shelf',
+    'slope',
+    'total_area',
+)
+
+
+def _create_taxon_distribution(taxonkey, session, _filters):
+    """returns a distribution matrix for given taxon by applying instances of
+    filters in _filters, or None if the taxon can't be distributed"""
+
+    logger.info("working on taxon {}".format(taxonkey))
+    cache.clear(cache.TAXON)
+
+    # filter outputs live in arena buffers until the taxon is done, the
+    # returned distribution is a new array
+    with ARENA.scope():
+        try:
+            return _distribute(taxonkey, session, _filters)
+        except InvalidTaxonException as e:
+            logger.warning("Invalid taxon {}. Error: {}".format(taxonkey, str(e)))
+        except NoPolygonException as e:
+            logger.warning("No polygon exists for taxon {}".format(taxonkey))
+
+
+def _distribute(taxonkey, session, _filters):
+
+    # the session isn't safe to share between threads.  With the taxon's
+    # records loaded and referenced here, the filters' get() calls only
+    # read its identity map
+    taxon, taxon_habitat = (session.query(model).get(taxonkey) for model in (Taxon, TaxonHabitat))
+
+    def apply(f, support):
+        report_stage(type(f).name)
+        if f.uses_support:
+            return f.apply(session, taxon=taxon or taxonkey, support=support)
+        return f.apply(session, taxon=taxon or taxonkey)
+
+    # the product is masked wherever a non-empty filter output is, so the
+    # cells unmasked by every output so far are all later filters need.
+    # Filters of the same cost run together
+    outputs = {}
+    support = None
+    for cost, group in itertools.groupby(sorted(_filters, key=lambda f: f.cost), key=lambda f: f.cost):
+        group = list(group)
+        for f, m in zip(group, threads.map(functools.partial(apply, support=support), group)):
+            outputs[f] = m
+            if m is not None and m.count() > 0:
+                unmasked = ~np.ma.getmaskarray(m)
+                support = unmasked if support is None else support & unmasked
+
+        if support is not None and not support.any():
+            logger.debug('taxon {} has no cells left after the filters of cost {}'.format(taxonkey, cost))
+            return np.ma.MaskedArray(data=np.zeros(support.shape), mask=True)
+
+    matrices = [outputs[f] for f in _filters]
+
+    if settings.DEBUG:
+        for i, m in enumerate(matrices):
+            fname = '{}-{}-{}'.format(taxonkey, i, type(_filters[i]).name)
+            io.save_image(m, fname)
+
+    polygon_matrix = next(m for f, m in zip(_filters, matrices) if isinstance(f, filters.polygon))
+
+    matrices = list(filter(lambda x: x is not None and x.count() > 0, matrices))  # remove Nones
+
+    report_stage('combine')
+
+    # the product is masked outside the polygon, so only the window
+    # around it needs combining.  The distribution is the only new array,
+    # it outlives the arena scope
+    window = Window.around(~np.ma.getmaskarray(polygon_matrix))
+    water_percentage = np.divide(Grid().get_grid('percent_water'), 100, out=ARENA.empty(polygon_matrix.shape))
+    distribution_matrix = combine_probability_matrices(
+        matrices,
+        window=window,
+        scale=water_percentage,
+        out=np.ma.MaskedArray(data=np.zeros(polygon_matrix.shape), mask=True)
+    )
+
+    if settings.DEBUG:
+        io.save_image(combine_probability_matrices(matrices, window=window), taxonkey)
 
-    distribution = functools.reduce(operator.mul, matrices)
-    # normalize
-    return distribution / distribution.sum()
+    return distribution_matrix
 
 
 def create_taxon_distribution(taxonkey):
-    """returns a distribution matrix for given taxon taxon by applying filters"""
+    """returns (taxonkey, distribution matrix) for given taxon by applying filters.
+    matrix is None if the taxon can't be distributed"""
 
-    logger.info("working on taxon {}".format(taxonkey))
+    with Session() as session:
+        return (taxonkey, _create_taxon_distribution(taxonkey, session, [f() for f in FILTERS]))
 
-    _filters = (
-        filters.polygon,
-        filters.fao,
-        filters.latitude,
-        filters.depth,
-        filters.habitat,
-        filters.submergence
-    )
 
-    try:
-        with Session() as session:
-            matrices = [f.filter(session, taxon=taxonkey) for f in _filters]
+def prefetch_taxa(session, taxon_keys):
+    """loads the Taxon and TaxonHabitat records of taxon_keys into session with one
+    query each, so the filters' session.query(...).get() calls don't hit the database.
+    The returned records must be kept referenced while the session is in use"""
+
+    taxa = session.query(Taxon).filter(Taxon.taxon_key.in_(taxon_keys)).all()
+    habitats = session.query(TaxonHabitat).filter(TaxonHabitat.taxon_key.in_(taxon_keys)).all()
+    return taxa + habitats
+
+
+def create_taxon_distributions(taxon_keys, prefetch=0):
+    """generator yielding (taxon_key, distribution matrix) for each of taxon_keys.
+
+    One session, one set of filter instances, the prefetched taxon records and
+    the world layers are shared by the whole batch. matrix is None for taxa
+    which can't be distributed.  With prefetch, the polygon and FAO cells of
+    the next prefetch taxa are queried in the background"""
 
-        if settings.DEBUG:
-            for i, m in enumerate(matrices):
-                fname = '{}-{}-{}'.format(taxonkey, i, _filters[i].name)
-                io.save_image(m, fname)
+    taxon_keys = list(taxon_keys)
 
-        matrices = list(filter(lambda x: x is not None and x.count() > 0, matrices))  # remove Nones
-        distribution_matrix = combine_probability_matrices(matrices)
+    grid = Grid()
+    for layer in WORLD_LAYERS:
+        grid.get_grid(layer)
 
-        if settings.DEBUG:
-            io.save_image(distribution_matrix, taxonkey)
+    _filters = [f() for f in FILTERS]
 
-        water_percentage = Grid().get_grid('percent_water') / 100
-        distribution_matrix *= water_percentage
+    with Session() as session:
+        prefetched = prefetch_taxa(session, taxon_keys)
+        logger.debug('prefetched {} records for {} taxa'.format(len(prefetched), len(taxon_keys)))
 
-        return (taxonkey, distribution_matrix)
+        if prefetch:
+            taxon_keys = Prefetcher(taxon_keys, prefetch)
 
-    except InvalidTaxonException as e:
-        logger.warning("Invalid taxon {}. Error: {}".format(taxonkey, str(e)))
-    except NoPolygonException as e:
-        logger.warning("No polygon exists for taxon {}".format(taxonkey))
+        for taxonkey in taxon_keys:
+            yield taxonkey, _create_taxon_distribution(taxonkey, session, _filters)
 
 
-def save_database(taxon_key, matrix):
+def save_database(taxon_key, matrix, rebuild=None):
+    """saves matrix to taxon_distribution, or taxon_distribution_blob with
+    settings.STORAGE 'blob', or to the shadow table of rebuild, an
+    sd_io.Rebuild, if given"""
 
     if matrix is None or matrix.mask.all():
         logger.info("Calculated matrix for taxon {} was None or masked, not saving to DB".format(taxon_key))
+    elif rebuild:
+        logger.info('saving {} to {}'.format(taxon_key, rebuild.shadow))
+        rebuild.save(matrix, taxon_key)
+    elif settings.STORAGE == 'blob':
+        logger.info('saving {} to DB as a blob'.format(taxon_key))
+        io.save_blob(matrix, taxon_key)
     else:
         logger.info('saving {} to DB'.format(taxon_key))
         io.save_database(matrix, taxon_key)
@@ -6,6 +6,29 @@ from .filter import BaseFilter
 from species_distribution.models.taxa import TaxonHabitat
 
 
+def depth_probabilities(seafloor_depth, taxon_mindepth, taxon_maxdepth):
+    """ vectorized BaseFilter.depth_probability, for broadcastable arrays of
+    seafloor depths and taxon depth ranges
+
+    The triangular distribution is integrated in closed form rather than
+    with np.trapz, results agree to floating point precision
+    """
+
+    x = np.asarray(seafloor_depth, dtype=float)
+    a = np.asarray(taxon_maxdepth, dtype=float)
+    b = np.asarray(taxon_mindepth, dtype=float)
+    c = b - (b - a) / 3  # peak of the distribution, 1/3 down
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # fraction of the triangle's area shallower than x
+        below_peak = 1 - (x - a) ** 2 / ((c - a) * (b - a))
+        above_peak = (b - x) ** 2 / ((b - c) * (b - a))
+
+    probability = np.where(x <= c, below_peak, above_peak)
+    probability = np.where(x < a, 1.0, np.where(x > b, 0.0, probability))
+    return np.clip(probability, 0, 1)
+
+
 class Filter(BaseFilter):
     """ Depth Filter
 
@@ -17,6 +40,10 @@ class Filter(BaseFilter):
     This filter is skipped if the species is coastal (Offshore = 0)
     """
 
+    def input_key(self, taxon, session):
+        taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
+        return (taxon_habitat.min_depth, taxon_habitat.max_depth, taxon_habitat.offshore, taxon.pelagic)
+
     def _filter(self, taxon=None, session=None):
 
         taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
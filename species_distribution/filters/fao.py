@@ -1,10 +1,14 @@
 from species_distribution.filters.filter import BaseFilter
-from species_distribution.models.taxa import fao_cells_for_taxon
+from species_distribution.models.taxa import fao_cells_for_taxon, TaxonHabitat
 from species_distribution.models.world import Grid
 
 
 class Filter(BaseFilter):
 
+    def input_key(self, taxon, session):
+        taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
+        return tuple(sorted(set(taxon_habitat.faos)))
+
     def _filter(self, taxon=None, session=None):
 
         probability_matrix = self.get_probability_matrix()
@@ -1,12 +1,15 @@
-import functools
 import itertools
 import logging
 
 import numpy as np
 
+from species_distribution.arena import ARENA
+from species_distribution.cache import cached, TAXON
+from species_distribution import memo
 from species_distribution.models.db import Session
 from species_distribution.models.taxa import Taxon
 from species_distribution.models.world import Grid
+from species_distribution import settings
 from species_distribution.settings import NUMPY_WARNINGS
 
 
@@ -25,27 +28,68 @@ class BaseFilter(metaclass=MetaBaseFilter):
     taxon should be a taxon ID which will be converted to a Taxon object
     and the SQLAlchemy session will be passed in by filter
 
+    Filters whose output only depends on a few taxon attributes should
+    return them from input_key, so taxa sharing them share the output,
+    see memo.py
+
+    Filters are applied cheapest first, by cost.  Filters with uses_support
+    get a support keyword, a boolean grid of the cells the earlier filters
+    left unmasked, and only need to be right on those cells
+
     """
 
+    cost = 1
+    uses_support = False
+
     def __init__(self):
         self.grid = Grid()
         self.logger = logging.getLogger(__name__)
         np.seterrcall(self.logger.warn)
         np.seterr(all=NUMPY_WARNINGS)
-        self.probability_matrix = np.ma.MaskedArray(data=np.full(self.grid.shape, 0, dtype=float), mask=True)
 
     def get_probability_matrix(self):
-        return self.probability_matrix.copy()
+        """ returns a fully masked grid of zeros, taken from the arena """
+        return ARENA.masked(self.grid.shape)
+
+    def input_key(self, taxon, session):
+        """ returns a hashable key of everything the output for taxon depends
+        on, or None if it depends on the taxon itself """
+        return None
+
+    def _copy(self, matrix):
+        """ returns a copy of matrix in a grid from the arena """
+        if matrix is None:
+            return None
+        probability_matrix = self.get_probability_matrix()
+        np.copyto(probability_matrix.data, matrix.data)
+        np.copyto(probability_matrix.mask, np.ma.getmaskarray(matrix))
+        return probability_matrix
 
     @classmethod
     def filter(cls, session, *args, **kwargs):
         instance = cls()
-        taxon = session.query(Taxon).get(kwargs['taxon'])
-        instance.logger.info('applying {} filter to taxon {}'.format(cls.__module__, taxon.taxon_key))
+        return instance.apply(session, *args, **kwargs)
+
+    def apply(self, session, *args, **kwargs):
+        """ applies this filter to kwargs['taxon'], a taxon key or Taxon.
+        Filter instances can be reused across many taxa """
+
+        taxon = kwargs['taxon']
+        if not isinstance(taxon, Taxon):
+            taxon = session.query(Taxon).get(taxon)
+        self.logger.info('applying {} filter to taxon {}'.format(self.__module__, taxon.taxon_key))
+
+        # debug runs write images and plots of every taxon, so always compute
+        key = None if settings.DEBUG else self.input_key(taxon, session)
+        if key is not None:
+            found, probability = memo.get(type(self).name, key)
+            if found:
+                self.logger.debug('reusing {} filter output for {}'.format(type(self).name, key))
+                return self._copy(probability)
 
         kwargs['session'] = session
         kwargs['taxon'] = taxon
-        probability = instance._filter(*args, **kwargs)
+        probability = self._filter(*args, **kwargs)
 
         # probability should either be  all masked or contain
         # only values 0->1:
@@ -60,9 +104,13 @@ class BaseFilter(metaclass=MetaBaseFilter):
             (probability.max() <= 1 and probability.min() >= 0)
         )
 
+        if key is not None:
+            memo.put(type(self).name, key, probability)
+
         return probability
 
-    @functools.lru_cache(maxsize=None)
+    @cached('depth_probability', max_entries=100000, scope=TAXON,
+            key=lambda self, *args, **kwargs: (args, tuple(sorted(kwargs.items()))))
     def depth_probability(self, seafloor_depth, taxon_mindepth, taxon_maxdepth):
         """
         calculates probability of taxon in seafloor_depth of water based on a
@@ -1,48 +1,24 @@
 
-import functools
-import gc
-
 import numpy as np
 
 from species_distribution import sd_io as io
 from species_distribution import settings
+from species_distribution import threads
+from species_distribution.arena import ARENA
 from species_distribution.filters.filter import BaseFilter
 from species_distribution.filters.polygon import Filter as PolygonFilter
+from species_distribution.kernel import BANK
 from species_distribution.models.taxa import TaxonHabitat
 from species_distribution.models.world import Grid
+from species_distribution.scatter import scatter_max
+from species_distribution.window import Window
 
 
-@functools.lru_cache(maxsize=None)
 def conical_frustum_kernel(r1, r2):
     """returns a square numpy array of side r1*2+1 containing a centered 0.0-1.0 density
     map of a conical frustum with inner (smaller) radius r2 and outer (larger) radius r1"""
 
-    xx, yy = np.mgrid[-r1:r1 + 1, -r1:r1 + 1]
-    cone = (xx ** 2 + yy ** 2)
-    kernel = np.ma.MaskedArray(data=cone, dtype=np.float)
-    # mask values outside r1
-    mask = kernel > (r1 ** 2)
-    kernel.mask = mask
-
-    # set values < r2 to maximum normalized output
-    r2_mask = (kernel <= (r2 ** 2))
-    kernel[r2_mask] = r2 ** 2
-    # normalize and invert
-    kernel = (kernel - r2 ** 2) / kernel.max()
-    kernel = 1 - kernel
-    return kernel
-
-
-def merge_kernel_greater_than(a, x, y, kernel):
-    """ merges kernel into a at x,y.  Doesn't handle edge wrapping"""
-
-    # mask out values which are already higher than kernel would provide,
-    # or are masked in the kernel
-
-    _slice = np.index_exp[y:y + kernel.shape[0], x:x + kernel.shape[1]]
-    view = a[_slice]
-    mask = (kernel < view) | kernel.mask
-    np.ma.putmask(view, ~mask, kernel)
+    return BANK.kernel(r1, r2)
 
 
 def apply_kernel_greater_than(a, i, j, kernel):
@@ -57,34 +33,39 @@ def apply_kernel_greater_than(a, i, j, kernel):
     so it can be applied symmetrically at i, j
     """
 
-    y = i - kernel.shape[0] // 2
-    x = j - kernel.shape[1] // 2
+    covered = ~np.ma.getmaskarray(a)
+    scatter_max(a.data, covered, [i - kernel.shape[0] // 2], [j - kernel.shape[1] // 2], kernel)
+    a.mask = ~covered
+    return a
 
-    rbound = x + kernel.shape[1]
 
-    if x < 0 or rbound > a.shape[1]:
+def reaching(cells, reach, support):
+    """ returns the True cells of the boolean grid cells whose kernels, which
+    cover reach[i, j] cells right and down from their cell, can touch a True
+    cell of the boolean grid support.  Columns wrap around the grid """
 
-        if x < 0:
-            # extends beyond left boundary,
-            # move over to other side to treat both
-            # out of bounds cases the same
-            x = a.shape[1] + x
-            rbound = x + kernel.shape[1]
+    height, width = support.shape
+    rows, columns = np.nonzero(cells)
+    reach = np.minimum(reach[rows, columns], width - 1).astype(int)
 
-        # extending beyond right boundary
-        extra = rbound - a.shape[1]
-        # merge into right side
-        merge_kernel_greater_than(a, x, y, kernel[:, 0:kernel.shape[1] - extra])
-        # then left
-        merge_kernel_greater_than(a, 0, y, kernel[:, kernel.shape[1] - extra: kernel.shape[1]])
+    # summed area table of the support, its columns repeated once more for the wrap
+    table = np.zeros((height + 1, 2 * width + 1), dtype=np.int32)
+    table[1:, 1:] = np.tile(support, 2).cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
 
-    else:
-        merge_kernel_greater_than(a, x, y, kernel)
-    return a
+    bottom = np.minimum(rows + reach + 1, height)
+    right = columns + reach + 1
+    count = table[bottom, right] - table[rows, right] - table[bottom, columns] + table[rows, columns]
+
+    result = np.zeros_like(cells)
+    result[rows[count > 0], columns[count > 0]] = True
+    return result
 
 
 class Filter(BaseFilter):
 
+    cost = 10
+    uses_support = True
+
     def _rebin(self, a, shape):
         """ return a new array which has been rebinned to the new shape """
 
@@ -93,13 +74,20 @@ class Filter(BaseFilter):
         sh = shape[0], a.shape[0] // shape[0], shape[1], a.shape[1] // shape[1]
         return a.reshape(sh).mean(-1).mean(1)
 
-    def calculate_matrix(self, taxon, habitat_grid, effective_distance, session=None, habitat_name=None):
+    def calculate_matrix(self, taxon, habitat_grid, effective_distance, session=None, habitat_name=None,
+                         polygon_matrix=None, support=None):
         """given a habitat_grid containing global habitat fractions
         and an effective_distance in km, returns a distribution matrix
         for that habitat
 
         The standard 1/2 degree grid is broken into finer resolution
-        so the conical frustum kernel can be applied to each cell
+        so the conical frustum kernel can be applied to each cell.
+        Only the window around the taxon's polygon which kernels can
+        reach is calculated at the finer resolution.  polygon_matrix is
+        the taxon's polygon filter output, computed if not given.
+
+        With a boolean grid support, only kernels reaching its cells are
+        applied, so only the support's cells are calculated
         """
 
         total_area = self.grid.get_grid('total_area') * 10 ** 6  # km**2 to meters**2
@@ -108,9 +96,6 @@ class Filter(BaseFilter):
         # bump up resolution by this factor for calculations
         resolution_scale = 10
 
-        new_size = np.multiply(matrix.shape, resolution_scale)
-        high_resolution_matrix = np.ma.resize(matrix, new_size)
-
         habitat_radius_m = np.sqrt(habitat_grid * total_area / np.pi)
         cell_length_m = np.sqrt(total_area)
 
@@ -126,36 +111,67 @@ class Filter(BaseFilter):
         r1 = np.ceil(r2 + resolution_scale * effective_distance * 1000 / cell_length_m)
 
         # use polygon matrix to reduce the number of cells to calculate
-        polygon_matrix = PolygonFilter()._filter(taxon=taxon, session=session)
+        if polygon_matrix is None:
+            polygon_matrix = PolygonFilter()._filter(taxon=taxon, session=session)
 
         edge_padding = 10
 
-        for i, j in np.ndindex(matrix.shape[0] - edge_padding * 2, matrix.shape[1]):
-
-            i += edge_padding
-
-            if (not habitat_grid[i, j] > 0):
-                continue
-            if polygon_matrix.mask[i, j]:
-                continue
-
-            try:
-                _r1 = r1[i, j]
-                _r2 = r2[i, j]
-                kernel = conical_frustum_kernel(_r1, _r2)
-                # merge the kernel into to the high resolution matrix
-                ii = i * resolution_scale + kernel.shape[0] // 2
-                jj = j * resolution_scale + kernel.shape[1] // 2
-                apply_kernel_greater_than(high_resolution_matrix, ii, jj, kernel)
+        cells = (habitat_grid > 0) & ~np.ma.getmaskarray(polygon_matrix)
+        cells[:edge_padding] = False
+        cells[-edge_padding:] = False
+
+        dropped = np.zeros_like(cells)
+        if support is not None:
+            # the cells of kernels which can't reach the support are set to
+            # 1, the peak of their kernel, outside the support.  Otherwise the
+            # matrix would be empty when it wouldn't be without a support, and
+            # be left out of the product instead of masking it
+            dropped = cells & ~reaching(cells, np.ceil((2 * r1 + 1) / resolution_scale), support)
+            cells &= ~dropped
+
+        if not cells.any():
+            matrix[dropped] = 1
+            return matrix
+
+        # only the window of the grid which kernels can reach is calculated.
+        # A kernel covers 2 * r1 + 1 high resolution cells right and down from
+        # the corner of its cell
+        reach = int(np.ceil((2 * r1[cells].max() + 1) / resolution_scale))
+        window = Window.around(cells, bottom=reach, right=reach)
+
+        # scratch grids come from the arena, they are released once rebinned
+        # so the next habitat reuses them
+        shape = tuple(np.multiply(window.shape, resolution_scale))
+        data = ARENA.zeros(shape)
+        covered = ARENA.zeros(shape, dtype=bool)
+
+        # cells with the same radii share a kernel, merged into the high
+        # resolution grid with its corner at the corner of each cell
+        rows, columns = np.nonzero(cells)
+        radii, kernel_index = np.unique(np.stack([r1[cells], r2[cells]], axis=1), axis=0, return_inverse=True)
+        for n, (_r1, _r2) in enumerate(radii):
+            group = kernel_index == n
+            applied = scatter_max(
+                data,
+                covered,
+                (rows[group] - window.top) * resolution_scale,
+                window.local_column(columns[group]) * resolution_scale,
+                conical_frustum_kernel(_r1, _r2)
+            )
+            if applied < group.sum():
+                self.logger.debug('skipped {} cells past the grid edge. r1: {} r2: {}'.format(
+                    group.sum() - applied, _r1, _r2))
 
-            except ValueError as e:
-                self.logger.debug('skipping cell [{}, {}]. r1: {} r2: {}  value error: {}'.format(i, j, r1, r2, str(e)))
+        mask = np.logical_not(covered, out=ARENA.empty(shape, dtype=bool))
+        high_resolution_matrix = np.ma.MaskedArray(data=data, mask=mask, copy=False)
 
         if settings.DEBUG:
             io.save_image(high_resolution_matrix, '{}-habitat-{}'.format(taxon.taxon_key, habitat_name))
 
-        # downscale high resolution matrix
-        matrix = self._rebin(high_resolution_matrix, matrix.shape)
+        # downscale high resolution matrix, then place it in the grid
+        matrix = window.embed(self._rebin(high_resolution_matrix, window.shape), matrix)
+        ARENA.release(data, covered, mask)
+        matrix[dropped] = 1
         return matrix
 
     def combine_matrices(self, matrices, dist_independent_matrices, taxon_habitat):
@@ -190,7 +206,7 @@ class Filter(BaseFilter):
         probability_matrix /= probability_matrix.max()
         return probability_matrix
 
-    def _filter(self, taxon=None, session=None):
+    def _filter(self, taxon=None, session=None, support=None):
 
         habitats = [
             {'habitat_attr': 'inshore', 'world_attr': 'area_coast', 'dist_independant': False},
@@ -215,14 +231,10 @@ class Filter(BaseFilter):
 
         taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
 
-        gc.collect()
-
-        for hab in habitats:
-
-            weight = getattr(taxon_habitat, hab['habitat_attr'])
+        # shared by every habitat, see calculate_matrix
+        polygon_matrix = PolygonFilter()._filter(taxon=taxon, session=session)
 
-            if not weight > 0:
-                continue
+        def habitat_matrix(hab):
 
             # if taxon.pelagic and hab['world_attr'] == 'seamount':
             #     self.logger.debug('skipping seamount habitat for pelagic taxon {}'.format(taxon.taxon_key))
@@ -243,9 +255,16 @@ class Filter(BaseFilter):
                 habitat_grid,
                 taxon_habitat.effective_distance,
                 session=session,
-                habitat_name=hab['habitat_attr']
+                habitat_name=hab['habitat_attr'],
+                polygon_matrix=polygon_matrix,
+                support=support
             )
-            matrix *= weight
+            matrix *= getattr(taxon_habitat, hab['habitat_attr'])
+            return matrix
+
+        # habitats are independent until combined, so they may run on threads
+        habitats = [hab for hab in habitats if getattr(taxon_habitat, hab['habitat_attr']) > 0]
+        for hab, matrix in zip(habitats, threads.map(habitat_matrix, habitats)):
             if hab['dist_independant']:
                 dist_independent_matrices.append(matrix)
             else:
@@ -4,8 +4,46 @@ from species_distribution.filters.filter import BaseFilter
 from species_distribution.models.taxa import TaxonHabitat
 
 
+def latitude_profiles(lat_north, lat_south, latitudes):
+    """ returns a (K, len(latitudes)) array of latitude probabilities for
+    K taxa with the given lat_north and lat_south, see Filter._filter.
+
+    The triangle distribution is treated as a polygon whose middle
+    points coincide at the range mean, so every taxon is evaluated with
+    the same piecewise linear expression.
+    """
+
+    lat_north = np.atleast_1d(np.asarray(lat_north, dtype=float))[:, np.newaxis]
+    lat_south = np.atleast_1d(np.asarray(lat_south, dtype=float))[:, np.newaxis]
+
+    taxon_range = lat_north - lat_south
+    taxon_mean = (lat_north + lat_south) / 2
+
+    middle_third_north = lat_north - (taxon_range / 3)
+    middle_third_south = lat_north - (2 * taxon_range / 3)
+
+    equator_in_middle_third = (middle_third_north > 0) & (middle_third_south < 0)
+
+    # polygon distribution where the middle third straddles the equator,
+    # else triangle distribution
+    plateau_south = np.where(equator_in_middle_third, middle_third_south, taxon_mean)
+    plateau_north = np.where(equator_in_middle_third, middle_third_north, taxon_mean)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rising = (latitudes - lat_south) * (1 / (plateau_south - lat_south))
+        falling = 1 - (latitudes - plateau_north) * (1 / (lat_north - plateau_north))
+
+    profile = np.where(latitudes < plateau_south, rising, np.where(latitudes > plateau_north, falling, 1))
+    profile[(latitudes <= lat_south) | (latitudes >= lat_north)] = 0
+    return profile
+
+
 class Filter(BaseFilter):
 
+    def input_key(self, taxon, session):
+        taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
+        return (taxon_habitat.lat_north, taxon_habitat.lat_south)
+
     def _filter(self, taxon=None, session=None):
         """ probability generated according to taxon_habitat.latnorth and taxon_habitat.latsouth
 
@@ -21,33 +59,9 @@ class Filter(BaseFilter):
 
         taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
 
-        taxon_range = taxon_habitat.lat_north - taxon_habitat.lat_south
-        taxon_mean = (taxon_habitat.lat_north + taxon_habitat.lat_south) / 2
-
-        middle_third_north = taxon_habitat.lat_north - (taxon_range / 3)
-        middle_third_south = taxon_habitat.lat_north - (2 * taxon_range / 3)
-
-        equator_in_middle_third = middle_third_north > 0 and middle_third_south < 0
-
-        if equator_in_middle_third:
-            # polygon distribution
-            x_points = (taxon_habitat.lat_south, middle_third_south, middle_third_north, taxon_habitat.lat_north)
-            y_points = (0, 1, 1, 0)
-        else:
-            # triangle distribution
-            x_points = (taxon_habitat.lat_south, taxon_mean, taxon_habitat.lat_north)
-            y_points = (0, 1, 0)
-
-        # get a 1-d longitudinal distribution for each regime
+        # get a 1-d north-south distribution, then broadcast it across the grid
         latitudes = self.grid.latitude[:, 0]
-        distribution1d = np.interp(latitudes, x_points, y_points)
-        mask = distribution1d <= 0
-        distribution1d = np.ma.MaskedArray(data=distribution1d)
-        distribution1d.mask = mask
-
-        probability_matrix = self.get_probability_matrix()
-
-        # broadcast 1-d north-south distribution across grid
-        probability_matrix[:] = distribution1d.reshape(distribution1d.shape[0], 1)
+        distribution1d = latitude_profiles(taxon_habitat.lat_north, taxon_habitat.lat_south, latitudes)[0]
+        distribution = np.repeat(distribution1d[:, np.newaxis], self.grid.shape[1], axis=1)
 
-        return probability_matrix
+        return np.ma.MaskedArray(data=distribution, mask=distribution <= 0)
@@ -1,3 +1,4 @@
+import logging
 import math
 import sys
 
@@ -7,6 +8,124 @@ from .filter import BaseFilter
 from species_distribution.models.taxa import TaxonHabitat
 from species_distribution import settings
 
+logger = logging.getLogger(__name__)
+
+
+def _points(*columns):
+    """ stacks broadcastable columns into a (K, len(columns)) array of points """
+    return np.stack(np.broadcast_arrays(*columns), axis=-1).astype(float)
+
+
+def _polyfit2(x, y):
+    """ least squares fit of a parabola to each row of the (K, N) arrays of
+    points x, y. Returns (K, 3) coefficients, highest power first, as np.polyfit
+    """
+    vander = np.stack((x ** 2, x, np.ones_like(x)), axis=-1)
+
+    # scale the columns, as np.polyfit does, to improve the condition number
+    scale = np.sqrt((vander * vander).sum(axis=-2, keepdims=True))
+    coefficients = np.linalg.pinv(vander / scale) @ y[..., np.newaxis]
+    return coefficients[..., 0] / scale[:, 0, :]
+
+
+def get_scenarios(lat_north, lat_south):
+    """ vectorized Filter.get_scenario, 0 where no scenario applies """
+    lat_north = np.asarray(lat_north)
+    lat_south = np.asarray(lat_south)
+    straddles = (lat_north >= 0) & (lat_south <= 0)
+    return np.select(
+        (
+            (lat_north >= 0) & (lat_south >= 0),
+            (lat_north <= 0) & (lat_south <= 0),
+            straddles & (abs(lat_north) > abs(lat_south)),
+            straddles & (abs(lat_north) < abs(lat_south)),
+            straddles & (abs(lat_north) == abs(lat_south)),
+        ),
+        (1, 2, 3, 4, 5),
+        0
+    )
+
+
+def fit_parabola_coefficients(min_depth, max_depth, lat_north, lat_south):
+    """ fits the upper and lower submergence parabolas for any number of taxa
+    at once.  Arguments are scalars or equal length sequences, as documented
+    in Filter.  Returns a tuple of (K, 3) arrays of coefficients (upper, lower),
+    highest power first.
+
+    Three point parabolas are fitted through four points by repeating the
+    last one, which doesn't change an exact fit.
+    """
+
+    min_depth, max_depth, lat_north, lat_south = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(a, dtype=float)) for a in (min_depth, max_depth, lat_north, lat_south))
+    )
+
+    # geometric mean requires values > 0, so the data is ever so slightly tweaked to handle
+    # depth values of 0
+    min_depth = np.where(min_depth == 0, sys.float_info.epsilon, min_depth)
+    mean_depth = -10 ** ((np.log10(abs(min_depth)) + np.log10(abs(max_depth))) / 2)
+
+    scenario = get_scenarios(lat_north, lat_south)
+    # Case 1 is not bounded by 60/-60, Case 2 is
+    case_1 = (lat_north >= 60) | (lat_north <= -60) | (lat_south >= 60) | (lat_south <= -60)
+    case_1 = case_1[:, np.newaxis]
+
+    # upper parabola
+    lat_high = np.where((scenario == 2) | (scenario == 4), lat_south, lat_north)
+    x_high = np.where(case_1, _points(60, 0, -60, -60), _points(60, lat_high, -lat_high, -60))
+    y_high = np.where(
+        case_1,
+        _points(
+            min_depth,
+            np.where(scenario == 4, min_depth, mean_depth),
+            np.where(scenario == 2, min_depth, mean_depth),
+            np.where(scenario == 2, min_depth, mean_depth),
+        ),
+        _points(0, min_depth, min_depth, 0)
+    )
+    p_high = _polyfit2(x_high, y_high)
+
+    # lower parabola
+    straddles = (scenario >= 3)[:, np.newaxis]
+    lat_low = np.where(scenario == 1, lat_south, lat_north)
+    x_low = np.where(straddles, _points(60, 0, -60, -60), _points(60, lat_low, -lat_low, -60))
+    y_low = np.where(
+        straddles,
+        _points(mean_depth, max_depth, mean_depth, mean_depth),
+        _points(mean_depth, max_depth, max_depth, mean_depth)
+    )
+
+    # special case to ensure p_low is lower than p_high
+    c = p_high[:, 2]  # coefficient of x^0, the vertical offset
+    special = ~case_1 & (scenario == 1)[:, np.newaxis]
+    y_low = np.where(special, _points(c, max_depth + c, max_depth + c, c), y_low)
+    p_low = _polyfit2(x_low, y_low)
+
+    # [SAU-1316]: if parabola shallow slope > parabola deep slope,
+    # then redraw parabola shallow using (60, Dmin), (0, Dgm) and (-60, Dmin).
+    redraw = p_high[:, 0] > p_low[:, 0]
+    if redraw.any():
+        logger.info('recalculating {} upper parabola(s)'.format(redraw.sum()))
+        p_high[redraw] = _polyfit2(
+            np.broadcast_to(_points(60, 0, -60, -60), (redraw.sum(), 4)),
+            _points(min_depth, mean_depth, min_depth, min_depth)[redraw]
+        )
+
+    # no scenario applies when lat_north < lat_south
+    p_high[scenario == 0] = np.nan
+    p_low[scenario == 0] = np.nan
+
+    return p_high, p_low
+
+
+def parabola_profiles(coefficients, latitudes):
+    """ evaluates parabolas of (..., 3) coefficients at latitudes.  Submergence is
+    constant poleward of 60/-60.  Returns an array of shape (..., len(latitudes)) """
+
+    coefficients = np.asarray(coefficients)[..., np.newaxis]
+    x = np.clip(latitudes, -60, 60)
+    return (coefficients[..., 0, :] * x + coefficients[..., 1, :]) * x + coefficients[..., 2, :]
+
 
 class Filter(BaseFilter):
     """ Submergence Filter
@@ -53,6 +172,16 @@ class Filter(BaseFilter):
 
     """
 
+    def input_key(self, taxon, session):
+        taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
+        return (
+            taxon_habitat.min_depth,
+            taxon_habitat.max_depth,
+            taxon_habitat.lat_north,
+            taxon_habitat.lat_south,
+            taxon_habitat.intertidal
+        )
+
     def _geometric_mean(self, a):
         """ a should be a sequence of numbers greater than 0 """
         try:
@@ -81,113 +210,13 @@ class Filter(BaseFilter):
         submergence model
         """
 
-        # geometric mean requires values > 0, so the data is ever so slightly tweaked to handle
-        # depth values of 0
         if min_depth == 0:
             min_depth += sys.float_info.epsilon
-        mean_depth = -self._geometric_mean((abs(min_depth), abs(max_depth)))
-
-        # depending on relationship of latnorth/latsouth and the equator, define different upper
-        # and lower parabolas according to business rules.  The 3 or 4 points defining each parabola are
-        # defined by each branch then modeled as p_high (upper parabola) and p_low (lower parabola)
-
-        scenario = self.get_scenario(lat_north, lat_south)
-        case = (lat_north >= 60 or lat_north <= -60 or lat_south >= 60 or lat_south <= -60) and 1 or 2
-        if case == 1:
-            # Case 1, not bounded by 60/-60
-            if scenario == 1:
-                x_high = (60, 0, -60)
-                y_high = (min_depth, mean_depth, mean_depth)
-
-                x_low = (60, lat_south, -lat_south, -60)
-                y_low = (mean_depth, max_depth, max_depth, mean_depth)
-
-            elif scenario == 2:
-                x_high = (60, 0, -60)
-                y_high = (min_depth, mean_depth, min_depth)
-
-                x_low = (60, lat_north, -lat_north, -60)
-                y_low = (mean_depth, max_depth, max_depth, mean_depth)
-
-            elif scenario == 3:
-                x_high = (60, 0, -60)
-                y_high = (min_depth, mean_depth, mean_depth)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
+        # log and raise on depths the geometric mean can't handle
+        self._geometric_mean((abs(min_depth), abs(max_depth)))
 
-            elif scenario == 4:
-                x_high = (60, 0, -60)
-                y_high = (min_depth, min_depth, mean_depth)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
-
-            elif scenario == 5:
-                x_high = (60, 0, -60)
-                y_high = (min_depth, mean_depth, mean_depth)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
-
-        elif case == 2:
-            # Case 2, bounded by 60/-60
-            if scenario == 1:
-                x_high = (60, lat_north, -lat_north, -60)
-                y_high = (0, min_depth, min_depth, 0)
-
-                x_low = (60, lat_south, -lat_south, -60)
-                y_low = None
-                # y_low = (mean_depth, max_depth, max_depth, mean_depth)
-
-            elif scenario == 2:
-                x_high = (60, lat_south, -lat_south, -60)
-                y_high = (0, min_depth, min_depth, 0)
-
-                x_low = (60, lat_north, -lat_north, -60)
-                y_low = (mean_depth, max_depth, max_depth, mean_depth)
-
-            elif scenario == 3:
-                x_high = (60, lat_north, -lat_north, -60)
-                y_high = (0, min_depth, min_depth, 0)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
-
-            elif scenario == 4:
-                x_high = (60, lat_south, -lat_south, -60)
-                y_high = (0, min_depth, min_depth, 0)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
-
-            elif scenario == 5:
-                x_high = (60, lat_north, -lat_north, -60)
-                y_high = (0, min_depth, min_depth, 0)
-
-                x_low = (60, 0, -60)
-                y_low = (mean_depth, max_depth, mean_depth)
-
-        p_high = np.poly1d(np.polyfit(x_high, y_high, 2))
-
-        if case == 2 and scenario == 1:
-            # special case to ensure p_low is lower than p_high
-            c = p_high[0]  # coefficient of x^0, the vertical offset
-            y_low = (c, max_depth + c, max_depth + c, c)
-
-        p_low = np.poly1d(np.polyfit(x_low, y_low, 2))
-
-        # [SAU-1316]: if parabola shallow slope > parabola deep slope,
-        # then redraw parabola shallow using (60, Dmin), (0, Dgm) and (-60, Dmin).
-        a_high = p_high[2]
-        a_low = p_low[2]
-        if a_high > a_low:
-            self.logger.info('recalculating upper parabola')
-            x_high = (60, 0, -60)
-            y_high = (min_depth, mean_depth, min_depth)
-            p_high = np.poly1d(np.polyfit(x_high, y_high, 2))
-
-        return p_high, p_low
+        p_high, p_low = fit_parabola_coefficients(min_depth, max_depth, lat_north, lat_south)
+        return np.poly1d(p_high[0]), np.poly1d(p_low[0])
 
     def _plot_parabolas(self, p_high, p_low, min_depth, max_depth, lat_north, lat_south, taxon_key):
         """ writes out a PNG plot of the calculated parabolas and the parameters used
@@ -208,19 +237,6 @@ class Filter(BaseFilter):
 
         plt.savefig(os.path.join(settings.PNG_DIR, '{}-submergence-parabolas.png'.format(taxon_key)))
 
-    def _grid_parabola(self, f):
-        """ given a function f which defines a fitted parabola,
-        return a Grid shaped array with that parabola applied
-        to 60/-60, and constant across longitudes """
-        # submergence is constant poleward of 60/-60
-        latitudes = np.clip(self.grid.latitude[:, 0], -60, 60)
-        y = f(latitudes)
-
-        matrix = self.get_probability_matrix()
-        # broadcast 1-D array across longitudes:
-        matrix[:] = y.reshape(y.shape[0], 1)   # pivot
-        return matrix
-
     def _filter(self, taxon=None, session=None):
 
         taxon_habitat = session.query(TaxonHabitat).get(taxon.taxon_key)
@@ -254,17 +270,18 @@ class Filter(BaseFilter):
         if settings.DEBUG:
             self._plot_parabolas(p_high, p_low, min_depth, max_depth, taxon_habitat.lat_north, taxon_habitat.lat_south, taxon_habitat.taxon_key)
 
-        p_high_array = self._grid_parabola(p_high)
-        p_low_array = self._grid_parabola(p_low)
+        # parabolas are evaluated once per latitude row and broadcast across longitudes.
+        # submergence is constant poleward of 60/-60
+        latitudes = np.clip(self.grid.latitude[:, 0], -60, 60)
+        p_high_profile = p_high(latitudes)[:, np.newaxis]
+        p_low_profile = p_low(latitudes)[:, np.newaxis]
 
         # define a mask with which to set cell values at 1 (or default to masked)
         # based on submergence rules
         mask = (
-            ((percent_water < 100) & (ocean_depth < p_high_array))
+            ((percent_water < 100) & (ocean_depth < p_high_profile))
             |
-            ((ocean_depth <= p_high_array) & (ocean_depth >= p_low_array))
+            ((ocean_depth <= p_high_profile) & (ocean_depth >= p_low_profile))
         )
-        probability_matrix = self.get_probability_matrix()
-        probability_matrix[mask] = 1
 
-        return probability_matrix
+        return np.ma.MaskedArray(data=mask.astype(float), mask=~mask)
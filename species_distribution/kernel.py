@@ -0,0 +1,97 @@
+""" Conical frustum kernels derived from a shared distance field
+
+The habitat filter spreads each habitat cell with a conical frustum
+kernel, and the radius pairs vary from cell to cell.  Rather than
+building every kernel from its own mgrid, the bank keeps one squared
+distance field, int32, which kernels of any radius are a centered view
+of, and a 1-d radial profile per radius pair, indexed by squared
+distance.  A kernel is then a single lookup of the profile through the
+distance field.
+
+The module level BANK reserves a field for common radii on import, so
+pool workers forked after it share the field's memory.
+"""
+
+import threading
+
+import numpy as np
+
+from .cache import cached
+
+# radius, in high resolution cells, of the field reserved on import
+RESERVED_RADIUS = 256
+
+
+@cached('frustum_profile', max_bytes=64 * 2 ** 20)
+def frustum_profile(r1, r2):
+    """returns the values of the frustum kernel with outer radius r1 and inner
+    radius r2 at squared distances 0 .. r1 ** 2 from its center"""
+
+    r1 = float(r1)
+    r2 = float(r2)
+    distance_squared = np.arange(int(r1 ** 2) + 1, dtype=float)
+    # flat within r2, falling linearly in squared distance to 0 at r1
+    return 1 - (np.maximum(distance_squared, r2 ** 2) - r2 ** 2) / r1 ** 2
+
+
+class KernelBank():
+    """ habitats are computed on threads, see threads.py, so the radius and
+    field are swapped in together and only grown under the lock """
+
+    def __init__(self, radius=0):
+        # (radius, field), read and replaced as one
+        self.reserved = (-1, None)
+        self.lock = threading.Lock()
+        self.reserve(radius)
+
+    @property
+    def radius(self):
+        return self.reserved[0]
+
+    @property
+    def field(self):
+        return self.reserved[1]
+
+    def reserve(self, radius):
+        """ makes sure the field covers kernels of radius, growing it to at
+        least double its size.  Returns (radius, field) covering it """
+
+        radius = int(radius)
+        reserved = self.reserved
+        if radius <= reserved[0]:
+            return reserved
+
+        with self.lock:
+            reserved = self.reserved
+            if radius <= reserved[0]:
+                return reserved
+
+            radius = max(radius, 2 * reserved[0])
+            squares = np.arange(-radius, radius + 1, dtype=np.int32) ** 2
+            self.reserved = (radius, np.add.outer(squares, squares))
+            return self.reserved
+
+    def distances(self, r):
+        """ returns a view of the squared distances of a (2r+1, 2r+1) square
+        from its center """
+
+        r = int(r)
+        radius, field = self.reserve(r)
+        _slice = slice(radius - r, radius + r + 1)
+        return field[_slice, _slice]
+
+    def kernel(self, r1, r2):
+        """returns a square masked array of side r1*2+1 containing a centered 0.0-1.0
+        density map of a conical frustum with inner radius r2 and outer radius r1,
+        masked outside r1"""
+
+        distance_squared = self.distances(r1)
+        limit = int(r1) ** 2
+        profile = frustum_profile(int(r1), int(r2))
+        return np.ma.MaskedArray(
+            data=profile[np.minimum(distance_squared, limit)],
+            mask=distance_squared > limit
+        )
+
+
+BANK = KernelBank(RESERVED_RADIUS)
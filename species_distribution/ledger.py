@@ -0,0 +1,135 @@
+""" Durable job ledger for distribution runs
+
+The ledger is a local SQLite file recording the state of every taxon of a
+run, with timestamps and the id of the worker which last touched it:
+
+    queued -> running -> computed -> saved
+                      -> failed
+                      -> timeout
+
+Computed matrices are spilled to a spool directory next to the ledger
+until they are saved to the database, so an interrupted or crashed run
+can be resumed redoing only the taxa which were actually in flight.
+"""
+
+from datetime import datetime
+import logging
+import os
+import socket
+import sqlite3
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPUTED = 'computed'
+SAVED = 'saved'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+STATES = (QUEUED, RUNNING, COMPUTED, SAVED, FAILED, TIMEOUT)
+
+
+def worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class Ledger():
+
+    def __init__(self, fname, spool_dir=None):
+        self.fname = fname
+        self.spool_dir = spool_dir or fname + '.spool'
+        self._connection = None
+        self._pid = None
+
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS job (
+                    taxon_key INTEGER PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    created_timestamp TEXT NOT NULL,
+                    modified_timestamp TEXT NOT NULL
+                )
+            """)
+
+    @property
+    def connection(self):
+        """ one connection per process, sqlite connections can't cross a fork """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.fname, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # ledgers are passed to pool workers, which open their own connection
+        return {'fname': self.fname, 'spool_dir': self.spool_dir, '_connection': None, '_pid': None}
+
+    def reset(self, taxon_keys):
+        """ starts a new run of taxon_keys, forgetting any previous run """
+        now = datetime.now().isoformat()
+        with self.connection:
+            self.connection.execute('DELETE FROM job')
+            self.connection.executemany(
+                'INSERT INTO job (taxon_key, state, created_timestamp, modified_timestamp) VALUES (?, ?, ?, ?)',
+                ((key, QUEUED, now, now) for key in taxon_keys)
+            )
+        for fname in os.listdir(self.spool_dir):
+            os.remove(os.path.join(self.spool_dir, fname))
+
+    def mark(self, taxon_key, state, message=None, worker=None):
+        assert(state in STATES)
+        attempt = state == RUNNING and 1 or 0
+        with self.connection:
+            self.connection.execute(
+                """UPDATE job SET state=?, worker=?, message=?, attempts=attempts + ?, modified_timestamp=?
+                   WHERE taxon_key=?""",
+                (state, worker or worker_id(), message, attempt, datetime.now().isoformat(), taxon_key)
+            )
+
+    def taxa(self, *states):
+        """ returns taxon keys in any of states, ordered by taxon key """
+        query = 'SELECT taxon_key FROM job WHERE state IN ({}) ORDER BY taxon_key'.format(','.join('?' * len(states)))
+        return [row[0] for row in self.connection.execute(query, states)]
+
+    def unfinished(self):
+        """ taxa which need to be distributed again on resume. Computed taxa
+        whose spill file is missing are included, timed out taxa are not """
+        computed = [key for key in self.taxa(COMPUTED) if not os.path.isfile(self.spill_file(key))]
+        return sorted(self.taxa(QUEUED, RUNNING, FAILED) + computed)
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM job GROUP BY state'))
+
+    def spill_file(self, taxon_key):
+        return os.path.join(self.spool_dir, '{}.npz'.format(taxon_key))
+
+    def spill(self, taxon_key, matrix):
+        """ writes a computed matrix to the spool and marks it computed """
+        fname = self.spill_file(taxon_key)
+        if matrix is not None:
+            tmp = fname + '.tmp.npz'
+            np.savez(tmp, data=np.ma.getdata(matrix), mask=np.ma.getmaskarray(matrix))
+            os.replace(tmp, fname)
+        self.mark(taxon_key, COMPUTED, matrix is None and 'no distribution' or None)
+
+    def load_spill(self, taxon_key):
+        """ returns the spilled matrix of taxon_key, or None """
+        fname = self.spill_file(taxon_key)
+        if not os.path.isfile(fname):
+            return None
+        with np.load(fname) as f:
+            return np.ma.MaskedArray(data=f['data'], mask=f['mask'])
+
+    def discard_spill(self, taxon_key):
+        fname = self.spill_file(taxon_key)
+        if os.path.isfile(fname):
+            os.remove(fname)
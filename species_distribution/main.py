@@ -1,16 +1,24 @@
 """ Main module for running species_distribution """
 
+import functools
 import logging
 from multiprocessing import Pool
+import os
 import signal
 import sys
 
 import species_distribution.distribution as distribution
+from species_distribution import cache
+from species_distribution.arena import ARENA
+from species_distribution import sparse
+from species_distribution import cluster
 from species_distribution import sd_io as io
 from species_distribution.models.db import Session
 from species_distribution.models.taxa import Taxon, TaxonExtent, TaxonHabitat
 from species_distribution.models.validation import refresh_validation_rules, filter_taxa_against_validation_results
 from species_distribution import settings
+from species_distribution.ledger import Ledger, RUNNING, COMPUTED, SAVED, FAILED
+from species_distribution.supervisor import Supervisor, DONE
 from sqlalchemy import exists, and_
 import numpy as np
 
@@ -37,14 +45,8 @@ def signal_handler(*args):
 signal.signal(signal.SIGINT, signal_handler)
 
 
-def main(arguments):
-    configure_logging(arguments.verbose and logging.DEBUG or logging.INFO)
-    logger.info("starting distribution")
-    logger.info("connecting to Host: {} DB: {} User: {}".format(
-            settings.DB['host'],
-            settings.DB['db'],
-            settings.DB['username'])
-    )
+def select_taxa(arguments):
+    """ returns the taxon keys to distribute according to arguments """
 
     taxonkeys = []
     with Session() as session:
@@ -97,10 +99,149 @@ def main(arguments):
     taxonkeys = filter_taxa_against_validation_results(taxonkeys)
     logger.info("Validations complete")
 
+    return taxonkeys
+
+
+def distribute(taxon_keys, ledger=None, prefetch=0):
+    """ generator yielding (taxon_key, matrix) for taxon_keys, recording progress
+    in ledger if given.  With a ledger, matrices are spilled to its spool and
+    None is yielded in their place, and a taxon raising an error is marked
+    failed instead of stopping the run.  prefetch is passed to
+    create_taxon_distributions """
+
+    remaining = list(taxon_keys)
+    while remaining:
+        distributions = distribution.create_taxon_distributions(remaining, prefetch)
+        try:
+            for taxon_key in list(remaining):
+                if ledger:
+                    ledger.mark(taxon_key, RUNNING)
+
+                _, matrix = next(distributions)
+
+                if ledger:
+                    ledger.spill(taxon_key, matrix)
+                    matrix = None
+
+                remaining.remove(taxon_key)
+                yield taxon_key, matrix
+
+        except Exception as e:
+            if ledger is None:
+                raise
+            remaining.remove(taxon_key)
+            logger.exception("taxon {} failed".format(taxon_key))
+            ledger.mark(taxon_key, FAILED, str(e))
+
+
+def distribute_chunk(taxon_keys, ledger=None, prefetch=0):
+    """ pool task, returns a list of the results of distribute(), with
+    matrices packed for the trip back to the parent """
+    results = [(taxon_key, sparse.pack(matrix)) for taxon_key, matrix in distribute(taxon_keys, ledger, prefetch)]
+    logger.info("worker caches: {}".format(cache.report()))
+    logger.info("worker arena: {}".format(ARENA.report()))
+    return results
+
+
+def distribute_one(taxon_key, ledger=None):
+    """ supervisor task, returns the packed distribution of taxon_key or None
+    if it was spilled to the ledger """
+    if ledger:
+        ledger.mark(taxon_key, RUNNING)
+
+    _, matrix = distribution.create_taxon_distribution(taxon_key)
+
+    if ledger:
+        ledger.spill(taxon_key, matrix)
+        matrix = None
+    return sparse.pack(matrix)
+
+
+def save(taxon_key, matrix, ledger=None, rebuild=None):
+    """ saves a distribution, reading it from the ledger's spool if there is one,
+    into the shadow table of rebuild if there is one """
+    if ledger:
+        matrix = ledger.load_spill(taxon_key)
+
+    distribution.save_database(taxon_key, matrix, rebuild=rebuild)
+
+    if ledger:
+        ledger.mark(taxon_key, SAVED)
+        ledger.discard_spill(taxon_key)
+
+
+def finish_rebuild(rebuild):
+    """ swaps in the shadow table of rebuild, unless the run was interrupted """
+    if STOP:
+        logger.critical("{} not swapped in, continue the rebuild with --rebuild --resume".format(rebuild.shadow))
+    else:
+        rebuild.finish()
+
+
+def main(arguments):
+    configure_logging(arguments.verbose and logging.DEBUG or logging.INFO)
+    logger.info("starting distribution")
+    logger.info("connecting to Host: {} DB: {} User: {}".format(
+            settings.DB['host'],
+            settings.DB['db'],
+            settings.DB['username'])
+    )
+
+    if arguments.threads:
+        settings.THREADS = arguments.threads
+
+    if arguments.rebuild and settings.STORAGE != 'rows':
+        raise ValueError('--rebuild only rebuilds taxon_distribution, with STORAGE "rows"')
+
+    if arguments.worker:
+        # the coordinator begins and finishes a rebuild, workers only save into it
+        save_worker = None
+        if arguments.rebuild:
+            save_worker = functools.partial(distribution.save_database, rebuild=io.Rebuild())
+        cluster.run_workers(cluster.parse_address(arguments.worker), arguments.processes, save=save_worker)
+        logger.info('worker complete')
+        return
+
+    ledger = None
+    if arguments.ledger:
+        ledger = Ledger(arguments.ledger)
+
+    rebuild = None
+    if arguments.rebuild:
+        rebuild = io.Rebuild()
+        rebuild.begin(resume=arguments.resume)
+
+    if arguments.resume:
+        if not ledger:
+            raise ValueError('--resume requires a --ledger')
+
+        logger.info("resuming from ledger {}: {}".format(arguments.ledger, ledger.counts()))
+        # computed taxa only need saving
+        for taxon_key in ledger.taxa(COMPUTED):
+            if os.path.isfile(ledger.spill_file(taxon_key)):
+                logger.info("saving spilled taxon {}".format(taxon_key))
+                save(taxon_key, None, ledger, rebuild)
+        taxonkeys = ledger.unfinished()
+    else:
+        taxonkeys = select_taxa(arguments)
+        if ledger:
+            ledger.reset(taxonkeys)
+
     num_of_taxons_to_process = len(taxonkeys)
 
     if num_of_taxons_to_process == 0:
         logger.info("No taxons selected for processing, process aborted.")
+        if rebuild and arguments.resume:
+            # the interrupted rebuild only had its swap left
+            rebuild.finish()
+        return
+
+    if arguments.coordinator:
+        finished = cluster.coordinate(taxonkeys, cluster.parse_address(arguments.coordinator),
+                                      ledger=ledger, stop=lambda: STOP)
+        logger.info('coordinator: {} of {} taxa finished'.format(len(finished), num_of_taxons_to_process))
+        if rebuild:
+            finish_rebuild(rebuild)
         return
 
     if arguments.processes > num_of_taxons_to_process:
@@ -109,35 +250,75 @@ def main(arguments):
     if arguments.numpy_exception:
         np.seterr(all='raise')
 
-    if arguments.processes == 1:
-        # no pool
-        for i, taxon_key in enumerate(taxonkeys):
+    if arguments.timeout or arguments.memory_limit:
+        # supervised workers, killed and replaced when a taxon exceeds the limits
+        supervisor = Supervisor(
+            functools.partial(distribute_one, ledger=ledger),
+            processes=arguments.processes,
+            timeout=arguments.timeout,
+            memory_limit=arguments.memory_limit and arguments.memory_limit * 2 ** 20
+        )
+        results = supervisor.run(taxonkeys)
+        for i, (taxon_key, state, result) in enumerate(results):
+            logger.info("finished work on taxon key {} [{}/{}]".format(taxon_key, i + 1, len(taxonkeys)))
+            if state == DONE:
+                save(taxon_key, sparse.unpack(result), ledger, rebuild)
+            else:
+                logger.error("taxon {} {}: {}".format(taxon_key, state, result))
+                if ledger:
+                    ledger.mark(taxon_key, state, result)
+
             if STOP:
                 logger.critical("Quitting early due to SIGINT")
+                results.close()
                 break
 
-            logger.info("starting work on taxon key {} [{}/{}]".format(taxon_key, i + 1, len(taxa)))
-            _, matrix = distribution.create_taxon_distribution(taxon_key)
-            distribution.save_database(taxon_key, matrix)
+    elif arguments.processes == 1:
+        # no pool
+        distributions = distribute(taxonkeys, ledger, arguments.prefetch)
+        for i, (taxon_key, matrix) in enumerate(distributions):
+            logger.info("finished work on taxon key {} [{}/{}]".format(taxon_key, i + 1, len(taxonkeys)))
+            save(taxon_key, matrix, ledger, rebuild)
+
+            if STOP:
+                logger.critical("Quitting early due to SIGINT")
+                distributions.close()
+                break
 
     else:
-        # pool
+        # pool, each task distributes a chunk of taxa
+        chunk_size = arguments.chunk_size
+        chunks = [taxonkeys[i:i + chunk_size] for i in range(0, len(taxonkeys), chunk_size)]
+
         with Pool(processes=arguments.processes) as pool:
             res = []
-            for taxonkey in taxonkeys:
+            for chunk in chunks:
 
                 if STOP:
                     logger.critical("Quitting early due to SIGINT")
                     break
 
-                function = distribution.create_taxon_distribution
-                args = (taxonkey,)
-                res.append(pool.apply_async(function, args))
+                res.append(pool.apply_async(distribute_chunk, (chunk, ledger, arguments.prefetch)))
 
             for r in res:
-                taxon_key, matrix = r.get()
-                distribution.save_database(taxon_key, matrix)
+                while not (r.ready() or STOP):
+                    r.wait(1)
+
+                if not r.ready():
+                    logger.critical("Quitting early due to SIGINT, unsaved taxa will be redone{}".format(
+                        ledger and ' or saved from the spool on --resume' or ''))
+                    pool.terminate()
+                    break
+
+                for taxon_key, payload in r.get():
+                    save(taxon_key, sparse.unpack(payload), ledger, rebuild)
+
+    if rebuild:
+        finish_rebuild(rebuild)
 
+    if ledger:
+        logger.info("ledger: {}".format(ledger.counts()))
+    logger.info("caches: {}".format(cache.report()))
 
     logger.info('distribution complete')
 
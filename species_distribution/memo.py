@@ -0,0 +1,83 @@
+""" Filter outputs shared by taxa with the same inputs
+
+Several filters only read a few attributes of a taxon, the latitude filter
+its latitude range, the depth filter its depth range and habitat flags,
+and thousands of taxa share those.  A filter declares what its output
+depends on with BaseFilter.input_key, and outputs are kept per
+(filter name, key) in a bounded in-memory cache.  With
+settings.FILTER_CACHE_DIR set they are also written there as .npz files,
+so pool workers, cluster workers on a shared filesystem and later runs
+reuse them.  Files are never invalidated, empty the directory when world
+data or filters change.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from . import settings
+from .cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+MEMORY = get_cache('filter_outputs', max_bytes=256 * 2 ** 20)
+
+# a filter output of None, as a value the cache can hold
+_NONE = 'none'
+
+
+def _fname(name, key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(settings.FILTER_CACHE_DIR, '{}-{}.npz'.format(name, digest))
+
+
+def _read(fname):
+    try:
+        with np.load(fname) as f:
+            if 'data' not in f:
+                return _NONE
+            return np.ma.MaskedArray(data=f['data'], mask=f['mask'])
+    except (OSError, ValueError):
+        return None
+
+
+def _write(fname, value):
+    directory = os.path.dirname(fname)
+    os.makedirs(directory, exist_ok=True)
+    # written aside then renamed, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        if value is _NONE:
+            np.savez(f)
+        else:
+            np.savez(f, data=value.data, mask=np.ma.getmaskarray(value))
+    os.replace(tmp, fname)
+
+
+def get(name, key):
+    """ returns (found, output) of filter name for key """
+
+    value = MEMORY.get((name, key))
+    if value is None and settings.FILTER_CACHE_DIR:
+        value = _read(_fname(name, key))
+        if value is not None:
+            MEMORY.put((name, key), value)
+
+    if value is None:
+        return False, None
+    return True, None if value is _NONE else value
+
+
+def put(name, key, output):
+    """ keeps a copy of the output of filter name for key """
+
+    value = _NONE if output is None else output.copy()
+    MEMORY.put((name, key), value)
+    if settings.FILTER_CACHE_DIR:
+        try:
+            _write(_fname(name, key), value)
+        except OSError as e:
+            logger.warning('unable to write filter output {}: {}'.format(name, e))
@@ -2,9 +2,10 @@
 
 from contextlib import contextmanager
 import logging
+import os
 
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, DeferredReflection
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.pool import NullPool
 
@@ -15,25 +16,48 @@ connection_str = 'postgresql://{username}:{password}@{host}:{port}/{db}'.format(
 
 logger = logging.getLogger(__name__)
 
+_engine = None
+_engine_pid = None
+
+
 def get_engine():
+    """ returns the engine of this process, created on first use """
+    global _engine, _engine_pid
 
-    return create_engine(
-        connection_str,
-        echo=False,
-        poolclass=NullPool,
-        isolation_level='READ UNCOMMITTED'
-    )
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = create_engine(
+            connection_str,
+            echo=False,
+            poolclass=NullPool,
+            isolation_level='READ UNCOMMITTED'
+        )
+        _engine_pid = os.getpid()
+    return _engine
 
 Base = declarative_base()
-Base.metadata.bind = get_engine()
+
+_reflected = False
+
+
+def reflect():
+    """ reflects the columns of every model from the database. Models are
+    only reflected when the first session is opened, so importing them
+    doesn't touch the database, and forked workers inherit the result """
+    global _reflected
+
+    if not _reflected:
+        logger.debug('reflecting models')
+        SpecDisModel.prepare(get_engine())
+        _reflected = True
+
 
 @contextmanager
 def Session():
     """Provide a transactional scope around a series of operations."""
+    reflect()
+    session_maker = sessionmaker(bind=get_engine(), autocommit=True) # autocommit=True, autoflush=False, expire_on_commit=False)
+    session = session_maker()
     try:
-        engine = get_engine()
-        session_maker = sessionmaker(bind=engine, autocommit=True) # autocommit=True, autoflush=False, expire_on_commit=False)
-        session = session_maker()
         yield session
 
     except Exception as e:
@@ -43,5 +67,6 @@ def Session():
         session.close()
 
 
-class SpecDisModel(Base):
+class SpecDisModel(DeferredReflection, Base):
+    """ models declare their primary key, other columns are reflected by reflect() """
     __abstract__ = True
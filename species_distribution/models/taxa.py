@@ -1,17 +1,53 @@
 """ Taxa data source """
 
-import functools
-
+import numpy as np
 from sqlalchemy import Column, Integer
 from sqlalchemy.orm import relationship
-from sqlalchemy.schema import Table
 
-from .db import SpecDisModel, Session, Base
+from .db import SpecDisModel, Session
+from ..cache import cached
 from ..exceptions import NoPolygonException
+from ..raster import rasterize
+from .. import settings
 
 
-@functools.lru_cache(maxsize=None)
 def polygon_cells_for_taxon(taxon_key):
+    """returns the (row, col) cells intersecting the taxon's extent, rasterized
+    in process or by PostGIS depending on settings.POLYGON_RASTERIZER"""
+
+    cells = _polygon_cells(taxon_key)
+    if cells is None:
+        raise NoPolygonException
+    return cells
+
+
+# run scoped, so cells prefetched for upcoming taxa survive, see prefetch.py.
+# Taxa without a polygon are cached as None, so they aren't queried again
+@cached('polygon_cells', max_entries=8, max_bytes=128 * 2 ** 20)
+def _polygon_cells(taxon_key):
+
+    if settings.POLYGON_RASTERIZER == 'postgis':
+        return _postgis_polygon_cells(taxon_key)
+
+    query = """
+    SELECT ST_ASBINARY(ST_MAKEVALID(ST_SIMPLIFY(geom,.10)))
+        FROM distribution.taxon_extent
+        WHERE taxon_key=:taxon_key
+    """
+
+    with Session() as session:
+        result = session.execute(query, {'taxon_key': taxon_key})
+        geometries = [row[0] for row in result.fetchall() if row[0] is not None]
+
+    cells = [rasterize(wkb) for wkb in geometries]
+    if not any(len(c) for c in cells):
+        return None
+    return np.unique(np.concatenate(cells), axis=0)
+
+polygon_cells_for_taxon.cache = _polygon_cells.cache
+
+
+def _postgis_polygon_cells(taxon_key):
 
     query = """
     WITH dis AS (
@@ -29,9 +65,10 @@ def polygon_cells_for_taxon(taxon_key):
         result = session.execute(query, {'taxon_key': taxon_key})
         data = result.fetchall()
         if len(data) == 0:
-            raise NoPolygonException
+            return None
         return data
 
+@cached('fao_cells', max_entries=8, max_bytes=128 * 2 ** 20)
 def fao_cells_for_taxon(taxon_key):
 
     query = """
@@ -69,14 +106,52 @@ def fao_cells_for_taxon(taxon_key):
         return data
 
 
+def fao_cells_for_taxa(taxon_keys):
+    """fao_cells_for_taxon for many taxa in one query, returns rows of
+    (taxon_key, row, col, value) ordered by taxon_key"""
+
+    query = """
+    SELECT
+        x.taxon_key,
+        x.row,
+        x.col,
+
+        -- clamp to range 0-1
+        CASE WHEN SUM(x.rnd) > 1
+            THEN 1.0
+        ELSE
+            SUM(x.rnd)
+        END
+
+    FROM
+    (
+        SELECT
+            t.taxon_key,
+            MAX(c.cell_row) - 1 as row,
+            MAX(c.cell_col) - 1 as col,
+            (MAX(g.water_area) / MAX(c.water_area)) as rnd
+        FROM taxon_habitat t
+        JOIN geo.simple_area_cell_assignment_raw g
+          ON (g.fao_area_id = ANY (t.found_in_fao_area_id) AND g.marine_layer_id IN (2, 12))
+        JOIN cell c on (g.cell_id = c.cell_id)
+        WHERE t.taxon_key = ANY (:taxon_keys)
+        GROUP by t.taxon_key, g.fao_area_id, g.cell_id
+    ) x
+    GROUP BY x.taxon_key, x.row, x.col
+    ORDER BY x.taxon_key, x.row, x.col
+    """
+
+    with Session() as session:
+        result = session.execute(query, {'taxon_keys': list(taxon_keys)})
+        data = result.fetchall()
+        return data
+
+
 class Taxon(SpecDisModel):
-    __table__ = Table(
-        'taxon',
-        Base.metadata,
-        Column('taxon_key', Integer(), primary_key=True),
-        autoload=True,
-        schema='master'
-    )
+    __tablename__ = 'taxon'
+    __table_args__ = {'schema': 'master'}
+
+    taxon_key = Column(Integer(), primary_key=True)
 
     def __str__(self):
         return str(self.taxonkey)
@@ -87,13 +162,10 @@ class Taxon(SpecDisModel):
 
 
 class TaxonDistributionLog(SpecDisModel):
-    __table__ = Table(
-        'taxon_distribution_log',
-        Base.metadata,
-        Column('taxon_key', Integer(), primary_key=True),
-        autoload=True,
-        schema='distribution'
-    )
+    __tablename__ = 'taxon_distribution_log'
+    __table_args__ = {'schema': 'distribution'}
+
+    taxon_key = Column(Integer(), primary_key=True)
 
     taxon = relationship('Taxon',
         backref = 'distribution_log',
@@ -105,23 +177,17 @@ class TaxonDistributionLog(SpecDisModel):
 
 
 class TaxonExtent(SpecDisModel):
-    __table__ = Table(
-        'taxon_extent',
-        Base.metadata,
-        Column('taxon_key', Integer(), primary_key=True),
-        autoload=True,
-        schema='distribution'
-    )
+    __tablename__ = 'taxon_extent'
+    __table_args__ = {'schema': 'distribution'}
+
+    taxon_key = Column(Integer(), primary_key=True)
 
 
 class TaxonHabitat(SpecDisModel):
-    __table__ = Table(
-        'taxon_habitat',
-        Base.metadata,
-        Column('taxon_key', Integer(), primary_key=True),
-        autoload=True,
-        schema='distribution'
-    )
+    __tablename__ = 'taxon_habitat'
+    __table_args__ = {'schema': 'distribution'}
+
+    taxon_key = Column(Integer(), primary_key=True)
 
     @property
     def faos(self):
@@ -1,19 +1,15 @@
 """ World data source """
 
 from sqlalchemy import Column, Integer
-from sqlalchemy.schema import Table
 from sqlalchemy import and_
-from .db import SpecDisModel, Base, Session
+from .db import SpecDisModel, Session
 
 
 class ValidationRule(SpecDisModel):
-    __table__ = Table(
-        'validation_rule',
-        Base.metadata,
-        Column('rule_id', Integer(), primary_key=True),
-        autoload=True,
-        extend_existing=True
-    )
+    __tablename__ = 'validation_rule'
+    __table_args__ = {'extend_existing': True}
+
+    rule_id = Column(Integer(), primary_key=True)
 
 
 def refresh_validation_rules():
@@ -1,23 +1,21 @@
 """ World data source """
 
-import functools
-
 import numpy as np
 from pyproj import Geod
 from sqlalchemy import Column, Integer
-from sqlalchemy.schema import Table
 
-from .db import Session, SpecDisModel, Base
+from .db import Session, SpecDisModel, reflect
+from ..cache import cached
+
+# world layers are needed by every taxon, the bound is a safety net
+GRID_CACHE_BYTES = 512 * 2 ** 20
 
 
 class GridPoint(SpecDisModel):
-    __table__ = Table(
-        'cell',
-        Base.metadata,
-        Column('cell_id', Integer(), primary_key=True),
-        autoload=True,
-        extend_existing=True
-    )
+    __tablename__ = 'cell'
+    __table_args__ = {'extend_existing': True}
+
+    cell_id = Column(Integer(), primary_key=True)
 
 
 class Grid():
@@ -51,7 +49,7 @@ class Grid():
         return (x + w * y) + 1
 
     @property
-    @functools.lru_cache(maxsize=None)
+    @cached('grid', max_bytes=GRID_CACHE_BYTES, key=lambda self: 'cell_height')
     def cell_height(self):
         cell_height = np.full(self.shape, np.nan)
         geod = Geod(ellps='WGS84')
@@ -67,26 +65,27 @@ class Grid():
         return cell_height
 
     @property
-    @functools.lru_cache(maxsize=None)
+    @cached('grid', max_bytes=GRID_CACHE_BYTES, key=lambda self: 'area_coast')
     def area_coast(self):
         coastal_prop = self.get_grid('coastal_prop')
         return coastal_prop * self.water_area
 
     @property
-    @functools.lru_cache(maxsize=None)
+    @cached('grid', max_bytes=GRID_CACHE_BYTES, key=lambda self: 'area_offshore')
     def area_offshore(self):
         coastal_prop = self.get_grid('coastal_prop')
         # water_area = self.get_grid('area')  # Area <-> WaterArea
         return (1 - coastal_prop) * self.water_area
 
     @property
-    @functools.lru_cache(maxsize=None)
+    @cached('grid', max_bytes=GRID_CACHE_BYTES, key=lambda self: 'water_area')
     def water_area(self):
         percent_water = self.get_grid('percent_water')
         return percent_water / 100 * self.get_grid('total_area')
 
     @property
     def field_names(self):
+        reflect()
         return (c.name for c in GridPoint.__table__.columns)
 
     def rows_to_grid(self, rows, dtype=np.float):
@@ -94,7 +93,6 @@ class Grid():
         grid = np.fromiter(rows, dtype=dtype)
         return grid.reshape(self.shape)
 
-    @functools.lru_cache(maxsize=None)
     def get_grid(self, field='SST'):
         """returns a spatial 2D numpy array of the field specified"""
 
@@ -102,14 +100,19 @@ class Grid():
             # Grid.field exists as a property
             return getattr(self, field)
         else:
-            # need to query the world table
+            return self._query_grid(field)
+
+    @cached('grid', max_bytes=GRID_CACHE_BYTES, key=lambda self, field: field)
+    def _query_grid(self, field):
+        """ reads field from the world table """
+        with Session() as session:
+            # the column is known once the session has reflected the models
             attr = getattr(GridPoint, field)
-            with Session() as session:
-                query = session \
-                    .query(GridPoint) \
-                    .order_by('cell_row', 'cell_col') \
-                    .values(attr)
+            query = session \
+                .query(GridPoint) \
+                .order_by('cell_row', 'cell_col') \
+                .values(attr)
 
-                grid_points = (r[0] for r in query)
+            grid_points = (r[0] for r in query)
 
-            return self.rows_to_grid(grid_points, dtype=attr.type.python_type)
+        return self.rows_to_grid(grid_points, dtype=attr.type.python_type)
@@ -0,0 +1,63 @@
+""" Background prefetch of taxon inputs
+
+Distributing a taxon starts with database queries for its polygon and
+FAO cells, during which the worker sits idle.  A Prefetcher iterates over
+taxon keys while threads run those queries for the next few taxa, so the
+results are waiting in the bounded caches of the query functions by the
+time the filters ask for them, and query latency overlaps with the numpy
+work of the current taxon.  Each query opens its own session.  The caches
+are raised to hold twice the taxa in flight, so prefetched results aren't
+evicted before their taxon runs.
+
+The taxon and taxon_habitat rows aren't among the INPUTS: before iterating,
+distribution.create_taxon_distributions loads those of the whole batch
+into its session's identity map with distribution.prefetch_taxa, one query
+per table, and the filters' session.query(...).get() calls are answered
+from there.  Only a taxon missing a row queries the database again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+
+from .models.taxa import polygon_cells_for_taxon, fao_cells_for_taxon
+
+logger = logging.getLogger(__name__)
+
+# cached functions of a taxon key reading its inputs from the database
+INPUTS = (polygon_cells_for_taxon, fao_cells_for_taxon)
+
+
+class Prefetcher():
+    """ iterates over taxon_keys, fetching the inputs of the next depth taxa
+    in the background """
+
+    def __init__(self, taxon_keys, depth=2):
+        self.taxon_keys = list(taxon_keys)
+        self.depth = depth
+        self.futures = {}
+
+        for f in INPUTS:
+            if hasattr(f, 'cache'):
+                f.cache.reserve(2 * (depth + 1))
+
+    def _submit(self, executor, taxon_key):
+        if taxon_key not in self.futures:
+            self.futures[taxon_key] = [executor.submit(f, taxon_key) for f in INPUTS]
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=len(INPUTS) * self.depth)
+        try:
+            for i, taxon_key in enumerate(self.taxon_keys):
+                for next_key in self.taxon_keys[i:i + self.depth + 1]:
+                    self._submit(executor, next_key)
+
+                # errors, like a missing polygon, are raised again when the
+                # filters call the input functions themselves
+                wait(self.futures.pop(taxon_key))
+                logger.debug('inputs of taxon {} ready'.format(taxon_key))
+                yield taxon_key
+        finally:
+            for futures in self.futures.values():
+                for future in futures:
+                    future.cancel()
+            executor.shutdown()
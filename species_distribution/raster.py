@@ -0,0 +1,195 @@
+""" Rasterization of taxon extent geometries onto the half degree grid
+
+polygon_cells_for_taxon used to intersect a taxon's extent with every
+polygon of distribution.grid in PostGIS.  Here the extent is fetched once
+as WKB and the cells are computed in process, so the work moves from the
+database server to the workers.
+
+A cell intersects a geometry when the geometry's boundary passes through
+or touches the cell, or when the cell lies inside a polygon of it.  Both
+are computed on grid coordinates, u = columns east of 180W and v = rows
+south of 90N, where cell (row, col) is the closed square
+[col, col + 1] x [row, row + 1]:
+
+    - every edge is cut into the rows it touches and each piece marks the
+      columns it touches
+    - a scanline through the middle of each row finds the crossings of
+      the polygon edges, and the cells whose centers lie between pairs
+      of crossings are inside, even-odd over all rings
+
+Geometries within -180..180 keep their columns on the grid, as the SQL
+did.  Geometries crossing the antimeridian, with longitudes past 180 or
+-180, have their columns wrapped around the grid.
+"""
+
+import struct
+
+import numpy as np
+
+ROWS = 360
+COLUMNS = 720
+RESOLUTION = .5
+
+POINT, LINESTRING, POLYGON, MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION = range(1, 8)
+
+
+class WKBReader():
+    """ reads the rings and paths of a WKB or EWKB geometry as arrays of
+    (longitude, latitude) """
+
+    def __init__(self, wkb):
+        self.wkb = bytes(wkb)
+        self.offset = 0
+        self.rings = []
+        self.paths = []
+
+    def _unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.wkb, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def _points(self, order, dimensions):
+        n, = self._unpack(order + 'I')
+        points = np.frombuffer(self.wkb, dtype=order + 'f8', count=n * dimensions, offset=self.offset)
+        self.offset += 8 * n * dimensions
+        return points.reshape(n, dimensions)[:, :2].astype(float)
+
+    def read(self):
+        order = '<' if self._unpack('B')[0] == 1 else '>'
+        code, = self._unpack(order + 'I')
+
+        # EWKB flags, then ISO WKB thousands, for Z and M coordinates
+        dimensions = 2 + bool(code & 0x80000000) + bool(code & 0x40000000)
+        if code & 0x20000000:
+            self._unpack(order + 'I')  # srid
+        code &= 0x0fffffff
+        dimensions += {1: 1, 2: 1, 3: 2}.get(code // 1000, 0)
+        kind = code % 1000
+
+        if kind == POINT:
+            self.paths.append(np.array([self._unpack(order + 'd' * dimensions)[:2]]))
+        elif kind == LINESTRING:
+            self.paths.append(self._points(order, dimensions))
+        elif kind == POLYGON:
+            n, = self._unpack(order + 'I')
+            self.rings.extend(self._points(order, dimensions) for _ in range(n))
+        elif kind in (MULTIPOINT, MULTILINESTRING, MULTIPOLYGON, GEOMETRYCOLLECTION):
+            n, = self._unpack(order + 'I')
+            for _ in range(n):
+                self.read()
+        else:
+            raise ValueError('unsupported WKB geometry type {}'.format(code))
+        return self
+
+
+def _grid_coordinates(points):
+    u = (points[:, 0] + 180) / RESOLUTION
+    v = (90 - points[:, 1]) / RESOLUTION
+    return u, v
+
+
+def _segments(lines):
+    """ returns u0, v0, u1, v1 of the segments of lines, a single point
+    being a segment of length 0 """
+
+    segments = []
+    for line in lines:
+        u, v = _grid_coordinates(line)
+        if len(u) == 1:
+            u = np.repeat(u, 2)
+            v = np.repeat(v, 2)
+        segments.append(np.stack([u[:-1], v[:-1], u[1:], v[1:]], axis=1))
+    if not segments:
+        return np.empty((4, 0))
+    return np.concatenate(segments).T
+
+
+def _touched_range(low, high):
+    """ first and last integer cell whose closed unit interval touches [low, high] """
+    return np.ceil(low).astype(int) - 1, np.floor(high).astype(int)
+
+
+def _expand(first, last):
+    """ returns (indexes into first, values) of every integer in first..last """
+    counts = np.maximum(last - first + 1, 0)
+    owner = np.repeat(np.arange(len(first)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, first[owner] + np.arange(counts.sum()) - starts
+
+
+def boundary_cells(lines):
+    """ returns rows, columns of the cells touched by the segments of lines """
+
+    u0, v0, u1, v1 = _segments(lines)
+
+    first, last = _touched_range(np.minimum(v0, v1), np.maximum(v0, v1))
+    first = np.maximum(first, 0)
+    last = np.minimum(last, ROWS - 1)
+    segment, rows = _expand(first, last)
+    u0, v0, u1, v1 = u0[segment], v0[segment], u1[segment], v1[segment]
+
+    # the part of each segment within its row, as a parameter range along it
+    dv = v1 - v0
+    flat = dv == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_top = np.where(flat, 0, (rows - v0) / dv)
+        t_bottom = np.where(flat, 1, (rows + 1 - v0) / dv)
+    t_low = np.clip(np.minimum(t_top, t_bottom), 0, 1)
+    t_high = np.clip(np.maximum(t_top, t_bottom), 0, 1)
+    ua = u0 + t_low * (u1 - u0)
+    ub = u0 + t_high * (u1 - u0)
+
+    first, last = _touched_range(np.minimum(ua, ub), np.maximum(ua, ub))
+    piece, columns = _expand(first, last)
+    return rows[piece], columns
+
+
+def interior_cells(rings):
+    """ returns rows, columns of the cells whose centers are inside rings, even-odd """
+
+    u0, v0, u1, v1 = _segments(rings)
+
+    # rows whose middle line v = row + .5 each edge crosses, half open so
+    # a vertex on the line counts once
+    first = np.ceil(np.minimum(v0, v1) - .5).astype(int)
+    last = np.ceil(np.maximum(v0, v1) - .5).astype(int) - 1
+    first = np.maximum(first, 0)
+    last = np.minimum(last, ROWS - 1)
+    edge, rows = _expand(first, last)
+    u0, v0, u1, v1 = u0[edge], v0[edge], u1[edge], v1[edge]
+    crossings = u0 + (rows + .5 - v0) * (u1 - u0) / (v1 - v0)
+
+    # every row has an even number of crossings, so sorted by row then
+    # longitude, consecutive crossings pair up into runs inside
+    order = np.lexsort((crossings, rows))
+    rows = rows[order][::2]
+    crossings = crossings[order].reshape(-1, 2)
+
+    first = np.ceil(crossings[:, 0] - .5).astype(int)
+    last = np.floor(crossings[:, 1] - .5).astype(int)
+    run, columns = _expand(first, last)
+    return rows[run], columns
+
+
+def rasterize(wkb):
+    """ returns a sorted (N, 2) array of the (row, col) cells of the grid
+    intersecting the geometry wkb """
+
+    geometry = WKBReader(wkb).read()
+    lines = geometry.rings + geometry.paths
+    if not lines:
+        return np.empty((0, 2), dtype=int)
+
+    boundary_rows, boundary_columns = boundary_cells(lines)
+    inside_rows, inside_columns = interior_cells(geometry.rings)
+    rows = np.concatenate([boundary_rows, inside_rows])
+    columns = np.concatenate([boundary_columns, inside_columns])
+
+    longitudes = np.concatenate([line[:, 0] for line in lines])
+    if longitudes.min() < -180 or longitudes.max() > 180:
+        columns = columns % COLUMNS
+    else:
+        columns = np.clip(columns, 0, COLUMNS - 1)
+
+    cells = np.unique(rows * COLUMNS + columns)
+    return np.stack([cells // COLUMNS, cells % COLUMNS], axis=1)
@@ -0,0 +1,143 @@
+""" PNG and GIF rendering of distribution grids
+
+Colors are looked up in a precomputed 256 entry RGBA table with plain
+numpy indexing, so rendering doesn't need to import matplotlib.  Images
+carry a hash of the array they were rendered from, which lets a
+re-render of an unchanged grid be skipped.
+"""
+
+import hashlib
+import logging
+from multiprocessing import Pool
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# matplotlib's 'jet' segment data, (x, y0, y1) per channel
+_jet_data = {
+    'red': ((0., 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1, 0.5, 0.5)),
+    'green': ((0., 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1, 0, 0)),
+    'blue': ((0., 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1, 0, 0)),
+}
+
+HASH_KEY = 'source-sha1'
+
+
+def segmented_lut(segment_data, n=256):
+    """returns an (n, 4) uint8 RGBA lookup table built from matplotlib style
+    segment data. Values match matplotlib's colormap(x) * 255 cast to uint8"""
+
+    channels = []
+    for color in ('red', 'green', 'blue'):
+        adata = np.array(segment_data[color], dtype=float)
+        x = adata[:, 0] * (n - 1)
+        y0 = adata[:, 1]
+        y1 = adata[:, 2]
+
+        xind = (n - 1) * np.linspace(0, 1, n)
+        ind = np.searchsorted(x, xind)[1:-1]
+        distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+        channel = np.concatenate([
+            [y1[0]],
+            distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1],
+            [y0[-1]],
+        ])
+        channels.append(np.clip(channel, 0, 1))
+
+    channels.append(np.ones(n))
+    lut = np.stack(channels, axis=-1) * 255
+    return lut.astype(np.uint8)
+
+
+JET = segmented_lut(_jet_data)
+
+
+def colorize(array, lut=JET):
+    """maps a 2d array of values 0-1 to an RGBA uint8 image array through lut.
+
+    Masked and NaN values are fully transparent, values outside 0-1 are
+    clamped to the ends of the table"""
+
+    n = lut.shape[0]
+    data = np.ma.filled(np.ma.asarray(array, dtype=float), np.nan)
+    bad = np.isnan(data)
+
+    scaled = data * n
+    scaled[bad] = 0
+    index = np.clip(scaled, 0, n - 1).astype(np.intp)
+
+    rgba = lut[index]
+    rgba[bad] = 0
+    return rgba
+
+
+def source_hash(array, *extra):
+    """returns a hex digest of the values, mask and shape of array, and any
+    extra render parameters"""
+
+    array = np.ma.asarray(array)
+    h = hashlib.sha1()
+    h.update(str((array.shape, array.dtype.str) + extra).encode('ascii'))
+    h.update(np.ascontiguousarray(array.data).tobytes())
+    h.update(np.packbits(np.ma.getmaskarray(array)).tobytes())
+    return h.hexdigest()
+
+
+def _existing_hash(fname):
+    from PIL import Image
+
+    try:
+        with Image.open(fname) as image:
+            return image.text.get(HASH_KEY)
+    except (OSError, AttributeError):
+        return None
+
+
+def render_png(array, fname, enhance=False, lut=JET, force=False):
+    """writes array to fname as a colorized PNG. Returns False without
+    writing if fname was already rendered from identical data"""
+
+    from PIL import Image, ImageOps
+    from PIL.PngImagePlugin import PngInfo
+
+    digest = source_hash(array, enhance, hashlib.sha1(lut.tobytes()).hexdigest())
+    if not force and os.path.isfile(fname) and _existing_hash(fname) == digest:
+        logger.debug('{} is up to date, skipping'.format(fname))
+        return False
+
+    logger.debug('writing {}'.format(fname))
+    image = Image.fromarray(colorize(array, lut))
+    if enhance:
+        image = ImageOps.equalize(image)
+        image = ImageOps.autocontrast(image)
+
+    info = PngInfo()
+    info.add_text(HASH_KEY, digest)
+    image.save(fname, pnginfo=info)
+    return True
+
+
+def render_gif(arrays, fname, duration=500, lut=JET):
+    """writes a looping animated GIF with one frame per array"""
+
+    from PIL import Image
+
+    frames = [Image.fromarray(colorize(a, lut)) for a in arrays]
+    frames[0].save(fname, save_all=True, append_images=frames[1:], duration=duration, loop=0)
+    logger.debug('wrote {}'.format(fname))
+
+
+def _render_png_star(args):
+    array, fname, kwargs = args
+    return render_png(array, fname, **kwargs)
+
+
+def render_many(jobs, processes=None, **kwargs):
+    """renders (array, fname) jobs to PNG in a process pool. kwargs are passed
+    to render_png. Returns the number of images actually written"""
+
+    tasks = ((array, fname, kwargs) for array, fname in jobs)
+    with Pool(processes=processes) as pool:
+        return sum(pool.imap_unordered(_render_png_star, tasks, chunksize=4))
@@ -0,0 +1,51 @@
+""" Scatter-max of kernels into a grid
+
+Distance based filters spread a kernel around many cells and keep the
+largest value wherever footprints overlap.  scatter_max applies a kernel
+at a batch of positions on plain arrays, a maximum over a window view of
+the grid per position, with the kernel's mask as the where argument.
+Positions whose footprint crosses the right edge take their columns
+through modular indexes, so footprints wrap around the grid.
+"""
+
+import numpy as np
+
+
+def scatter_max(data, covered, rows, columns, kernel):
+    """ merges the masked array kernel into data with its top left corner at
+    each (rows[n], columns[n]), keeping the maximum of data and kernel values,
+    and sets covered where the kernel is unmasked.  Columns wrap around the
+    width of data.  Positions where the kernel would extend past the top or
+    bottom of data are skipped.  data and covered are 2d arrays modified in
+    place, returns the number of positions applied """
+
+    height, width = data.shape
+    kernel_height, kernel_width = kernel.shape
+    values = np.ma.getdata(kernel)
+    footprint = ~np.ma.getmaskarray(kernel)
+
+    rows = np.asarray(rows, dtype=np.intp)
+    columns = np.asarray(columns, dtype=np.intp) % width
+
+    inside = (rows >= 0) & (rows + kernel_height <= height)
+    rows = rows[inside]
+    columns = columns[inside]
+    wraps = columns + kernel_width > width
+
+    # footprints within the grid are merged through window views
+    for row, column in zip(rows[~wraps], columns[~wraps]):
+        _slice = np.index_exp[row:row + kernel_height, column:column + kernel_width]
+        view = data[_slice]
+        np.maximum(view, values, out=view, where=footprint)
+        covered[_slice] |= footprint
+
+    # the others through their wrapped column indexes
+    offsets = np.arange(kernel_width)
+    for row, column in zip(rows[wraps], columns[wraps]):
+        _slice = np.index_exp[row:row + kernel_height, (column + offsets) % width]
+        view = data[_slice]
+        np.maximum(view, values, out=view, where=footprint)
+        data[_slice] = view
+        covered[_slice] |= footprint
+
+    return len(rows)
@@ -1,41 +1,73 @@
 from datetime import datetime
 import functools
+from io import BytesIO
 import logging
 import os
+import re
 
 import numpy as np
 
 from .models.db import Session
 from .utils import IteratorFile
+from . import blob
+from . import cache
+from . import render
 from . import settings
+from . import sparse
 
 logger = logging.getLogger(__name__)
 
+SHAPE = (360, 720)
+
+# (table, taxon_key): sparse payload of a loaded distribution, or None
+LOADED = cache.get_cache('loaded_distributions', max_bytes=256 * 2 ** 20)
+
+_missing = object()
+
+# taxa per query of load_distributions
+LOAD_CHUNK_SIZE = 64
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+# a row of COPY (SELECT taxon_key::int4, cell_id::int4, relative_abundance::float8) binary output
+COPY_ROW = np.dtype([
+    ('fields', '>i2'),
+    ('taxon_key_length', '>i4'), ('taxon_key', '>i4'),
+    ('cell_id_length', '>i4'), ('cell_id', '>i4'),
+    ('value_length', '>i4'), ('value', '>f8'),
+])
+
+# pg_class relkind of views a rebuild recreates
+VIEW_KINDS = {'v': 'VIEW', 'm': 'MATERIALIZED VIEW'}
+
 
 def save_image(array, name, enhance=False):
-    """saves 2d array of values 0-1 to a grayscale PNG"""
+    """saves 2d array of values 0-1 to a colorized PNG"""
 
     if (array is None) or array.count() == 0:
         return
 
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from PIL import Image, ImageOps
-
     if not os.path.isdir(settings.PNG_DIR):
         os.makedirs(settings.PNG_DIR)
 
     png = os.path.join(settings.PNG_DIR, str(name) + '.png')
-    logger.debug('writing {}'.format(png))
+    render.render_png(array, png, enhance=enhance)
+
 
-    array = plt.cm.jet(array) * 255
-    array = array.astype(np.uint8)
-    image = Image.fromarray(array)
-    if enhance:
-        image = ImageOps.equalize(image)
-        image = ImageOps.autocontrast(image)
-    image.save(png)
+def _copy_distribution(cursor, table, distribution, taxonkey):
+    """ copies the cells of distribution into table """
+
+    ravel = distribution.ravel()
+    # don't include values which are NaN, masked, or smaller than machine epsilon
+    # (approximately 0 valued)
+    indexes = np.where(~(np.isnan(ravel) | ravel.mask | (ravel <= np.finfo(float).eps).mask))[0]
+
+    def records():
+        for seq, value in zip(indexes + 1, ravel[indexes]):
+            yield '{}\t{}\t{}\n'.format(taxonkey, seq, value)
+
+    f = IteratorFile(records())
+    cursor.copy_from(f, table, columns=('taxon_key', 'cell_id', 'relative_abundance'))
 
 
 def save_database(distribution, taxonkey):
@@ -49,35 +81,265 @@ def save_database(distribution, taxonkey):
         cursor = raw_conn.cursor()
         cursor.execute("DELETE FROM taxon_distribution WHERE taxon_key = %s", (taxonkey, ))
 
-        ravel = distribution.ravel()
-        # don't include values which are NaN, masked, or smaller than machine epsilon
-        # (approximately 0 valued)
-        indexes = np.where(~(np.isnan(ravel) | ravel.mask | (ravel <= np.finfo(float).eps).mask))[0]
+        _copy_distribution(cursor, 'taxon_distribution', distribution, taxonkey)
+        _log_saved(cursor, taxonkey)
+
+        raw_conn.commit()
+    LOADED.discard(('taxon_distribution', taxonkey))
+
+
+def save_blob(distribution, taxonkey):
+    """ saves distribution as one row of taxon_distribution_blob, see blob.py """
+
+    data = blob.encode(distribution)
+    with Session() as session:
+        raw_conn = session.connection().connection
+        cursor = raw_conn.cursor()
+        cursor.execute("DELETE FROM taxon_distribution_blob WHERE taxon_key = %s", (taxonkey, ))
+        cursor.execute("""
+            INSERT INTO taxon_distribution_blob (taxon_key, version, cell_count, data)
+            VALUES (%s, %s, %s, %s)
+            """, (taxonkey, blob.VERSION, blob.read_header(data).cells, data))
+        _log_saved(cursor, taxonkey)
+
+        raw_conn.commit()
+    LOADED.discard(('taxon_distribution_blob', taxonkey))
+
+
+def _log_saved(cursor, taxonkey):
+    # update log. Postgres doesn't have UPSERT until 9.5
+    # This might not be totally thread safe, see
+    # master.lookup_* functions in integration-database
+    # for other solutions
+
+    cursor.execute("UPDATE taxon_distribution_log SET modified_timestamp=%s WHERE taxon_key=%s", (datetime.now(), taxonkey))
+    if cursor.rowcount == 0:
+        # UPDATE didn't find anything, so INSERT
+        logger.debug('inserting new row in taxon_distribution_log')
+        cursor.execute("""
+            INSERT INTO taxon_distribution_log (taxon_key, modified_timestamp)
+            VALUES (%s, %s)
+            """, (taxonkey, datetime.now()))
+    else:
+        logger.debug('updated taxon_distribution_log')
+
+
+class Rebuild():
+    """ rebuilds taxon_distribution in a shadow table, swapped in at the end
+
+    Saving a taxon into the live table deletes and inserts rows of a large
+    indexed table, maintaining its indexes row by row, and readers see it
+    half updated for the length of the run.  A rebuild copies each taxon
+    into taxon_distribution_rebuild, which has no indexes, and records it
+    in taxon_distribution_log_rebuild.  finish() then:
+
+        - copies the rows of taxa the run didn't save from the live table
+        - builds the live table's indexes and constraints once
+        - in one transaction, renames the live table to
+          taxon_distribution_previous, replacing an older one, renames the
+          shadow table to taxon_distribution and updates taxon_distribution_log
+
+    The shadow table takes the live table's defaults, constraints, comments
+    and storage settings, and the swap carries over its foreign keys and
+    privileges.  Views on the live table, and views on those, are dropped
+    and recreated on the new table in the swap, with their owners and
+    privileges.  Nothing else should write taxon_distribution during a
+    rebuild.  An interrupted
+    rebuild is continued by beginning it with resume=True, which keeps the
+    shadow tables.
+    """
+
+    def __init__(self, table='taxon_distribution'):
+        self.table = table
+        self.shadow = table + '_rebuild'
+        self.previous = table + '_previous'
+        self.log = table + '_log_rebuild'
+
+    def begin(self, resume=False):
+        with Session() as session:
+            raw_conn = session.connection().connection
+            cursor = raw_conn.cursor()
+            if not resume:
+                cursor.execute('DROP TABLE IF EXISTS {}, {}'.format(self.shadow, self.log))
+            # everything but the indexes, which finish() builds
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS {} (
+                    LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS INCLUDING STORAGE
+                )'''.format(self.shadow, self.table))
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    taxon_key int PRIMARY KEY,
+                    modified_timestamp timestamp NOT NULL
+                )""".format(self.log))
+            raw_conn.commit()
+        logger.info('rebuilding {} in {}'.format(self.table, self.shadow))
+
+    def save(self, distribution, taxonkey):
+        with Session() as session:
+            raw_conn = session.connection().connection
+            cursor = raw_conn.cursor()
+
+            # only a taxon saved again, after a resume, pays for a scan of the shadow table
+            cursor.execute('DELETE FROM {} WHERE taxon_key = %s'.format(self.log), (taxonkey, ))
+            if cursor.rowcount:
+                cursor.execute('DELETE FROM {} WHERE taxon_key = %s'.format(self.shadow), (taxonkey, ))
 
-        def records():
-            for seq, value in zip(indexes + 1, ravel[indexes]):
-                yield '{}\t{}\t{}\n'.format(taxonkey, seq, value)
+            _copy_distribution(cursor, self.shadow, distribution, taxonkey)
+            cursor.execute(
+                'INSERT INTO {} (taxon_key, modified_timestamp) VALUES (%s, %s)'.format(self.log),
+                (taxonkey, datetime.now())
+            )
+            raw_conn.commit()
+        LOADED.discard((self.shadow, taxonkey))
 
-        f = IteratorFile(records())
-        cursor.copy_from(f, 'taxon_distribution', columns=('taxon_key', 'cell_id', 'relative_abundance'))
+    def _indexes(self, cursor):
+        """ returns (name, definition, constraint type or None) of the live table's indexes """
+        cursor.execute("""
+            SELECT i.indexname, i.indexdef, c.contype
+            FROM pg_indexes i
+            LEFT JOIN pg_constraint c
+              ON c.conname = i.indexname AND c.conrelid = %s::regclass
+            WHERE i.tablename = %s AND i.schemaname = current_schema()
+            """, (self.table, self.table))
+        return cursor.fetchall()
 
-        # update log. Postgres doesn't have UPSERT until 9.5
-        # This might not be totally thread safe, see
-        # master.lookup_* functions in integration-database
-        # for other solutions
+    def _sequences(self, cursor):
+        """ returns (column, sequence) of the live table's serial columns """
+        cursor.execute("""
+            SELECT attname, pg_get_serial_sequence(%s, attname)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            """, (self.table, self.table))
+        return [(column, sequence) for column, sequence in cursor.fetchall() if sequence]
 
-        cursor.execute("UPDATE taxon_distribution_log SET modified_timestamp=%s WHERE taxon_key=%s", (datetime.now(), taxonkey))
-        if cursor.rowcount == 0:
-            # UPDATE didn't find anything, so INSERT
-            logger.debug('inserting new row in taxon_distribution_log')
+    def _foreign_keys(self, cursor):
+        """ returns (name, definition) of the live table's foreign keys """
+        cursor.execute("""
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """, (self.table, ))
+        return cursor.fetchall()
+
+    def _views(self, cursor):
+        """ returns (name, kind, definition, owner) of the views depending on
+        the live table, directly or through other views, in dependency order """
+        cursor.execute("""
+            WITH RECURSIVE dependent(oid, depth) AS (
+                SELECT r.ev_class, 1
+                FROM pg_depend d
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+                  AND d.refobjid = %s::regclass AND r.ev_class <> d.refobjid
+              UNION
+                SELECT r.ev_class, v.depth + 1
+                FROM dependent v
+                JOIN pg_depend d ON d.refobjid = v.oid
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+                  AND r.ev_class <> v.oid
+            )
+            SELECT c.oid::regclass::text, c.relkind, pg_get_viewdef(c.oid), quote_ident(pg_get_userbyid(c.relowner))
+            FROM (SELECT oid, max(depth) AS depth FROM dependent GROUP BY oid) v
+            JOIN pg_class c ON c.oid = v.oid
+            ORDER BY v.depth, c.oid
+            """, (self.table, ))
+        return cursor.fetchall()
+
+    def _grants(self, cursor, relation=None):
+        """ returns (grantee, privilege, grantable) of the privileges on relation,
+        the live table by default """
+        cursor.execute("""
+            SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(r.rolname) END,
+                a.privilege_type, a.is_grantable
+            FROM pg_class c
+            CROSS JOIN aclexplode(c.relacl) a
+            LEFT JOIN pg_roles r ON r.oid = a.grantee
+            WHERE c.oid = %s::regclass
+            """, (relation or self.table, ))
+        return cursor.fetchall()
+
+    def _grant(self, cursor, relation, grants):
+        for grantee, privilege, grantable in grants:
+            cursor.execute('GRANT {} ON {} TO {}{}'.format(
+                privilege, relation, grantee, grantable and ' WITH GRANT OPTION' or ''))
+
+    def _index_definition(self, definition, name):
+        """ definition of the index name on the live table, for the shadow table """
+        pattern = r'^(CREATE (?:UNIQUE )?INDEX )\S+( ON (?:ONLY )?)\S+'
+        return re.sub(pattern, r'\g<1>{}_rebuild\g<2>{}'.format(name, self.shadow), definition)
+
+    def finish(self):
+        with Session() as session:
+            raw_conn = session.connection().connection
+            cursor = raw_conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO {shadow}
+                SELECT * FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM {log} l WHERE l.taxon_key = t.taxon_key)
+                """.format(shadow=self.shadow, table=self.table, log=self.log))
+            logger.info('copied {} rows of taxa not rebuilt'.format(cursor.rowcount))
+
+            indexes = self._indexes(cursor)
+            for name, definition, constraint in indexes:
+                logger.info('building index {}'.format(name))
+                cursor.execute(self._index_definition(definition, name))
+                if constraint in ('p', 'u'):
+                    cursor.execute('ALTER TABLE {} ADD CONSTRAINT {}_rebuild {} USING INDEX {}_rebuild'.format(
+                        self.shadow, name, 'PRIMARY KEY' if constraint == 'p' else 'UNIQUE', name))
+            cursor.execute('ANALYZE {}'.format(self.shadow))
+            raw_conn.commit()
+
+            # the swap, readers see the old or the new table
+            cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(self.table))
+            sequences = self._sequences(cursor)
+            foreign_keys = self._foreign_keys(cursor)
+            grants = self._grants(cursor)
+            # views would follow the renamed table, and keep the next rebuild from dropping it
+            views = self._views(cursor)
+            view_grants = [self._grants(cursor, name) for name, _, _, _ in views]
+            for name, kind, _, _ in reversed(views):
+                cursor.execute('DROP {} {}'.format(VIEW_KINDS[kind], name))
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(self.previous))
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(self.table, self.previous))
+            for name, _, _ in indexes:
+                cursor.execute('ALTER INDEX {0} RENAME TO {0}_previous'.format(name))
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(self.shadow, self.table))
+            for name, _, _ in indexes:
+                cursor.execute('ALTER INDEX {0}_rebuild RENAME TO {0}'.format(name))
+            # the shadow table's defaults use the sequences, which would be
+            # dropped with the previous table by the next rebuild
+            for column, sequence in sequences:
+                cursor.execute('ALTER SEQUENCE {} OWNED BY {}.{}'.format(sequence, self.table, column))
+            # foreign keys are checked after the swap, so readers aren't locked out meanwhile
+            for name, definition in foreign_keys:
+                cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID'.format(self.table, name, definition))
+            self._grant(cursor, self.table, grants)
+            for (name, kind, definition, owner), granted in zip(views, view_grants):
+                cursor.execute('CREATE {} {} AS {}'.format(VIEW_KINDS[kind], name, definition.rstrip().rstrip(';')))
+                cursor.execute('ALTER {} {} OWNER TO {}'.format(VIEW_KINDS[kind], name, owner))
+                self._grant(cursor, name, granted)
+
+            cursor.execute("""
+                UPDATE taxon_distribution_log t SET modified_timestamp = l.modified_timestamp
+                FROM {log} l WHERE l.taxon_key = t.taxon_key
+                """.format(log=self.log))
             cursor.execute("""
                 INSERT INTO taxon_distribution_log (taxon_key, modified_timestamp)
-                VALUES (%s, %s)
-                """, (taxonkey, datetime.now()))
-        else:
-            logger.debug('updated taxon_distribution_log')
+                SELECT l.taxon_key, l.modified_timestamp FROM {log} l
+                WHERE NOT EXISTS (SELECT 1 FROM taxon_distribution_log t WHERE t.taxon_key = l.taxon_key)
+                """.format(log=self.log))
+            cursor.execute('DROP TABLE {}'.format(self.log))
+            raw_conn.commit()
 
-        raw_conn.commit()
+            for name, _ in foreign_keys:
+                cursor.execute('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(self.table, name))
+            raw_conn.commit()
+
+        # every table changed name
+        LOADED.clear()
+        logger.info('swapped {} into {}, the old table is {}'.format(self.shadow, self.table, self.previous))
 
 
 @functools.lru_cache()
@@ -89,3 +351,99 @@ def completed_taxon():
         """
         result = session.execute(query)
         return [x[0] for x in result]
+
+
+def decode_copy(data):
+    """ returns taxon_key, cell_id and relative_abundance arrays of the rows of
+    the binary COPY output data, see COPY_ROW """
+
+    if data[:len(COPY_SIGNATURE)] != COPY_SIGNATURE:
+        raise ValueError('not binary COPY output')
+
+    # signature, flags, header extension length and extension, rows, then a -1 trailer
+    start = len(COPY_SIGNATURE) + 8 + int.from_bytes(data[len(COPY_SIGNATURE) + 4:len(COPY_SIGNATURE) + 8], 'big')
+    body = memoryview(data)[start:len(data) - 2]
+    if len(body) % COPY_ROW.itemsize:
+        raise ValueError('unexpected binary COPY row size')
+
+    rows = np.frombuffer(body, dtype=COPY_ROW)
+    if not (
+        (rows['fields'] == 3).all() and (rows['taxon_key_length'] == 4).all()
+        and (rows['cell_id_length'] == 4).all() and (rows['value_length'] == 8).all()
+    ):
+        raise ValueError('unexpected binary COPY fields')
+
+    return rows['taxon_key'].astype(np.int64), rows['cell_id'].astype(np.int64), rows['value'].astype(float)
+
+
+def _query_rows(cursor, table, taxon_keys):
+    """ returns {taxon_key: sparse payload} of taxon_keys found in the row table """
+
+    buffer = BytesIO()
+    cursor.copy_expert(cursor.mogrify("""
+        COPY (
+            SELECT taxon_key::int4, cell_id::int4, relative_abundance::float8 FROM {}
+            WHERE taxon_key = ANY(%s) AND relative_abundance IS NOT NULL
+        ) TO STDOUT WITH (FORMAT binary)
+        """.format(table), (list(taxon_keys), )).decode(), buffer)
+    keys, cells, values = decode_copy(buffer.getbuffer())
+
+    # rows come in no particular order, group them by taxon in cell order
+    order = np.lexsort((cells, keys))
+    keys, cells, values = keys[order], cells[order], values[order]
+    found, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    return {
+        int(key): (SHAPE, (cells[start:end] - 1).astype(np.int32), values[start:end])
+        for key, start, end in zip(found, starts, ends)
+    }
+
+
+def _query_blobs(cursor, taxon_keys):
+    """ returns {taxon_key: sparse payload} of taxon_keys found in taxon_distribution_blob """
+
+    cursor.execute("SELECT taxon_key, data FROM taxon_distribution_blob WHERE taxon_key = ANY(%s)", (list(taxon_keys), ))
+    return {key: blob.decode_cells(data) for key, data in cursor}
+
+
+def load_distributions(taxon_keys, table=None):
+    """ yields (taxon_key, distribution) of taxon_keys, in order, as saved by
+    save_database.  Distributions are masked outside their saved cells and None
+    for taxa without any.
+
+    table names a table of rows like taxon_distribution, by default
+    distributions are read from the storage of settings.STORAGE.  Rows are
+    fetched by binary COPY and decoded with numpy, several taxa per query.
+    Loaded distributions are kept in the LOADED cache, saving a taxon in this
+    process evicts it.
+    """
+
+    if table is not None and not re.match(r'^[\w.]+$', table):
+        raise ValueError('invalid table name {}'.format(table))
+    source = table or ('taxon_distribution_blob' if settings.STORAGE == 'blob' else 'taxon_distribution')
+
+    taxon_keys = list(taxon_keys)
+    for i in range(0, len(taxon_keys), LOAD_CHUNK_SIZE):
+        chunk = taxon_keys[i:i + LOAD_CHUNK_SIZE]
+
+        payloads = {key: LOADED.get((source, key), _missing) for key in chunk}
+        missing = sorted(set(key for key, payload in payloads.items() if payload is _missing))
+        if missing:
+            with Session() as session:
+                cursor = session.connection().connection.cursor()
+                if table is None and settings.STORAGE == 'blob':
+                    found = _query_blobs(cursor, missing)
+                else:
+                    found = _query_rows(cursor, source, missing)
+            for key in missing:
+                payloads[key] = found.get(key)
+                LOADED.put((source, key), payloads[key])
+
+        for key in chunk:
+            yield key, sparse.unpack(payloads[key])
+
+
+def load_distribution(taxon_key, table=None):
+    """ returns the saved distribution of taxon_key, see load_distributions """
+    for _, distribution in load_distributions([taxon_key], table):
+        return distribution
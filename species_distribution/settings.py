@@ -17,6 +17,19 @@ settings = {
     'NUMPY_WARNINGS': 'warn',
     'PNG_DIR': 'png',
 
+    # 'local' rasterizes taxon extents in process, see raster.py, or 'postgis'
+    'POLYGON_RASTERIZER': 'local',
+
+    # threads computing the filters and habitats of a taxon, see threads.py
+    'THREADS': 0,
+
+    # 'rows' saves a row per cell to taxon_distribution, 'blob' a row per
+    # taxon to taxon_distribution_blob, see blob.py
+    'STORAGE': 'rows',
+
+    # directory sharing filter outputs between processes and runs, see memo.py
+    'FILTER_CACHE_DIR': None,
+
     'DB': {
         'username': 'sau_int',
         'password': 'sau_int',
@@ -25,24 +38,29 @@ settings = {
         'db': 'sau_int'
     },
 
+    # coordinator / worker runs, see cluster.py.  There is no default
+    # authkey, anyone who knows it can run code on the coordinator.  A taxon
+    # whose worker stops reporting for lease seconds is served again up to
+    # retries times
+    'CLUSTER': {
+        'port': 50000,
+        'authkey': None,
+        'lease': 600,
+        'retries': 2
+    },
+
     'USER_SETTINGS_DIR': user_settings_dir,
     'USER_SETTINGS_FILE': user_settings_file
 }
 
 locals().update(settings)
 
-# override with user settings in ./species-distribution/.settings.json
-try:
-
-    if not os.path.isdir(user_settings_dir):
-        os.makedirs(user_settings_dir)
-
-    if not os.path.isfile(user_settings_file):
-        with open(user_settings_file, 'w') as f:
-            json.dump(settings, f, indent=4)
-
-    user_settings = json.load(open(user_settings_file))
-    locals().update(user_settings)
-except:
-    raise Exception('unable to open user settings {}'.format(user_settings_file))
-
+# override with user settings in ./.settings.json or species_distribution/.settings.json.
+# Importing settings doesn't write anything, create the file to override the defaults
+if os.path.isfile(user_settings_file):
+    try:
+        with open(user_settings_file) as f:
+            user_settings = json.load(f)
+        locals().update(user_settings)
+    except:
+        raise Exception('unable to open user settings {}'.format(user_settings_file))
@@ -0,0 +1,35 @@
+""" Compact transfer of distributions between processes
+
+A distribution is masked outside its taxon's range, usually most of the
+grid, and pickling the full masked array sends 2MB of data and mask per
+taxon through the pool's result pipe.  pack keeps only the unmasked cells,
+as flat int32 indexes and their values, which is all save_database writes.
+"""
+
+import numpy as np
+
+
+def pack(matrix):
+    """ returns (shape, indexes, values) of the unmasked cells of the masked
+    array matrix, or None if matrix is None """
+
+    if matrix is None:
+        return None
+
+    indexes = np.flatnonzero(~np.ma.getmaskarray(matrix)).astype(np.int32)
+    values = np.ma.getdata(matrix).ravel()[indexes]
+    return matrix.shape, indexes, values
+
+
+def unpack(payload):
+    """ returns the masked array packed into payload, masked cells are 0 """
+
+    if payload is None:
+        return None
+
+    shape, indexes, values = payload
+    data = np.zeros(int(np.prod(shape)), dtype=values.dtype)
+    mask = np.ones(data.shape, dtype=bool)
+    data[indexes] = values
+    mask[indexes] = False
+    return np.ma.MaskedArray(data=data.reshape(shape), mask=mask.reshape(shape))
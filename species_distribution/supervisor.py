@@ -0,0 +1,170 @@
+""" Worker processes with per-task time and memory limits
+
+A pathological taxon can pin a worker for hours or grow its allocations
+until the machine runs out of memory.  The supervisor runs each task in
+one of its own worker processes, one task at a time per worker, so a task
+exceeding its wall-clock limit can be killed and its worker replaced
+without losing the others.  Workers run under an address space limit, so
+oversized allocations raise MemoryError in the task instead of taking
+the host down.
+
+Tasks call report_stage as they progress, so a timed out or crashed task
+is reported with the stage it was in.
+"""
+
+from collections import deque
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import resource
+import signal
+import time
+
+from species_distribution.ledger import FAILED, TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+
+STAGE_LENGTH = 64
+
+# the shared stage buffer of this process, when it is a supervised worker
+_stage = None
+
+
+def report_stage(name):
+    """ records the stage of the current task, a no-op outside supervised workers """
+    if _stage is not None:
+        _stage.value = str(name).encode()[:STAGE_LENGTH - 1]
+
+
+def _work(task, connection, stage, memory_limit):
+    global _stage
+    _stage = stage
+
+    # SIGINT is handled by the supervising process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    while True:
+        key = connection.recv()
+        if key is None:
+            break
+
+        report_stage('start')
+        try:
+            result = (DONE, task(key))
+        except Exception as e:
+            logger.exception('task {} failed'.format(key))
+            result = (FAILED, '{} at stage {}: {}'.format(type(e).__name__, stage.value.decode(), e))
+        connection.send(result)
+
+
+class _Worker():
+
+    def __init__(self, task, memory_limit):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.stage = multiprocessing.Array('c', STAGE_LENGTH)
+        self.process = multiprocessing.Process(
+            target=_work,
+            args=(task, child_connection, self.stage, memory_limit),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+        self.key = None
+        self.started = None
+
+    def submit(self, key):
+        self.key = key
+        self.started = time.time()
+        self.connection.send(key)
+
+    def done(self):
+        key, self.key = self.key, None
+        return key
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+
+
+class Supervisor():
+    """ runs task(key) for keys in processes worker processes.  timeout is
+    a per-task wall clock limit in seconds and memory_limit a per-worker
+    address space limit in bytes, either can be None """
+
+    def __init__(self, task, processes=1, timeout=None, memory_limit=None):
+        self.task = task
+        self.processes = processes
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+
+    def _replace(self, workers, i):
+        workers[i].kill()
+        workers[i] = _Worker(self.task, self.memory_limit)
+
+    def run(self, keys):
+        """ generator yielding (key, state, result) for keys as their tasks
+        finish.  state is DONE with the task's return value as result, or
+        FAILED or TIMEOUT with a message naming the stage as result.
+        Closing the generator kills running tasks """
+
+        pending = deque(keys)
+        workers = [_Worker(self.task, self.memory_limit) for _ in range(min(self.processes, len(pending)))]
+
+        try:
+            while True:
+                for worker in workers:
+                    if worker.key is None and pending:
+                        worker.submit(pending.popleft())
+
+                busy = [i for i, worker in enumerate(workers) if worker.key is not None]
+                if not busy:
+                    break
+
+                wait([workers[i].connection for i in busy] + [workers[i].process.sentinel for i in busy], timeout=1)
+
+                for i in busy:
+                    worker = workers[i]
+                    stage = worker.stage.value.decode()
+
+                    if worker.connection.poll():
+                        try:
+                            state, result = worker.connection.recv()
+                            yield worker.done(), state, result
+                            continue
+                        except EOFError:
+                            pass
+
+                    if not worker.process.is_alive():
+                        message = 'worker exited with code {} at stage {}'.format(worker.process.exitcode, stage)
+                        key = worker.done()
+                        self._replace(workers, i)
+                        yield key, FAILED, message
+
+                    elif self.timeout and time.time() - worker.started > self.timeout:
+                        message = 'stage {} after {:.0f}s'.format(stage, time.time() - worker.started)
+                        key = worker.done()
+                        logger.error('killing task {}: {}'.format(key, message))
+                        self._replace(workers, i)
+                        yield key, TIMEOUT, message
+        finally:
+            for worker in workers:
+                if worker.key is not None:
+                    worker.kill()
+                else:
+                    worker.close()
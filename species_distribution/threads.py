@@ -0,0 +1,56 @@
+""" Thread pool for the independent parts of a taxon
+
+The filters of a taxon, and the habitats of the habitat filter, don't
+depend on each other until they are combined, and their numpy work
+releases the GIL.  With settings.THREADS above 1, map runs them on a
+pool of threads, which shortens a single taxon where a process pool
+can't help.  Maps nested in a mapped task run on a pool of their own,
+so a task waiting on its subtasks can't starve them of threads.
+
+Shared state tasks grow or fill, the kernel bank, the caches and the
+arena, is guarded by locks.  Tasks take the caller's numpy error handling
+with them, since numpy keeps it per thread.  Debug runs draw images with
+matplotlib, which isn't thread safe, so they map in the calling thread.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+from . import settings
+
+# (pid, nesting depth): executor, pools aren't inherited by forked workers
+EXECUTORS = {}
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _executor(depth):
+    key = (os.getpid(), depth)
+    with _lock:
+        if key not in EXECUTORS:
+            EXECUTORS[key] = ThreadPoolExecutor(max_workers=settings.THREADS)
+        return EXECUTORS[key]
+
+
+def map(f, items):
+    """ returns [f(item) for item in items], computed on the thread pool
+    with settings.THREADS > 1.  Exceptions of f are raised in the caller """
+
+    items = list(items)
+    if (settings.THREADS or 0) < 2 or settings.DEBUG or len(items) < 2:
+        return [f(item) for item in items]
+
+    depth = getattr(_local, 'depth', 0)
+    errors = np.geterr()
+    call = np.geterrcall()
+
+    def task(item):
+        _local.depth = depth + 1
+        with np.errstate(call=call, **errors):
+            return f(item)
+
+    return list(_executor(depth).map(task, items))
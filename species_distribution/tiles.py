@@ -0,0 +1,218 @@
+""" Web map tile pyramids of distributions
+
+Distributions are sampled into 256x256 Web Mercator tiles in the XYZ
+scheme, colorized with the render lookup table, and written either as a
+{z}/{x}/{y}.png directory tree or an MBTiles SQLite file.  Tiles with no
+abundance are not written.
+"""
+
+from io import BytesIO
+import logging
+from multiprocessing import Pool
+import os
+import sqlite3
+
+import numpy as np
+
+from . import render
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+# the distribution grid: rows start at 90N, columns at 180W
+NORTH = 90.0
+WEST = -180.0
+
+
+def tile_edges_lonlat(z, x, y, tile_size=TILE_SIZE):
+    """returns 1d arrays of the longitudes of the pixel column edges and the
+    latitudes of the pixel row edges of XYZ tile z/x/y, tile_size + 1 each"""
+
+    world = tile_size * 2 ** z
+    px = (x * tile_size + np.arange(tile_size + 1)) / world
+    py = (y * tile_size + np.arange(tile_size + 1)) / world
+
+    longitude = px * 360 - 180
+    latitude = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py))))
+    return longitude, latitude
+
+
+def _edges_to_cells(edges, n):
+    """given pixel edges in fractional cell units, returns the first cell of each
+    pixel and the end of the last pixel"""
+    starts = np.clip(np.floor(edges[:-1]).astype(int), 0, n - 1)
+    stop = int(np.clip(np.ceil(edges[-1]), starts[-1] + 1, n))
+    return starts, stop
+
+
+def tile_cells(shape, z, x, y, tile_size=TILE_SIZE):
+    """returns (rows, row_stop, cols, col_stop) for tile z/x/y of a global grid of
+    the given shape. rows and cols are the first grid cell covered by each pixel
+    row and pixel column, the stops bound the cells covered by the last ones"""
+
+    cell_height = 180 / shape[0]
+    cell_width = 360 / shape[1]
+    longitude, latitude = tile_edges_lonlat(z, x, y, tile_size)
+
+    rows, row_stop = _edges_to_cells((NORTH - latitude) / cell_height, shape[0])
+    cols, col_stop = _edges_to_cells((longitude - WEST) / cell_width, shape[1])
+    return rows, row_stop, cols, col_stop
+
+
+def sample_tile(data, z, x, y, tile_size=TILE_SIZE):
+    """returns the tile z/x/y of data, a 2d grid of non-negative values with
+    missing values < 0. Pixels take the maximum of the cells they cover so
+    small ranges stay visible at low zoom"""
+
+    rows, row_stop, cols, col_stop = tile_cells(data.shape, z, x, y, tile_size)
+    window = data[rows[0]:row_stop, cols[0]:col_stop]
+
+    # reduceat returns the cell itself where several pixels start in the same cell
+    tile = np.maximum.reduceat(window, rows - rows[0], axis=0)
+    return np.maximum.reduceat(tile, cols - cols[0], axis=1)
+
+
+def tiles(distribution, zooms, tile_size=TILE_SIZE):
+    """yields (z, x, y, array) for every tile of distribution containing
+    abundance at each zoom level in zooms. Tile values are scaled so the
+    distribution maximum is 1"""
+
+    distribution = np.ma.masked_invalid(distribution)
+    if not distribution.count() or not distribution.max() > 0:
+        return
+
+    data = np.ma.filled(distribution / distribution.max(), -1)
+
+    for z in zooms:
+        n = 2 ** z
+        for x in range(n):
+            for y in range(n):
+                tile = sample_tile(data, z, x, y, tile_size)
+                if not tile.max() > 0:
+                    continue
+                yield z, x, y, np.ma.masked_less(tile, 0)
+
+
+def encode_png(array):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.fromarray(render.colorize(array)).save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+
+class XYZWriter():
+    """writes tiles to directory/{z}/{x}/{y}.png"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, z, x, y, data):
+        path = os.path.join(self.directory, str(z), str(x))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, '{}.png'.format(y)), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class MBTilesWriter():
+    """writes tiles to an MBTiles (SQLite) file"""
+
+    def __init__(self, fname, name='', bounds=(-180, -85.0511, 180, 85.0511)):
+        if os.path.isfile(fname):
+            os.remove(fname)
+        self.connection = sqlite3.connect(fname)
+        self.connection.executescript("""
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        self.zooms = set()
+        self.metadata = {
+            'name': str(name),
+            'format': 'png',
+            'type': 'overlay',
+            'bounds': ','.join(str(b) for b in bounds),
+        }
+
+    def write(self, z, x, y, data):
+        # MBTiles rows are numbered from the south (TMS)
+        tms_y = 2 ** z - 1 - y
+        self.connection.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)', (z, x, tms_y, sqlite3.Binary(data)))
+        self.zooms.add(z)
+
+    def close(self):
+        if self.zooms:
+            self.metadata['minzoom'] = str(min(self.zooms))
+            self.metadata['maxzoom'] = str(max(self.zooms))
+        self.connection.executemany('INSERT INTO metadata VALUES (?, ?)', self.metadata.items())
+        self.connection.commit()
+        self.connection.close()
+
+
+def export_distribution(distribution, writer, zooms=range(6)):
+    """writes the tile pyramid of distribution with writer, returns the number
+    of tiles written"""
+
+    count = 0
+    for z, x, y, array in tiles(distribution, zooms):
+        writer.write(z, x, y, encode_png(array))
+        count += 1
+    writer.close()
+    return count
+
+
+def writer_for_taxon(output, taxon_key, fmt):
+    if fmt == 'mbtiles':
+        return MBTilesWriter(os.path.join(output, '{}.mbtiles'.format(taxon_key)), name=taxon_key)
+    elif fmt == 'xyz':
+        return XYZWriter(os.path.join(output, str(taxon_key)))
+    raise ValueError('unknown tile format {}'.format(fmt))
+
+
+def load_hdf5(fname, taxon_key):
+    import h5py
+
+    with h5py.File(fname, 'r') as f:
+        return np.ma.masked_invalid(f['taxa/' + str(taxon_key)][:])
+
+
+def load_database(taxon_key):
+    from . import sd_io as io
+
+    distribution = io.load_distribution(taxon_key)
+    if distribution is None:
+        return np.ma.MaskedArray(data=np.zeros(io.SHAPE), mask=True)
+    return distribution
+
+
+def _export_taxon(args):
+    taxon_key, source, output, fmt, zooms = args
+
+    if source == 'database':
+        distribution = load_database(taxon_key)
+    else:
+        distribution = load_hdf5(source, taxon_key)
+
+    count = export_distribution(distribution, writer_for_taxon(output, taxon_key, fmt), zooms)
+    logger.info('taxon {}: wrote {} tiles'.format(taxon_key, count))
+    return taxon_key, count
+
+
+def export_taxa(taxon_keys, source, output, fmt='xyz', zooms=range(6), processes=None):
+    """exports tile pyramids for each taxon in taxon_keys in parallel.
+
+    source is either 'database' or the path of an hdf5 distribution file.
+    yields (taxon_key, tile count) as taxa complete"""
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    tasks = ((key, source, output, fmt, tuple(zooms)) for key in taxon_keys)
+    with Pool(processes=processes) as pool:
+        for result in pool.imap_unordered(_export_taxon, tasks):
+            yield result
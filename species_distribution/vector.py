@@ -0,0 +1,168 @@
+""" Vector mode: the cheap filters evaluated for a batch of taxa at once
+
+The fao, latitude, depth and submergence filters are evaluated for K taxa
+into K x 360 x 720 masked stacks with a handful of numpy operations,
+rather than once per taxon.  Each stack function mirrors the _filter of
+the corresponding filter module: a taxon for which the filter would be
+skipped or would return an all-masked matrix is marked inactive, and
+combine_probability_stacks leaves it out of that taxon's product, the
+same as distribution.combine_probability_matrices does.
+
+This is a library building block, the runs don't use it.  A batch holds
+the cheap filters only: it doesn't apply the polygon and habitat filters,
+nor scale by the grid's water percentage, which create_taxon_distribution
+does, so it is no substitute for a taxon's distribution.
+"""
+
+import numpy as np
+
+from .filters.depth import depth_probabilities
+from .filters.latitude import latitude_profiles
+from .filters.submergence import fit_parabola_coefficients, parabola_profiles
+from .models.db import Session
+from .models.taxa import Taxon, TaxonHabitat, fao_cells_for_taxa
+from .models.world import Grid
+
+
+def _stack(data, mask, active=None):
+    """returns a K x H x W masked stack, with an (K,) array of which taxa
+    the filter applies to"""
+
+    stack = np.ma.MaskedArray(data=data, mask=mask)
+    if active is None:
+        active = np.ones(len(stack), dtype=bool)
+    active = active & (np.ma.count(stack, axis=(1, 2)) > 0)
+    return stack, active
+
+
+def latitude_stack(lat_north, lat_south, latitudes, shape):
+    profiles = latitude_profiles(lat_north, lat_south, latitudes)[:, :, np.newaxis]
+    k = len(profiles)
+    data = np.broadcast_to(profiles, (k,) + shape)
+    return _stack(data, data <= 0)
+
+
+def depth_stack(min_depth, max_depth, skip, world_depth):
+    """min_depth and max_depth are positive taxon depths, skip marks taxa for
+    which the depth filter doesn't apply (coastal or pelagic)"""
+
+    # min and max are inverted between taxon and world
+    mindepth = -np.asarray(min_depth, dtype=float)[:, np.newaxis, np.newaxis]
+    maxdepth = -np.asarray(max_depth, dtype=float)[:, np.newaxis, np.newaxis]
+
+    deep = world_depth < maxdepth
+
+    # the depth filter only evaluates world depths found in
+    # np.arange(mindepth, maxdepth - 1, -1)
+    steps = mindepth - world_depth
+    in_range = (steps >= 0) & (steps == np.floor(steps)) & (world_depth > maxdepth - 1)
+
+    data = np.where(deep, 1.0, depth_probabilities(world_depth, mindepth, maxdepth))
+    return _stack(data, ~(deep | in_range), ~np.asarray(skip, dtype=bool))
+
+
+def submergence_stack(min_depth, max_depth, lat_north, lat_south, intertidal, latitudes, ocean_depth, percent_water):
+    min_depth = -np.asarray(min_depth, dtype=float)
+    max_depth = -np.asarray(max_depth, dtype=float)
+    lat_north = np.asarray(lat_north, dtype=float)
+    lat_south = np.asarray(lat_south, dtype=float)
+
+    # short circuit, won't do submergence with unsupported data
+    unsupported = (
+        np.asarray(intertidal, dtype=bool)
+        | (max_depth == 9999)
+        | (abs(lat_north) == 90)
+        | (abs(lat_south) == 90)
+        | ((lat_north >= 60) & (lat_south >= 60))
+        | ((lat_north <= -60) & (lat_south <= -60))
+    )
+
+    p_high, p_low = fit_parabola_coefficients(min_depth, max_depth, lat_north, lat_south)
+    p_high_profiles = parabola_profiles(p_high, latitudes)[:, :, np.newaxis]
+    p_low_profiles = parabola_profiles(p_low, latitudes)[:, :, np.newaxis]
+
+    mask = (
+        ((percent_water < 100) & (ocean_depth < p_high_profiles))
+        |
+        ((ocean_depth <= p_high_profiles) & (ocean_depth >= p_low_profiles))
+    )
+    return _stack(mask.astype(float), ~mask, ~unsupported)
+
+
+def fao_stack(taxon_keys, cells, shape):
+    """cells are rows of (taxon_key, row, col, value) as returned by fao_cells_for_taxa"""
+
+    k = len(taxon_keys)
+    data = np.zeros((k,) + shape)
+    mask = np.ones((k,) + shape, dtype=bool)
+
+    if cells:
+        position = {key: i for i, key in enumerate(taxon_keys)}
+        keys, rows, cols, values = zip(*cells)
+        index = (np.array([position[key] for key in keys]), np.array(rows), np.array(cols))
+        data[index] = np.array(values, dtype=float)
+        mask[index] = False
+
+    return _stack(data, mask)
+
+
+def combine_probability_stacks(stacks):
+    """given a sequence of (stack, active) filter results, returns the K x H x W
+    product of each taxon's active filters, normalized so each taxon sums to 1.0"""
+
+    distribution = None
+    for stack, active in stacks:
+        # inactive taxa are left out of the product
+        stack = np.ma.where(active[:, np.newaxis, np.newaxis], stack, 1.0)
+        distribution = stack if distribution is None else distribution * stack
+
+    # normalize
+    return distribution / distribution.sum(axis=(1, 2))[:, np.newaxis, np.newaxis]
+
+
+def taxa_parameters(session, taxon_keys):
+    """returns a dict of arrays of the filter parameters of taxon_keys, in order"""
+
+    habitats = {h.taxon_key: h for h in session.query(TaxonHabitat).filter(TaxonHabitat.taxon_key.in_(taxon_keys))}
+    taxa = {t.taxon_key: t for t in session.query(Taxon).filter(Taxon.taxon_key.in_(taxon_keys))}
+
+    habitats = [habitats[key] for key in taxon_keys]
+    parameters = {
+        attr: np.array([getattr(h, attr) for h in habitats], dtype=float)
+        for attr in ('lat_north', 'lat_south', 'min_depth', 'max_depth')
+    }
+    parameters['intertidal'] = np.array([bool(h.intertidal) for h in habitats])
+    # the depth filter is skipped for coastal and pelagic taxa
+    parameters['skip_depth'] = np.array([h.offshore == 0 or taxa[h.taxon_key].pelagic for h in habitats])
+    return parameters
+
+
+def filter_stacks(taxon_keys):
+    """returns a list of (stack, active) results of the fao, latitude, depth
+    and submergence filters for taxon_keys. Every key must have a taxon_habitat
+    record"""
+
+    taxon_keys = list(taxon_keys)
+    grid = Grid()
+    latitudes = grid.latitude[:, 0]
+
+    with Session() as session:
+        p = taxa_parameters(session, taxon_keys)
+
+    return [
+        fao_stack(taxon_keys, fao_cells_for_taxa(taxon_keys), grid.shape),
+        latitude_stack(p['lat_north'], p['lat_south'], latitudes, grid.shape),
+        depth_stack(p['min_depth'], p['max_depth'], p['skip_depth'], grid.get_grid('ele_avg')),
+        submergence_stack(
+            p['min_depth'], p['max_depth'], p['lat_north'], p['lat_south'], p['intertidal'],
+            latitudes, grid.get_grid('ele_min'), grid.get_grid('percent_water')
+        ),
+    ]
+
+
+def create_cheap_distributions(taxon_keys):
+    """returns a K x 360 x 720 masked stack combining the cheap filters of
+    taxon_keys with combine_probability_matrices semantics.  Each taxon takes
+    about 2.3MB, so batches should be sized accordingly"""
+
+    return combine_probability_stacks(filter_stacks(taxon_keys))
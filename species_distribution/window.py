@@ -0,0 +1,105 @@
+""" Rectangular windows of the global grid
+
+Computations for a taxon can be restricted to the part of the grid its
+polygon covers.  Windows wrap across the antimeridian, so a range
+spanning 180 degrees longitude stays a single narrow window.
+"""
+
+import numpy as np
+
+
+class Window():
+    """ rows [top, bottom) and columns left .. left + width - 1, modulo the
+    grid width, of a grid of shape grid_shape """
+
+    def __init__(self, grid_shape, top, bottom, left, width):
+        self.grid_shape = grid_shape
+        self.top = top
+        self.bottom = bottom
+        self.left = left
+        self.width = width
+
+    def __repr__(self):
+        return 'Window(rows {}:{}, columns {}+{})'.format(self.top, self.bottom, self.left, self.width)
+
+    @classmethod
+    def full(cls, grid_shape):
+        return cls(grid_shape, 0, grid_shape[0], 0, grid_shape[1])
+
+    @classmethod
+    def around(cls, cells, top=0, bottom=0, left=0, right=0):
+        """ returns the smallest window containing every True value of the 2d
+        boolean array cells, padded by the given number of cells on each side.
+        The columns are chosen to leave out the widest empty band of columns,
+        wrapping around the antimeridian """
+
+        height, grid_width = cells.shape
+        rows = np.nonzero(cells.any(axis=1))[0]
+        columns = np.nonzero(cells.any(axis=0))[0]
+
+        if len(rows) == 0:
+            return cls(cells.shape, 0, 0, 0, 0)
+
+        # widest gap between occupied columns, including the gap across the antimeridian
+        gaps = np.diff(np.append(columns, columns[0] + grid_width)) - 1
+        widest = np.argmax(gaps)
+        start = columns[(widest + 1) % len(columns)] - left
+        width = grid_width - gaps[widest] + left + right
+
+        if width >= grid_width:
+            start, width = 0, grid_width
+
+        return cls(
+            cells.shape,
+            max(rows[0] - top, 0),
+            min(rows[-1] + 1 + bottom, height),
+            start % grid_width,
+            width
+        )
+
+    @property
+    def shape(self):
+        return (self.bottom - self.top, self.width)
+
+    @property
+    def full_width(self):
+        return self.width == self.grid_shape[1]
+
+    @property
+    def columns(self):
+        """ grid column index of each window column """
+        return (self.left + np.arange(self.width)) % self.grid_shape[1]
+
+    def local_column(self, j):
+        """ window column of grid column j """
+        return (j - self.left) % self.grid_shape[1]
+
+    def scale(self, factor):
+        """ returns this window on a grid with factor times the resolution """
+        return Window(
+            (self.grid_shape[0] * factor, self.grid_shape[1] * factor),
+            self.top * factor,
+            self.bottom * factor,
+            self.left * factor,
+            self.width * factor
+        )
+
+    def crop(self, a, out=None):
+        """ returns a copy of the window of the 2d grid a, written into the
+        window shaped array out if given """
+
+        rows = a[self.top:self.bottom]
+        if out is None:
+            return rows.take(self.columns, axis=1)
+
+        # copied as the slices on either side of the antimeridian, faster than take
+        right = min(self.left + self.width, self.grid_shape[1])
+        n = right - self.left
+        np.copyto(out[:, :n], rows[:, self.left:right])
+        np.copyto(out[:, n:], rows[:, :self.width - n])
+        return out
+
+    def embed(self, a, out):
+        """ writes the window sized array a into the grid out, returns out """
+        out[self.top:self.bottom, self.columns] = a
+        return out
@@ -0,0 +1,64 @@
+import unittest2
+
+import numpy as np
+
+from species_distribution.arena import Arena
+
+
+class TestArena(unittest2.TestCase):
+
+    def test_outside_scope_allocates(self):
+        arena = Arena()
+        a = arena.zeros((3, 4))
+        self.assertEqual(a.shape, (3, 4))
+        self.assertFalse(a.any())
+        self.assertEqual(arena.allocations, 0)
+        self.assertEqual(arena.lent, [])
+
+    def test_buffers_reused_across_scopes(self):
+        arena = Arena()
+        with arena.scope():
+            a = arena.zeros((10, 10))
+            a[:] = 5
+            base = a.base
+        with arena.scope():
+            b = arena.zeros((5, 5), dtype=bool)
+            self.assertFalse(b.any())
+            c = arena.zeros((10, 10))
+            self.assertFalse(c.any())
+        self.assertEqual(arena.allocations, 2)
+        self.assertEqual(arena.reuses, 1)
+        self.assertIs(b.base.base, base.base)
+
+    def test_masked(self):
+        arena = Arena()
+        with arena.scope():
+            m = arena.masked((4, 6))
+            self.assertTrue(m.mask.all())
+            self.assertEqual(m.data.sum(), 0)
+            m[1, 2] = 1.0
+            self.assertEqual(m.count(), 1)
+
+    def test_max_bytes(self):
+        arena = Arena(max_bytes=1000)
+        with arena.scope():
+            arena.empty(100)
+            arena.empty(50)
+        self.assertEqual([b.nbytes for b in arena.free], [800])
+        arena.reclaim()
+        self.assertEqual(len(arena.free), 1)
+
+    def test_release(self):
+        arena = Arena()
+        with arena.scope():
+            for _ in range(3):
+                a = arena.zeros((10, 10))
+                b = arena.empty((10, 10), dtype=bool)
+                arena.release(a, b)
+            self.assertEqual(arena.lent, [])
+            self.assertEqual(arena.allocations, 2)
+            self.assertEqual(arena.reuses, 4)
+
+            # arrays the arena didn't hand out are left alone
+            arena.release(np.zeros(3))
+            self.assertEqual(len(arena.free), 2)
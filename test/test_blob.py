@@ -0,0 +1,48 @@
+import pickle
+import unittest2
+
+import numpy as np
+
+from species_distribution import blob
+from species_distribution import sparse
+
+
+class TestBlob(unittest2.TestCase):
+
+    def test_round_trip(self):
+        matrix = np.ma.masked_less(np.random.random((36, 72)), .3)
+        matrix[5:20, 10:40] = np.ma.masked
+        matrix[0, 0] = np.nan
+        matrix.mask[0, 0] = False
+
+        for compress in (True, False):
+            decoded = blob.decode(blob.encode(matrix, compress=compress))
+
+            expected = np.ma.masked_invalid(matrix)
+            np.testing.assert_array_equal(decoded.mask, expected.mask)
+            np.testing.assert_array_equal(decoded.compressed(), expected.compressed().astype(np.float32))
+
+    def test_runs(self):
+        matrix = np.ma.MaskedArray(data=np.ones((360, 720)), mask=True)
+        matrix.mask[100:200, 300:500] = False
+        data = blob.encode(matrix)
+
+        header = blob.read_header(data)
+        self.assertEqual(header.shape, (360, 720))
+        self.assertEqual(header.cells, 100 * 200)
+        self.assertEqual(header.runs, 100)
+        self.assertLess(len(data), len(pickle.dumps(sparse.pack(matrix))) / 10)
+
+    def test_empty(self):
+        matrix = np.ma.MaskedArray(data=np.zeros((4, 8)), mask=True)
+        decoded = blob.decode(blob.encode(matrix))
+        self.assertTrue(decoded.mask.all())
+        self.assertEqual(decoded.shape, (4, 8))
+
+    def test_version(self):
+        data = bytearray(blob.encode(np.ma.masked_less(np.random.random((4, 8)), .5)))
+        data[2] = blob.VERSION + 1
+        with self.assertRaises(ValueError):
+            blob.decode(bytes(data))
+        with self.assertRaises(ValueError):
+            blob.decode(b'not a blob at all')
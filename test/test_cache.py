@@ -0,0 +1,66 @@
+import unittest2
+
+import numpy as np
+
+from species_distribution import cache
+
+
+class TestCache(unittest2.TestCase):
+
+    def test_entry_bound(self):
+        c = cache.Cache('test', max_entries=2)
+        for key in 'abc':
+            c.put(key, key)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('c'), 'c')
+        self.assertEqual(c.stats()['evictions'], 1)
+
+    def test_reserve(self):
+        c = cache.Cache('test', max_entries=2)
+        c.reserve(4)
+        c.reserve(3)
+        for key in 'abcd':
+            c.put(key, key)
+        self.assertEqual(c.max_entries, 4)
+        self.assertEqual(c.get('a'), 'a')
+
+    def test_discard(self):
+        c = cache.Cache('test', max_bytes=2 ** 20)
+        c.put('a', np.zeros(10))
+        c.discard('a')
+        c.discard('b')
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.bytes, 0)
+
+    def test_byte_bound_evicts_least_recently_used(self):
+        c = cache.Cache('test', max_bytes=2500)
+        for key in range(3):
+            c.put(key, np.zeros(100))
+        c.get(0)
+        c.put(3, np.zeros(100))
+        self.assertIsNotNone(c.get(0))
+        self.assertIsNone(c.get(1))
+        self.assertLessEqual(c.bytes, 2500)
+
+    def test_oversized_value_not_cached(self):
+        c = cache.Cache('test', max_bytes=100)
+        c.put('big', np.zeros(100))
+        self.assertEqual(c.stats()['entries'], 0)
+
+    def test_cached(self):
+        calls = []
+
+        @cache.cached('test_cached', scope=cache.TAXON, key=lambda self, x: x)
+        def double(self, x):
+            calls.append(x)
+            return 2 * x
+
+        self.assertEqual(double(None, 2), 4)
+        self.assertEqual(double(object(), 2), 4)
+        self.assertEqual(calls, [2])
+        self.assertEqual(double.cache.stats()['hits'], 1)
+
+        cache.clear(cache.TAXON)
+        double(None, 2)
+        self.assertEqual(calls, [2, 2])
+        self.assertIn('test_cached', cache.report())
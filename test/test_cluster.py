@@ -0,0 +1,114 @@
+import socket
+import threading
+import time
+import unittest2
+
+from species_distribution import cluster
+from species_distribution import settings
+from species_distribution.ledger import FAILED, RUNNING, SAVED
+
+
+class TestCluster(unittest2.TestCase):
+
+    def test_parse_address(self):
+        self.assertEqual(cluster.parse_address('example.org:1234'), ('example.org', 1234))
+
+    def test_coordinate(self):
+        coordinator = cluster.Coordinator([1, 2, 3], ('127.0.0.1', 0), authkey='test')
+        # no taxa will be requeued, the worker quits when the queue is empty
+        coordinator.done.set()
+        saved = {}
+
+        def distribute(taxon_key):
+            if taxon_key == 2:
+                raise ValueError('bad taxon')
+            return taxon_key, taxon_key * 10
+
+        try:
+            count = cluster.work(coordinator.address, 'test', distribute=distribute, save=saved.__setitem__)
+        finally:
+            coordinator.close()
+
+        self.assertEqual(count, 3)
+        self.assertEqual(saved, {1: 10, 3: 30})
+
+        reports = [coordinator.reports.get_nowait() for _ in range(6)]
+        final = {key: state for key, state, worker, message in reports[1::2]}
+        self.assertEqual(final, {1: SAVED, 2: FAILED, 3: SAVED})
+
+    def test_authkey_required(self):
+        default = settings.CLUSTER
+        settings.CLUSTER = {'port': 50000, 'authkey': None}
+        try:
+            with self.assertRaises(ValueError):
+                cluster.Coordinator([1], ('127.0.0.1', 0))
+            with self.assertRaises(ValueError):
+                cluster.connect(('127.0.0.1', 50000))
+        finally:
+            settings.CLUSTER = default
+
+    def _coordinate(self, taxon_keys, **kwargs):
+        """ runs coordinate in a thread, returns its address, thread and result """
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            address = s.getsockname()
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(
+            cluster.coordinate(taxon_keys, address, authkey='test', **kwargs)))
+        thread.start()
+
+        for _ in range(50):
+            try:
+                return address, thread, result, cluster.connect(address, 'test')
+            except OSError:
+                time.sleep(.1)
+
+    def test_lost_worker_requeued(self):
+        address, thread, result, (tasks, reports, _) = self._coordinate([1], lease=.5, retries=1)
+
+        # a worker starts the taxon then dies
+        taxon_key = tasks.serve('lost')
+        reports.put((taxon_key, RUNNING, 'lost', None))
+
+        saved = {}
+        count = cluster.work(address, 'test', distribute=lambda key: (key, key * 10), save=saved.__setitem__)
+        thread.join(10)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(saved, {1: 10})
+        self.assertEqual(result, {1: SAVED})
+
+    def test_lost_worker_retries(self):
+        address, thread, result, (tasks, reports, _) = self._coordinate([1], lease=.2, retries=0)
+
+        reports.put((tasks.serve('lost'), RUNNING, 'lost', None))
+        thread.join(10)
+
+        self.assertEqual(result, {1: FAILED})
+
+    def test_lost_before_reporting(self):
+        # a worker dies between taking a taxon and reporting it running, and
+        # a duplicated key is served once
+        address, thread, result, (tasks, _, _) = self._coordinate([1, 2, 1], lease=.5, retries=1)
+        self.assertEqual(tasks.lease(), .5)
+        self.assertEqual(tasks.serve('lost'), 1)
+
+        saved = {}
+        cluster.work(address, 'test', distribute=lambda key: (key, key * 10), save=saved.__setitem__)
+        thread.join(10)
+
+        self.assertEqual(saved, {1: 10, 2: 20})
+        self.assertEqual(result, {1: SAVED, 2: SAVED})
+
+    def test_heartbeats_keep_the_lease(self):
+        # a taxon taking longer than the lease isn't served again
+        address, thread, result, _ = self._coordinate([1], lease=.4, retries=0)
+
+        def distribute(taxon_key):
+            time.sleep(1.2)
+            return taxon_key, taxon_key
+
+        cluster.work(address, 'test', distribute=distribute, save=lambda *args: None)
+        thread.join(10)
+
+        self.assertEqual(result, {1: SAVED})
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest2
+
+import numpy as np
+
+from species_distribution import diff
+
+
+class TestDiff(unittest2.TestCase):
+
+    def test_compare(self):
+        a = (np.array([1, 2, 5]), np.array([.2, .3, .5]))
+        b = (np.array([2, 5, 7]), np.array([.3, .4, .3]))
+        result = diff.compare(a, b)
+        self.assertAlmostEqual(result['l1'], .2 + .1 + .3)
+        self.assertAlmostEqual(result['linf'], .3)
+        self.assertEqual((result['removed'], result['added']), (1, 1))
+        self.assertTrue(diff.changed(result))
+
+    def test_identical(self):
+        a = (np.array([3, 4]), np.array([.5, .5]))
+        result = diff.compare(a, a)
+        self.assertEqual(result['l1'], 0)
+        self.assertFalse(diff.changed(result))
+        self.assertEqual(diff.histogram([result])[0], (0, 1))
+
+    def test_snapshot_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            matrix = np.ma.masked_less(np.arange(12.).reshape((3, 4)), 10)
+            np.savez(os.path.join(directory, '42.npz'), data=matrix.data, mask=matrix.mask)
+
+            source = diff.source(directory)
+            self.assertEqual(source.taxa(), [42])
+            indexes, values = source.cells(42)
+            np.testing.assert_array_equal(indexes, [10, 11])
+            np.testing.assert_array_equal(values, [10, 11])
+            self.assertEqual(len(source.cells(7)[0]), 0)
+
+    def test_database_source_table_name(self):
+        self.assertEqual(str(diff.source('database')), 'database:taxon_distribution')
+        with self.assertRaises(ValueError):
+            diff.source('database:x; DROP TABLE y')
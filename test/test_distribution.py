@@ -19,3 +19,85 @@ class TestUtils(unittest2.TestCase):
 
         self.assertEqual(result[0, 0], 1)
         self.assertFalse(result[0, 1])
+
+    def test_combine_probability_matrices_window(self):
+        m1 = np.ma.MaskedArray(np.full((3, 4), .5), mask=False)
+        m2 = np.ma.MaskedArray(np.full((3, 4), .2), mask=False)
+        m2[0, 3] = np.ma.masked
+        scale = np.full((3, 4), 2.)
+        out = np.ma.MaskedArray(np.zeros((3, 4)), mask=True)
+
+        window = distribution.Window((3, 4), 0, 1, 3, 2)
+        result = distribution.combine_probability_matrices((m1, m2), window=window, scale=scale, out=out)
+
+        self.assertIs(result, out)
+        self.assertEqual(result.count(), 1)
+        self.assertEqual(result[0, 0], 2)
+
+    def test_combine_probability_matrices_zero_sum(self):
+        m1 = np.ma.MaskedArray(np.zeros((2, 2)), mask=[[0, 0], [1, 1]])
+        result = distribution.combine_probability_matrices((m1, m1))
+        self.assertTrue(result.mask.all())
+
+
+class FakeSession():
+
+    def query(self, model):
+        return self
+
+    def get(self, key):
+        return None
+
+
+class Stop(Exception):
+    pass
+
+
+def fake_filter(base, output, cost=1, uses_support=False):
+    """ a filter of class base returning output, which records the keywords it was applied with """
+
+    class Fake(base):
+        def __init__(self):
+            self.applied = None
+
+        def apply(self, session, **kwargs):
+            self.applied = kwargs
+            if isinstance(output, Exception):
+                raise output
+            return output
+
+    Fake.cost = cost
+    Fake.uses_support = uses_support
+    return Fake()
+
+
+def grid(cells):
+    m = np.ma.MaskedArray(np.zeros((4, 4)), mask=True)
+    for cell in cells:
+        m[cell] = .5
+    return m
+
+
+class TestSupport(unittest2.TestCase):
+
+    def test_expensive_filter_gets_support(self):
+        polygon = fake_filter(distribution.filters.polygon, grid([(0, 0), (0, 1), (1, 1)]))
+        latitude = fake_filter(distribution.filters.latitude, grid([(0, 1), (1, 1), (3, 3)]))
+        empty = fake_filter(distribution.filters.fao, grid([]))
+        habitat = fake_filter(distribution.filters.habitat, Stop(), cost=10, uses_support=True)
+
+        with self.assertRaises(Stop):
+            distribution._distribute(1, FakeSession(), [polygon, empty, habitat, latitude])
+
+        self.assertNotIn('support', latitude.applied)
+        np.testing.assert_array_equal(np.argwhere(habitat.applied['support']), [(0, 1), (1, 1)])
+
+    def test_empty_support_skips_expensive_filters(self):
+        polygon = fake_filter(distribution.filters.polygon, grid([(0, 0)]))
+        latitude = fake_filter(distribution.filters.latitude, grid([(3, 3)]))
+        habitat = fake_filter(distribution.filters.habitat, Stop(), cost=10, uses_support=True)
+
+        result = distribution._distribute(1, FakeSession(), [polygon, habitat, latitude])
+
+        self.assertIsNone(habitat.applied)
+        self.assertTrue(result.mask.all())
@@ -3,6 +3,7 @@ import unittest2
 import numpy as np
 
 import species_distribution.filters as filters
+from species_distribution.filters.habitat import reaching
 
 
 class TestHabitat(unittest2.TestCase):
@@ -83,3 +84,15 @@ class TestHabitat(unittest2.TestCase):
         # retained value, outside application area
         self.assertAlmostEqual(array[5, 9], 1)
         self.assertAlmostEqual(array[5, 0], 1)
+
+    def test_reaching(self):
+        cells = np.zeros((6, 8), dtype=bool)
+        cells[[0, 0, 2, 4], [0, 7, 6, 4]] = True
+        reach = np.full(cells.shape, 2)
+        support = np.zeros(cells.shape, dtype=bool)
+        support[2, 1] = True
+
+        # (0, 7) reaches across the right edge, (2, 6) stops short of it,
+        # (4, 4) is below
+        result = reaching(cells, reach, support)
+        np.testing.assert_array_equal(np.argwhere(result), [(0, 0), (0, 7)])
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import unittest2
+
+import numpy as np
+
+from species_distribution.kernel import KernelBank, frustum_profile
+
+
+def mgrid_kernel(r1, r2):
+    """ the frustum kernel as it was built before the bank """
+    xx, yy = np.mgrid[-r1:r1 + 1, -r1:r1 + 1]
+    kernel = np.ma.MaskedArray(data=xx ** 2 + yy ** 2, dtype=float)
+    kernel.mask = kernel > r1 ** 2
+    kernel[kernel <= r2 ** 2] = r2 ** 2
+    kernel = (kernel - r2 ** 2) / kernel.max()
+    return 1 - kernel
+
+
+class TestKernelBank(unittest2.TestCase):
+
+    def test_matches_mgrid_kernel(self):
+        bank = KernelBank(8)
+        for r1, r2 in ((1., 1.), (5., 2.), (20., 5.), (37., 3.), (40., 40.)):
+            expected = mgrid_kernel(r1, r2)
+            kernel = bank.kernel(r1, r2)
+            np.testing.assert_array_equal(kernel.mask, expected.mask)
+            np.testing.assert_array_equal(kernel.compressed(), expected.compressed())
+
+    def test_reserve_grows(self):
+        bank = KernelBank(4)
+        self.assertEqual(bank.distances(3).shape, (7, 7))
+        bank.distances(5)
+        self.assertEqual(bank.radius, 8)
+        self.assertEqual(bank.distances(5)[5, 5], 0)
+
+    def test_threads_growing_the_bank(self):
+        # threads growing the field must never see the new field with the old radius
+        radii = [(r, r // 3) for r in range(3, 120, 3)] * 2
+
+        def check(radii):
+            r1, r2 = radii
+            kernel = bank.kernel(r1, r2)
+            expected = mgrid_kernel(float(r1), float(r2))
+            return (
+                np.array_equal(kernel.mask, expected.mask)
+                and np.array_equal(kernel.compressed(), expected.compressed())
+            )
+
+        # switch threads as often as possible, to interleave the growth
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(20):
+                bank = KernelBank(2)
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    self.assertTrue(all(executor.map(check, radii)))
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertGreaterEqual(bank.radius, 117)
+
+    def test_profile(self):
+        profile = frustum_profile(4, 2)
+        self.assertEqual(len(profile), 17)
+        self.assertTrue((profile[:5] == 1).all())
+        self.assertEqual(profile[-1], 1 - 12 / 16)
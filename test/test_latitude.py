@@ -0,0 +1,26 @@
+import unittest2
+
+import numpy as np
+
+from species_distribution.filters.latitude import latitude_profiles
+
+
+class TestLatitude(unittest2.TestCase):
+
+    latitudes = np.arange(89.75, -90, -.5)
+
+    def test_triangle_distribution(self):
+        profile = latitude_profiles(40, 20, self.latitudes)[0]
+        expected = np.interp(self.latitudes, (20, 30, 40), (0, 1, 0))
+        np.testing.assert_array_equal(profile, expected)
+
+    def test_polygon_distribution(self):
+        # middle third straddles the equator
+        profile = latitude_profiles(30, -30, self.latitudes)[0]
+        expected = np.interp(self.latitudes, (-30, -10, 10, 30), (0, 1, 1, 0))
+        np.testing.assert_allclose(profile, expected)
+
+    def test_many_taxa(self):
+        profiles = latitude_profiles([40, 30], [20, -30], self.latitudes)
+        self.assertEqual(profiles.shape, (2, 360))
+        np.testing.assert_array_equal(profiles[0], latitude_profiles(40, 20, self.latitudes)[0])
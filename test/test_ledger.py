@@ -0,0 +1,60 @@
+import os
+import pickle
+import tempfile
+import unittest2
+
+import numpy as np
+
+from species_distribution.ledger import Ledger, QUEUED, RUNNING, COMPUTED, SAVED, FAILED
+
+
+class TestLedger(unittest2.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ledger = Ledger(os.path.join(self.directory.name, 'run.ledger'))
+        self.ledger.reset([3, 1, 2])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reset(self):
+        self.assertEqual(self.ledger.taxa(QUEUED), [1, 2, 3])
+        self.ledger.reset([4])
+        self.assertEqual(self.ledger.counts(), {QUEUED: 1})
+
+    def test_mark(self):
+        self.ledger.mark(1, RUNNING)
+        self.ledger.mark(1, FAILED, 'boom')
+        self.ledger.mark(1, RUNNING)
+        attempts, message = self.ledger.connection.execute(
+            'SELECT attempts, message FROM job WHERE taxon_key=1').fetchone()
+        self.assertEqual(attempts, 2)
+        self.assertIsNone(message)
+
+    def test_spill(self):
+        matrix = np.ma.masked_less(np.arange(12.).reshape((3, 4)), 5)
+        self.ledger.spill(1, matrix)
+        self.assertEqual(self.ledger.taxa(COMPUTED), [1])
+
+        loaded = self.ledger.load_spill(1)
+        np.testing.assert_array_equal(loaded.mask, matrix.mask)
+        np.testing.assert_array_equal(loaded.compressed(), matrix.compressed())
+
+        self.ledger.mark(1, SAVED)
+        self.ledger.discard_spill(1)
+        self.assertIsNone(self.ledger.load_spill(1))
+
+    def test_unfinished(self):
+        self.ledger.spill(1, np.ma.zeros((2, 2)))
+        self.ledger.mark(2, RUNNING)
+        self.ledger.mark(3, SAVED)
+        self.assertEqual(self.ledger.unfinished(), [2])
+
+        # a computed taxon whose spill is lost is redone
+        self.ledger.discard_spill(1)
+        self.assertEqual(self.ledger.unfinished(), [1, 2])
+
+    def test_pickle(self):
+        ledger = pickle.loads(pickle.dumps(self.ledger))
+        self.assertEqual(ledger.taxa(QUEUED), [1, 2, 3])
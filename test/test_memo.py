@@ -0,0 +1,51 @@
+import shutil
+import tempfile
+
+import unittest2
+
+import numpy as np
+
+from species_distribution import memo
+from species_distribution import settings
+
+
+class TestMemo(unittest2.TestCase):
+
+    def setUp(self):
+        memo.MEMORY.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        settings.FILTER_CACHE_DIR = None
+        shutil.rmtree(self.directory)
+
+    def test_miss(self):
+        self.assertEqual(memo.get('latitude', (10, -10)), (False, None))
+
+    def test_put_keeps_a_copy(self):
+        matrix = np.ma.MaskedArray(data=np.arange(6.0).reshape(2, 3), mask=[[1, 0, 0], [0, 0, 1]])
+        memo.put('latitude', (10, -10), matrix)
+        matrix[0, 1] = 100
+
+        found, output = memo.get('latitude', (10, -10))
+        self.assertTrue(found)
+        self.assertEqual(output[0, 1], 1)
+        self.assertTrue(output.mask[1, 2])
+
+    def test_none_output(self):
+        memo.put('depth', (0, 100, 0, False), None)
+        self.assertEqual(memo.get('depth', (0, 100, 0, False)), (True, None))
+
+    def test_directory_shared(self):
+        settings.FILTER_CACHE_DIR = self.directory
+        matrix = np.ma.MaskedArray(data=np.ones((2, 2)), mask=[[1, 0], [0, 0]])
+        memo.put('fao', (18, 21), matrix)
+        memo.put('depth', (0, 100, 0, False), None)
+
+        # as seen by another process
+        memo.MEMORY.clear()
+        found, output = memo.get('fao', (18, 21))
+        self.assertTrue(found)
+        np.testing.assert_array_equal(output.mask, matrix.mask)
+        self.assertEqual(memo.get('depth', (0, 100, 0, False)), (True, None))
+        self.assertEqual(memo.get('fao', (18,)), (False, None))
@@ -0,0 +1,77 @@
+import threading
+import unittest2
+
+from species_distribution import prefetch
+from species_distribution import settings
+from species_distribution.exceptions import NoPolygonException
+from species_distribution.models import taxa
+
+
+class TestPrefetcher(unittest2.TestCase):
+
+    def test_prefetches_ahead(self):
+        fetched = []
+        lock = threading.Lock()
+
+        def fetch(taxon_key):
+            with lock:
+                fetched.append(taxon_key)
+
+        inputs = prefetch.INPUTS
+        prefetch.INPUTS = (fetch,)
+        try:
+            for taxon_key in prefetch.Prefetcher([1, 2, 3, 4], depth=2):
+                if taxon_key == 1:
+                    # the current taxon was fetched, next ones submitted
+                    self.assertIn(1, fetched)
+        finally:
+            prefetch.INPUTS = inputs
+
+        self.assertEqual(sorted(fetched), [1, 2, 3, 4])
+
+    def test_caches_hold_prefetched_taxa(self):
+        prefetch.Prefetcher([1, 2, 3], depth=20)
+        for f in prefetch.INPUTS:
+            self.assertGreaterEqual(f.cache.max_entries, 42)
+
+
+class FakeResult():
+
+    def fetchall(self):
+        return []
+
+
+class FakeSession():
+    """ a session finding no extent for any taxon, counting its queries """
+
+    queries = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters):
+        FakeSession.queries += 1
+        return FakeResult()
+
+
+class TestPolygonCells(unittest2.TestCase):
+
+    def test_no_polygon_cached(self):
+        session = taxa.Session
+        rasterizer = settings.POLYGON_RASTERIZER
+        taxa.Session = FakeSession
+        try:
+            for settings.POLYGON_RASTERIZER in ('local', 'postgis'):
+                taxa.polygon_cells_for_taxon.cache.clear()
+                FakeSession.queries = 0
+                for _ in range(2):
+                    with self.assertRaises(NoPolygonException):
+                        taxa.polygon_cells_for_taxon(1)
+                self.assertEqual(FakeSession.queries, 1)
+        finally:
+            taxa.Session = session
+            settings.POLYGON_RASTERIZER = rasterizer
+            taxa.polygon_cells_for_taxon.cache.clear()
@@ -0,0 +1,57 @@
+import struct
+
+import unittest2
+
+import numpy as np
+
+from species_distribution.raster import rasterize
+
+
+def wkb(rings, kind=3, order='<'):
+    data = struct.pack(order + 'BII', 1 if order == '<' else 0, kind, len(rings))
+    for ring in rings:
+        data += struct.pack(order + 'I', len(ring))
+        data += b''.join(struct.pack(order + 'dd', *point) for point in ring)
+    return data
+
+
+def cells(rings, **kwargs):
+    return set(map(tuple, rasterize(wkb(rings, **kwargs)).tolist()))
+
+
+class TestRaster(unittest2.TestCase):
+
+    def test_box_on_grid_lines(self):
+        # 1x1 degree box, 2x2 cells inside and the 12 cells touching its edges
+        box = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+        result = cells([box])
+        self.assertEqual(len(result), 16)
+        self.assertIn((178, 360), result)
+        self.assertEqual({r for r, c in result}, {177, 178, 179, 180})
+
+    def test_small_polygon_inside_a_cell(self):
+        triangle = [(0.1, 0.1), (0.2, 0.1), (0.1, 0.2), (0.1, 0.1)]
+        self.assertEqual(cells([triangle], order='>'), {(179, 360)})
+
+    def test_hole(self):
+        outer = [(-5, -5), (5, -5), (5, 5), (-5, 5), (-5, -5)]
+        hole = [(-2.1, -2.1), (2.1, -2.1), (2.1, 2.1), (-2.1, 2.1), (-2.1, -2.1)]
+        result = cells([outer, hole])
+        self.assertIn((170, 350), result)
+        self.assertNotIn((180, 360), result)
+        self.assertIn((176, 355), result)
+
+    def test_multipolygon(self):
+        a = wkb([[(0.1, 0.1), (0.2, 0.1), (0.1, 0.2), (0.1, 0.1)]])
+        b = wkb([[(10.1, 0.1), (10.2, 0.1), (10.1, 0.2), (10.1, 0.1)]])
+        geometry = struct.pack('<BII', 1, 6, 2) + a + b
+        result = rasterize(geometry)
+        np.testing.assert_array_equal(result, [[179, 360], [179, 380]])
+
+    def test_antimeridian_wraps(self):
+        box = [(179.1, 0.1), (180.9, 0.1), (180.9, 0.4), (179.1, 0.4), (179.1, 0.1)]
+        self.assertEqual(cells([box]), {(179, 718), (179, 719), (179, 0), (179, 1)})
+
+    def test_edge_of_grid_stays_on_grid(self):
+        box = [(179.6, 0.1), (180, 0.1), (180, 0.4), (179.6, 0.4), (179.6, 0.1)]
+        self.assertEqual(cells([box]), {(179, 719)})
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest2
+
+import numpy as np
+
+from species_distribution import render
+
+
+class TestRender(unittest2.TestCase):
+
+    def test_jet_lut(self):
+        self.assertEqual(render.JET.shape, (256, 4))
+        self.assertEqual(render.JET.dtype, np.uint8)
+        # dark blue to dark red, fully opaque
+        self.assertEqual(tuple(render.JET[0]), (0, 0, 127, 255))
+        self.assertEqual(tuple(render.JET[-1]), (127, 0, 0, 255))
+
+    def test_colorize_masked_transparent(self):
+        array = np.ma.MaskedArray(data=[[0, .5], [1, np.nan]], mask=[[True, False], [False, False]])
+        rgba = render.colorize(array)
+        self.assertEqual(rgba.shape, (2, 2, 4))
+        self.assertEqual(rgba[0, 0, 3], 0)
+        self.assertEqual(rgba[1, 1, 3], 0)
+        self.assertEqual(tuple(rgba[0, 1]), tuple(render.JET[128]))
+        self.assertEqual(tuple(rgba[1, 0]), tuple(render.JET[255]))
+
+    def test_render_png_skips_unchanged(self):
+        array = np.ma.MaskedArray(data=np.linspace(0, 1, 16).reshape(4, 4), mask=False)
+        with tempfile.TemporaryDirectory() as d:
+            fname = os.path.join(d, 'test.png')
+            self.assertTrue(render.render_png(array, fname))
+            self.assertFalse(render.render_png(array, fname))
+            array[0, 0] = .5
+            self.assertTrue(render.render_png(array, fname))
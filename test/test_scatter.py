@@ -0,0 +1,33 @@
+import unittest2
+
+import numpy as np
+
+from species_distribution.scatter import scatter_max
+
+
+class TestScatterMax(unittest2.TestCase):
+
+    def setUp(self):
+        self.data = np.zeros((6, 8))
+        self.covered = np.zeros((6, 8), dtype=bool)
+        kernel = np.arange(9.).reshape((3, 3))
+        self.kernel = np.ma.MaskedArray(data=kernel, mask=kernel == 0)
+
+    def test_overlapping_kernels_keep_maximum(self):
+        applied = scatter_max(self.data, self.covered, [0, 1], [0, 1], self.kernel)
+        self.assertEqual(applied, 2)
+        self.assertEqual(self.data[1, 1], 4)
+        self.assertEqual(self.data[2, 2], max(8, 4))
+        # the masked kernel corner doesn't cover
+        self.assertFalse(self.covered[0, 0])
+        self.assertTrue(self.covered[1, 1])
+
+    def test_wraps_columns(self):
+        scatter_max(self.data, self.covered, [0], [7], self.kernel)
+        np.testing.assert_array_equal(self.data[2, [7, 0, 1]], [6, 7, 8])
+        self.assertEqual(self.covered.sum(), 8)
+
+    def test_skips_past_bottom(self):
+        applied = scatter_max(self.data, self.covered, [4, 3], [0, 0], self.kernel)
+        self.assertEqual(applied, 1)
+        self.assertEqual(self.data[5, 2], 8)
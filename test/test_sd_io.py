@@ -0,0 +1,188 @@
+import struct
+import unittest2
+
+import numpy as np
+
+from species_distribution import sd_io
+from species_distribution import sparse
+from species_distribution.sd_io import Rebuild
+
+
+class TestRebuild(unittest2.TestCase):
+
+    def test_names(self):
+        rebuild = Rebuild()
+        self.assertEqual(rebuild.shadow, 'taxon_distribution_rebuild')
+        self.assertEqual(rebuild.previous, 'taxon_distribution_previous')
+        self.assertEqual(rebuild.log, 'taxon_distribution_log_rebuild')
+
+    def test_index_definition(self):
+        rebuild = Rebuild()
+        self.assertEqual(
+            rebuild._index_definition(
+                'CREATE INDEX taxon_distribution_cell_id_idx ON distribution.taxon_distribution USING btree (cell_id)',
+                'taxon_distribution_cell_id_idx'),
+            'CREATE INDEX taxon_distribution_cell_id_idx_rebuild ON taxon_distribution_rebuild USING btree (cell_id)'
+        )
+        self.assertEqual(
+            rebuild._index_definition(
+                'CREATE UNIQUE INDEX taxon_distribution_pkey ON ONLY taxon_distribution USING btree (taxon_key, cell_id)',
+                'taxon_distribution_pkey'),
+            'CREATE UNIQUE INDEX taxon_distribution_pkey_rebuild ON ONLY taxon_distribution_rebuild USING btree (taxon_key, cell_id)'
+        )
+
+    def test_finish_recreates_views(self):
+        views = [
+            ('distribution.v_taxon_distribution', 'v', ' SELECT a.cell_id FROM taxon_distribution a;', 'sau'),
+            ('v_taxon_cells', 'm', ' SELECT cell_id FROM distribution.v_taxon_distribution;', 'sau'),
+        ]
+        grants = {'distribution.v_taxon_distribution': [('PUBLIC', 'SELECT', False)]}
+        cursor = CatalogCursor(views, grants)
+
+        session = sd_io.Session
+        sd_io.Session = lambda: FakeSession(cursor)
+        try:
+            Rebuild().finish()
+        finally:
+            sd_io.Session = session
+
+        statements = [query for query in cursor.queries if not query.startswith(('SELECT', 'WITH'))]
+        rename = statements.index('ALTER TABLE taxon_distribution RENAME TO taxon_distribution_previous')
+        swap = statements.index('ALTER TABLE taxon_distribution_rebuild RENAME TO taxon_distribution')
+        # dependents first, in the swap's transaction
+        self.assertEqual(statements[rename - 3:rename - 1], [
+            'DROP MATERIALIZED VIEW v_taxon_cells',
+            'DROP VIEW distribution.v_taxon_distribution',
+        ])
+        created = [query for query in statements[swap:] if 'VIEW' in query or query.startswith('GRANT')]
+        self.assertEqual(created, [
+            'CREATE VIEW distribution.v_taxon_distribution AS SELECT a.cell_id FROM taxon_distribution a',
+            'ALTER VIEW distribution.v_taxon_distribution OWNER TO sau',
+            'GRANT SELECT ON distribution.v_taxon_distribution TO PUBLIC',
+            'CREATE MATERIALIZED VIEW v_taxon_cells AS SELECT cell_id FROM distribution.v_taxon_distribution',
+            'ALTER MATERIALIZED VIEW v_taxon_cells OWNER TO sau',
+        ])
+        self.assertLess(statements.index(created[-1]), statements.index('DROP TABLE taxon_distribution_log_rebuild'))
+
+
+def copy_output(rows):
+    """ binary COPY output of (taxon_key, cell_id, relative_abundance) rows """
+    header = sd_io.COPY_SIGNATURE + struct.pack('>ii', 0, 0)
+    body = b''.join(struct.pack('>hiiiiid', 3, 4, key, 4, cell, 8, value) for key, cell, value in rows)
+    return header + body + struct.pack('>h', -1)
+
+
+class FakeCursor():
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.rowcount = 1
+
+    def execute(self, query, parameters=None):
+        pass
+
+    def copy_from(self, f, table, columns):
+        pass
+
+    def mogrify(self, query, parameters):
+        return query.encode()
+
+    def copy_expert(self, query, f):
+        f.write(self.data)
+
+
+class CatalogCursor(FakeCursor):
+    """ records the statements executed, answering the catalog queries of
+    Rebuild.finish with views and their grants """
+
+    def __init__(self, views, grants):
+        super().__init__()
+        self.views = views
+        self.grants = grants
+        self.queries = []
+        self.rows = []
+
+    def execute(self, query, parameters=None):
+        query = ' '.join(query.split())
+        self.queries.append(query)
+        if 'pg_rewrite' in query:
+            self.rows = self.views
+        elif 'aclexplode' in query:
+            self.rows = self.grants.get(parameters[0], [])
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection():
+
+    def __init__(self, cursor=None):
+        # session.connection().connection is the raw connection
+        self.connection = self
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor or FakeCursor()
+
+    def commit(self):
+        pass
+
+
+class FakeSession():
+
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def connection(self):
+        return FakeConnection(self.cursor)
+
+
+class TestLoad(unittest2.TestCase):
+
+    def test_decode_copy(self):
+        keys, cells, values = sd_io.decode_copy(copy_output([(1, 5, .5), (2, 3, .25)]))
+        np.testing.assert_array_equal(keys, [1, 2])
+        np.testing.assert_array_equal(cells, [5, 3])
+        np.testing.assert_array_equal(values, [.5, .25])
+
+        self.assertEqual(len(sd_io.decode_copy(copy_output([]))[0]), 0)
+        with self.assertRaises(ValueError):
+            sd_io.decode_copy(b'taxon_key\tcell_id\n')
+
+    def test_query_rows(self):
+        rows = [(7, 10, .1), (3, 2, .2), (7, 1, .3), (3, 720 * 360, .4)]
+        found = sd_io._query_rows(FakeCursor(copy_output(rows)), 'taxon_distribution', [3, 7, 9])
+
+        self.assertEqual(sorted(found), [3, 7])
+        distribution = sparse.unpack(found[7])
+        self.assertEqual(distribution.shape, (360, 720))
+        np.testing.assert_array_equal(distribution.compressed(), [.3, .1])
+        self.assertEqual(distribution[0, 9], .1)
+        self.assertEqual(sparse.unpack(found[3])[-1, -1], .4)
+
+    def test_invalid_table(self):
+        with self.assertRaises(ValueError):
+            sd_io.load_distribution(1, table='taxon_distribution; DROP TABLE taxon')
+
+    def test_save_evicts(self):
+        session = sd_io.Session
+        sd_io.Session = FakeSession
+        distribution = np.ma.masked_less(np.random.random((360, 720)), .5)
+        try:
+            sd_io.LOADED.put(('taxon_distribution', 1), 'old')
+            sd_io.save_database(distribution, 1)
+            self.assertIsNone(sd_io.LOADED.get(('taxon_distribution', 1)))
+
+            sd_io.LOADED.put(('taxon_distribution_blob', 1), 'old')
+            sd_io.save_blob(distribution, 1)
+            self.assertIsNone(sd_io.LOADED.get(('taxon_distribution_blob', 1)))
+        finally:
+            sd_io.Session = session
@@ -0,0 +1,24 @@
+import pickle
+import unittest2
+
+import numpy as np
+
+from species_distribution import sparse
+
+
+class TestSparse(unittest2.TestCase):
+
+    def test_round_trip(self):
+        matrix = np.ma.masked_less(np.random.random((36, 72)), .8)
+        matrix[0, 0] = np.nan
+        matrix.mask[0, 0] = False
+
+        payload = pickle.loads(pickle.dumps(sparse.pack(matrix)))
+        unpacked = sparse.unpack(payload)
+
+        np.testing.assert_array_equal(unpacked.mask, matrix.mask)
+        np.testing.assert_array_equal(unpacked.compressed(), matrix.compressed())
+        self.assertLess(len(pickle.dumps(payload)), len(pickle.dumps(matrix)) / 2)
+
+    def test_none(self):
+        self.assertIsNone(sparse.unpack(sparse.pack(None)))
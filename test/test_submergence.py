@@ -1,6 +1,9 @@
 import unittest2
 
+import numpy as np
+
 import species_distribution.filters as filters
+from species_distribution.filters.submergence import fit_parabola_coefficients, parabola_profiles
 
 
 class TestHabitat(unittest2.TestCase):
@@ -57,3 +60,25 @@ class TestHabitat(unittest2.TestCase):
         lat_south = 20
         upper_f, lower_f = submergence_filter.fit_parabolas(min_depth, max_depth, lat_north, lat_south)
         self.assertAlmostEqual(upper_f(0), -86.3, places=1)
+
+    def test_batch_parabola_fit(self):
+        # fitting many taxa at once matches fitting them one at a time
+        taxa = (
+            (-1, -10, 10, -10),
+            (-1, -300, 90, -90),
+            (-200, -1500, -23, -67),
+            (-10, -50, 65, 14),
+            (-69, -108, 45, 20),
+        )
+        p_high, p_low = fit_parabola_coefficients(*zip(*taxa))
+        self.assertEqual(p_high.shape, (len(taxa), 3))
+
+        latitudes = np.arange(-60, 61, 10)
+        for i, taxon in enumerate(taxa):
+            one_high, one_low = fit_parabola_coefficients(*taxon)
+            np.testing.assert_allclose(np.polyval(one_high[0], latitudes), np.polyval(p_high[i], latitudes))
+            np.testing.assert_allclose(np.polyval(one_low[0], latitudes), np.polyval(p_low[i], latitudes))
+
+    def test_parabola_profiles_constant_poleward_of_60(self):
+        profiles = parabola_profiles([[1, 0, 0], [0, 1, 0]], np.array([90, 60, 0, -75]))
+        np.testing.assert_array_equal(profiles, [[3600, 3600, 0, 3600], [60, 60, 0, -60]])
@@ -0,0 +1,55 @@
+import os
+import time
+import unittest2
+
+import numpy as np
+
+from species_distribution.ledger import FAILED, TIMEOUT
+from species_distribution.supervisor import Supervisor, DONE, report_stage
+
+
+def task(key):
+    report_stage('stage {}'.format(key))
+    if key == 'slow':
+        time.sleep(60)
+    elif key == 'raise':
+        raise ValueError('bad taxon')
+    elif key == 'exit':
+        os._exit(3)
+    elif key == 'huge':
+        return np.ones(2 ** 31).sum()
+    return key * 2
+
+
+class TestSupervisor(unittest2.TestCase):
+
+    def run_keys(self, keys, **kwargs):
+        results = Supervisor(task, **kwargs).run(keys)
+        return {key: (state, result) for key, state, result in results}
+
+    def test_done(self):
+        results = self.run_keys([1, 2, 3], processes=2)
+        self.assertEqual(results, {1: (DONE, 2), 2: (DONE, 4), 3: (DONE, 6)})
+
+    def test_timeout(self):
+        started = time.time()
+        results = self.run_keys(['slow', 1, 2], processes=2, timeout=1)
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(results['slow'][0], TIMEOUT)
+        self.assertIn('stage slow', results['slow'][1])
+        self.assertEqual(results[2], (DONE, 4))
+
+    def test_failures(self):
+        results = self.run_keys(['raise', 'exit', 1], processes=1)
+        self.assertEqual(results['raise'][0], FAILED)
+        self.assertIn('bad taxon', results['raise'][1])
+        self.assertEqual(results['exit'][0], FAILED)
+        self.assertIn('stage exit', results['exit'][1])
+        # the dead worker was replaced
+        self.assertEqual(results[1], (DONE, 2))
+
+    def test_memory_limit(self):
+        results = self.run_keys(['huge', 1], memory_limit=2 ** 30)
+        self.assertEqual(results['huge'][0], FAILED)
+        self.assertIn('MemoryError', results['huge'][1])
+        self.assertEqual(results[1], (DONE, 2))
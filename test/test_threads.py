@@ -0,0 +1,68 @@
+import threading
+
+import unittest2
+
+import numpy as np
+
+from species_distribution import settings
+from species_distribution import threads
+from species_distribution.filters.habitat import conical_frustum_kernel
+from species_distribution.kernel import RESERVED_RADIUS
+
+from .test_kernel import mgrid_kernel
+
+
+class TestThreads(unittest2.TestCase):
+
+    def setUp(self):
+        self.threads = settings.THREADS
+
+    def tearDown(self):
+        settings.THREADS = self.threads
+
+    def test_without_threads(self):
+        settings.THREADS = 0
+        names = threads.map(lambda x: threading.current_thread().name, range(3))
+        self.assertEqual(set(names), {threading.current_thread().name})
+
+    def test_order_kept(self):
+        settings.THREADS = 4
+        self.assertEqual(threads.map(lambda x: x * x, range(20)), [x * x for x in range(20)])
+
+    def test_nested(self):
+        # more outer tasks than threads, each waiting on inner tasks
+        settings.THREADS = 2
+        result = threads.map(lambda x: sum(threads.map(lambda y: x * y, range(3))), range(4))
+        self.assertEqual(result, [0, 3, 6, 9])
+
+    def test_exception_raised(self):
+        settings.THREADS = 2
+
+        def f(x):
+            if x == 1:
+                raise ValueError(x)
+            return x
+
+        with self.assertRaises(ValueError):
+            threads.map(f, range(3))
+
+    def test_numpy_errors_follow(self):
+        settings.THREADS = 2
+        with np.errstate(divide='raise'):
+            with self.assertRaises(FloatingPointError):
+                threads.map(lambda x: np.float64(x) / 0, range(2))
+
+    def test_habitat_kernels_growing_the_bank(self):
+        # habitats map over threads, some needing kernels past the reserved field
+        settings.THREADS = 4
+        radii = [(RESERVED_RADIUS + r, r) for r in range(-8, 40, 4)]
+
+        def matches(radii):
+            kernel = conical_frustum_kernel(*radii)
+            expected = mgrid_kernel(*map(float, radii))
+            return (
+                np.array_equal(kernel.mask, expected.mask)
+                and np.array_equal(kernel.compressed(), expected.compressed())
+            )
+
+        self.assertTrue(all(threads.map(matches, radii)))
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import tempfile
+import unittest2
+
+import numpy as np
+
+from species_distribution import tiles
+
+
+class TestTiles(unittest2.TestCase):
+
+    def test_tile_cells_world(self):
+        rows, row_stop, cols, col_stop = tiles.tile_cells((360, 720), 0, 0, 0)
+        self.assertEqual(cols[0], 0)
+        self.assertEqual(col_stop, 720)
+        # web mercator stops short of the poles
+        self.assertTrue(rows[0] > 0)
+        self.assertTrue(row_stop < 360)
+        self.assertEqual(rows[0], 360 - row_stop)
+
+    def test_tiles_skips_empty(self):
+        distribution = np.ma.MaskedArray(data=np.zeros((360, 720)), mask=True)
+        # a single cell just east of the antimeridian, north of the equator
+        distribution[170, 0] = 1
+
+        result = list(tiles.tiles(distribution, zooms=(0, 1)))
+        self.assertEqual([(z, x, y) for z, x, y, _ in result], [(0, 0, 0), (1, 0, 0)])
+        self.assertEqual(result[0][3].shape, (256, 256))
+
+    def test_tiles_empty_distribution(self):
+        distribution = np.ma.MaskedArray(data=np.zeros((360, 720)), mask=True)
+        self.assertEqual(list(tiles.tiles(distribution, zooms=(0, 1, 2))), [])
+
+    def test_mbtiles_writer(self):
+        distribution = np.ma.MaskedArray(data=np.full((360, 720), .5), mask=False)
+        with tempfile.TemporaryDirectory() as d:
+            fname = os.path.join(d, 'test.mbtiles')
+            count = tiles.export_distribution(distribution, tiles.MBTilesWriter(fname), zooms=(0, 1))
+            self.assertEqual(count, 5)
+
+            connection = sqlite3.connect(fname)
+            rows = connection.execute('SELECT zoom_level, tile_column, tile_row FROM tiles ORDER BY 1, 2, 3').fetchall()
+            self.assertEqual(rows[0], (0, 0, 0))
+            self.assertEqual(len(rows), 5)
+            metadata = dict(connection.execute('SELECT name, value FROM metadata'))
+            self.assertEqual(metadata['maxzoom'], '1')
+            connection.close()
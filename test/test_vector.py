@@ -0,0 +1,151 @@
+from collections import namedtuple
+import importlib
+import unittest2
+
+import numpy as np
+
+from species_distribution import distribution
+from species_distribution import vector
+from species_distribution import filters
+from species_distribution.filters.latitude import latitude_profiles
+from species_distribution.models.taxa import Taxon, TaxonHabitat
+
+# the filters package names its filter classes after their modules
+fao_module = importlib.import_module('species_distribution.filters.fao')
+filter_module = importlib.import_module('species_distribution.filters.filter')
+
+Habitat = namedtuple('Habitat', 'taxon_key lat_north lat_south min_depth max_depth intertidal offshore')
+FakeTaxon = namedtuple('FakeTaxon', 'taxon_key pelagic')
+
+
+class FakeGrid():
+    """ a 5 degree grid of integer depths """
+
+    def __init__(self):
+        rng = np.random.RandomState(0)
+        self.shape = (36, 72)
+        self.latitude = np.repeat(np.arange(87.5, -90, -5)[:, np.newaxis], 72, axis=1)
+        ele_avg = rng.randint(-400, 10, self.shape).astype(float)
+        self.grids = {
+            'ele_avg': ele_avg,
+            'ele_min': ele_avg - rng.randint(0, 200, self.shape),
+            'percent_water': np.where(rng.rand(*self.shape) < .2, rng.rand(*self.shape) * 100, 100),
+        }
+
+    def get_grid(self, field):
+        return self.grids[field]
+
+
+class FakeQuery():
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *args):
+        return self.rows.values()
+
+    def get(self, key):
+        return self.rows[key]
+
+
+class FakeSession():
+
+    def __init__(self, taxa, habitats):
+        self.rows = {Taxon: taxa, TaxonHabitat: habitats}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def query(self, model):
+        return FakeQuery(self.rows[model])
+
+
+class TestVector(unittest2.TestCase):
+
+    def test_combine_probability_stacks(self):
+        # combining stacks matches combining each taxon's matrices
+        rng = np.random.RandomState(0)
+        shape = (3, 4, 5)
+        stacks = [
+            vector._stack(rng.rand(*shape), rng.rand(*shape) < .3),
+            vector._stack(rng.rand(*shape), rng.rand(*shape) < .3, np.array([True, False, True])),
+        ]
+        result = vector.combine_probability_stacks(stacks)
+
+        for k in range(shape[0]):
+            matrices = [stack[k] for stack, active in stacks if active[k]]
+            expected = distribution.combine_probability_matrices(matrices)
+            np.testing.assert_array_equal(result[k].mask, expected.mask)
+            np.testing.assert_allclose(result[k].filled(0), expected.filled(0))
+
+    def test_latitude_stack(self):
+        latitudes = np.arange(89.75, -90, -.5)
+        stack, active = vector.latitude_stack([40, 10], [20, -10], latitudes, (360, 720))
+        self.assertEqual(stack.shape, (2, 360, 720))
+        self.assertTrue(active.all())
+        np.testing.assert_array_equal(stack[1, :, 100], latitude_profiles(10, -10, latitudes)[0])
+
+    def test_depth_stack(self):
+        world_depth = np.array([[-5, -20, -50, -200]], dtype=float)
+        stack, active = vector.depth_stack([10, 10], [100, 100], [False, True], world_depth)
+
+        self.assertTrue(active[0])
+        self.assertFalse(active[1])
+        # shallower than the taxon, masked
+        self.assertTrue(stack.mask[0, 0, 0])
+        # deeper than the taxon
+        self.assertEqual(stack[0, 0, 3], 1)
+        self.assertTrue(0 < stack[0, 0, 1] < stack[0, 0, 2] < 1)
+
+    def test_fao_stack(self):
+        cells = [(1, 0, 0, .5), (3, 1, 1, 1.0)]
+        stack, active = vector.fao_stack([1, 2, 3], cells, (2, 2))
+        np.testing.assert_array_equal(active, [True, False, True])
+        self.assertEqual(stack[0, 0, 0], .5)
+        self.assertEqual(stack[2].count(), 1)
+
+    def test_create_cheap_distributions(self):
+        # each taxon's slice matches combining its fao, latitude, depth and submergence filters
+        grid = FakeGrid()
+        habitats = {
+            1: Habitat(1, 40, -20, 10, 200, False, 1),
+            2: Habitat(2, 10, -50, 0, 150, False, 1),
+            3: Habitat(3, 70, 20, 5, 80, True, 0),
+        }
+        taxa = {key: FakeTaxon(key, key == 2) for key in habitats}
+        session = FakeSession(taxa, habitats)
+        rng = np.random.RandomState(1)
+        cells = [
+            (key, row, col, rng.rand())
+            for key in habitats for row in range(36) for col in range(72) if rng.rand() < .7
+        ]
+
+        patched = [
+            (vector, 'Grid', lambda: grid),
+            (vector, 'Session', lambda: session),
+            (vector, 'fao_cells_for_taxa', lambda keys: cells),
+            (fao_module, 'fao_cells_for_taxon', lambda key: [cell[1:] for cell in cells if cell[0] == key]),
+            (filter_module, 'Grid', lambda: grid),
+        ]
+        originals = [(module, name, getattr(module, name)) for module, name, _ in patched]
+        try:
+            for module, name, value in patched:
+                setattr(module, name, value)
+
+            result = vector.create_cheap_distributions([1, 2, 3])
+            self.assertEqual(result.shape, (3, 36, 72))
+            for k, key in enumerate([1, 2, 3]):
+                matrices = [
+                    f()._filter(taxon=taxa[key], session=session)
+                    for f in (filters.fao, filters.latitude, filters.depth, filters.submergence)
+                ]
+                expected = distribution.combine_probability_matrices([m for m in matrices if m is not None])
+                self.assertGreater(expected.count(), 0)
+                np.testing.assert_array_equal(result[k].mask, expected.mask)
+                np.testing.assert_allclose(result[k].filled(0), expected.filled(0))
+        finally:
+            for module, name, value in originals:
+                setattr(module, name, value)
@@ -0,0 +1,52 @@
+import unittest2
+
+import numpy as np
+
+from species_distribution.window import Window
+
+
+class TestWindow(unittest2.TestCase):
+
+    def test_around(self):
+        cells = np.zeros((10, 20), dtype=bool)
+        cells[2, 5] = cells[4, 8] = True
+        window = Window.around(cells, bottom=2, right=3)
+        self.assertEqual((window.top, window.bottom), (2, 7))
+        np.testing.assert_array_equal(window.columns, np.arange(5, 12))
+
+    def test_around_antimeridian(self):
+        cells = np.zeros((10, 20), dtype=bool)
+        cells[3, 18] = cells[3, 1] = True
+        window = Window.around(cells, left=1)
+        np.testing.assert_array_equal(window.columns, [17, 18, 19, 0, 1])
+        self.assertFalse(window.full_width)
+
+    def test_around_padding_covers_grid(self):
+        cells = np.zeros((10, 20), dtype=bool)
+        cells[3, 0] = cells[3, 10] = True
+        window = Window.around(cells, right=15)
+        self.assertTrue(window.full_width)
+        self.assertEqual(window.left, 0)
+
+    def test_crop_embed(self):
+        a = np.ma.MaskedArray(data=np.arange(200.).reshape(10, 20), mask=False)
+        window = Window(a.shape, 2, 4, 18, 4)
+        cropped = window.crop(a)
+        np.testing.assert_array_equal(cropped[0], [58, 59, 40, 41])
+
+        out = np.ma.MaskedArray(data=np.zeros(a.shape), mask=True)
+        window.embed(cropped, out)
+        self.assertEqual(out.count(), 8)
+        self.assertEqual(out[3, 1], a[3, 1])
+
+    def test_crop_into(self):
+        a = np.arange(200.).reshape(10, 20)
+        for window in (Window(a.shape, 2, 4, 18, 4), Window(a.shape, 0, 10, 3, 5), Window.full(a.shape)):
+            out = np.empty(window.shape)
+            self.assertIs(window.crop(a, out=out), out)
+            np.testing.assert_array_equal(out, window.crop(a))
+
+    def test_scale(self):
+        window = Window((10, 20), 2, 4, 18, 4).scale(10)
+        self.assertEqual(window.shape, (20, 40))
+        self.assertEqual(window.local_column(5), 25)